@@ -7,7 +7,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
 from message_numbers import EVAL_SIM_TAG 
 from message_numbers import EVAL_GEN_TAG 
 
-def give_sim_work_first(active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_test, gen_info):
+def give_sim_work_first(active_w, idle_w, hist, sim_specs, gen_specs, term_test, gen_info):
     """ 
     Decide what should be given to workers. This allocation function gives any
     available simulation work first, and only when all simulations are
@@ -17,17 +17,24 @@ def give_sim_work_first(active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_t
     note: everything put into the Work dictionary will be given, so be
     careful not to put more gen or sim items into Work than necessary.
 
+    If sim_specs['batch_efficiency'] is set, each sim call gets a batch of
+    the next ready points (see sim_batch_size), rather than one point.
+
     Parameters
     -----------
     active_w: set
         Active worker ranks
 
     idle_w: set
-        Idle worker ranks
-
-    H: numpy structured array
+        Worker ranks with a free slot. With alloc_specs['queue_depth'] > 1,
+        this includes workers running sims (active_w['slots'] holds what is
+        queued on each worker). Those can be given more sim work, which they
+        start once their current work returns.
 
-    H_ind: integer 
+    hist: History
+        The History array (hist.H), the number of points in it (hist.index)
+        and the points that are ready to be given out (hist.ready, and
+        hist.priority if H has a priority field)
 
     sim_specs: dictionary
 
@@ -49,13 +56,21 @@ def give_sim_work_first(active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_t
 
     Work = {}
     gen_count = 0
-    already_in_Work = np.zeros(H_ind,dtype=bool) # To mark points as they are included in Work, but not yet marked as 'given' in H.
+    H, H_ind = hist.H, hist.index
 
     if len(gen_info) == 0: 
         gen_info[0] = {}
         gen_info[0]['rand_stream'] = {i:np.random.RandomState(i) for i in idle_w}
 
-    for i in idle_w:
+    # Workers with nothing queued get work first, and only they are given gen
+    # work or have their resources used by multi-node sims
+    slots = active_w['slots'] if 'slots' in active_w else {}
+    empty_w = set(i for i in idle_w if not slots.get(i))
+
+    batch = sim_batch_size(hist, sim_specs, len(idle_w))
+    given_in_Work = 0
+
+    for i in sorted(idle_w, key=lambda i: len(slots.get(i, []))):
         if term_test(H, H_ind):
             break
 
@@ -64,29 +79,49 @@ def give_sim_work_first(active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_t
         if i in blocked_set:
             continue
 
-        # Find indices of H where that are not given nor paused
-        q_inds_logical = np.logical_and.reduce((~H['given'][:H_ind],~H['paused'][:H_ind],~already_in_Work))
+        # Oldest point that is not given nor paused (nor already in Work)
+        first_ready = hist.ready.next(H)
 
-        if np.any(q_inds_logical):
+        if len(first_ready):
             # Give sim work if possible
 
+            # Rows for this sim call (no more than sim_max allows)
+            k = int(max(1, min(batch, hist.given_max - hist.given_count - given_in_Work)))
+
             if 'priority' in H.dtype.fields:
                 if 'give_all_with_same_priority' in gen_specs and gen_specs['give_all_with_same_priority']:
-                    # Give all points with highest priority
-                    q_inds = H['priority'][:H_ind][q_inds_logical] == np.max(H['priority'][:H_ind][q_inds_logical])
-                    sim_ids_to_send = np.nonzero(q_inds_logical)[0][q_inds]
+                    # Give all points with highest priority (that share the
+                    # first one's state_key, as one sim call's rows must)
+                    sim_ids_to_send = hist.priority.top_all(H)
+                    if 'state_key' in sim_specs:
+                        keys = H[sim_specs['state_key']][sim_ids_to_send]
+                        sim_ids_to_send = sim_ids_to_send[keys == keys[0]]
                 else:
                     # Give first point with highest priority
-                    sim_ids_to_send = np.nonzero(q_inds_logical)[0][np.argmax(H['priority'][:H_ind][q_inds_logical])]
+                    sim_ids_to_send = hist.priority.top(H)
+
+                    if k > 1 and batchable(H, [sim_ids_to_send], sim_specs)[0]:
+                        # And the next highest, while they can be batched
+                        sim_ids_to_send = take_top_batch(hist, H, k, sim_specs)
             else:
-                # Give oldest point
-                sim_ids_to_send = np.nonzero(q_inds_logical)[0][0]
+                # Give oldest point(s)
+                sim_ids_to_send = first_ready
+                if k > 1:
+                    sim_ids_to_send = batch_prefix(H, hist.ready.next(H, k), sim_specs)
+
+                if 'state_key' in sim_specs and i in active_w['sim_state']:
+                    # Prefer (one of the next few) points for the state the
+                    # worker's persistent sim already holds
+                    window = hist.ready.next(H, sim_specs.get('affinity_window', 100))
+                    match = window[H[sim_specs['state_key']][window] == active_w['sim_state'][i]]
+                    if len(match):
+                        sim_ids_to_send = batch_prefix(H, match[:k], sim_specs)
 
             sim_ids_to_send = np.atleast_1d(sim_ids_to_send)
 
             # Only give work if enough idle workers
             if 'num_nodes' in H.dtype.names and np.any(H[sim_ids_to_send]['num_nodes'] > 1):
-                if np.any(H[sim_ids_to_send]['num_nodes'] > len(idle_w) - len(Work) - len(blocked_set)):
+                if i not in empty_w or np.any(H[sim_ids_to_send]['num_nodes'] > len(empty_w - set(Work) - blocked_set)):
                     # Worker i doesn't get any work. Just waiting for other resources to open up
                     continue
                 block_others = True
@@ -99,18 +134,23 @@ def give_sim_work_first(active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_t
                        'libE_info': {'H_rows': sim_ids_to_send,
                                 },
                       }
-            already_in_Work[sim_ids_to_send] = True
+            # Points in Work will be given, so they are no longer ready
+            hist.take(sim_ids_to_send)
+            given_in_Work += len(sim_ids_to_send)
 
             if block_others:
-                unassigned_workers = idle_w - set(Work.keys()) - blocked_set
+                unassigned_workers = empty_w - set(Work.keys()) - blocked_set
                 workers_to_block = list(unassigned_workers)[:np.max(H[sim_ids_to_send]['num_nodes'])-1]
                 Work[i]['libE_info']['blocking'] = set(workers_to_block)
 
         else:
             # Since there is no sim work to give, give gen work. 
 
+            if i not in empty_w:
+                continue
+
             # Limit number of gen instances if given
-            if 'num_inst' in gen_specs and len(active_w[EVAL_GEN_TAG]) + gen_count >= gen_specs['num_inst']:
+            if 'num_inst' in gen_specs and len(active_w[EVAL_GEN_TAG]) + len(active_w['persis_gen']) + gen_count >= gen_specs['num_inst']:
                 break
 
             # Don't give out any gen instances if in batch mode and any point has not been returned or paused
@@ -128,5 +168,77 @@ def give_sim_work_first(active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_t
                                 }
                        }
 
+            if 'persistent' in gen_specs and gen_specs['persistent']:
+                # The gen stays resident, receiving sim output as it returns
+                Work[i]['libE_info']['persistent'] = True
+
     return Work, gen_info
 
+
+def sim_batch_size(hist, sim_specs, num_idle):
+    """
+    Number of points to give in each sim call, so workers spend a fraction
+    sim_specs['batch_efficiency'] of their time evaluating sims.
+
+    With t the measured sim time per point and o the time a worker waits
+    for work after returning output (hist.sim_row_time and
+    hist.sim_overhead), a call with k points keeps the worker busy for a
+    fraction k*t/(k*t + o). The smallest k reaching the target is used, at
+    most sim_specs['max_batch'], and the ready points are split evenly over
+    the idle workers. Returns 1 until the times have been measured.
+    """
+    if 'batch_efficiency' not in sim_specs or hist.sim_row_time is None or hist.sim_overhead is None:
+        return 1
+
+    e = sim_specs['batch_efficiency']
+    k = int(np.ceil(e/(1-e)*hist.sim_overhead/max(hist.sim_row_time, 1e-12)))
+    k = min(k, sim_specs.get('max_batch', k))
+
+    if k > 1 and num_idle:
+        num_ready = len(hist.ready.next(hist.H, k*num_idle))
+        k = min(k, int(np.ceil(num_ready/num_idle)))
+
+    return max(k, 1)
+
+
+def batchable(H, rows, sim_specs):
+    """
+    Marks the rows that can be evaluated in one sim call with rows[0]: those
+    using a single node (if H has a num_nodes field) and with the same
+    state_key (if sim_specs has one)
+    """
+    ok = np.ones(len(rows), dtype=bool)
+    if 'num_nodes' in H.dtype.names:
+        ok &= H['num_nodes'][rows] <= 1
+    if 'state_key' in sim_specs:
+        ok &= H[sim_specs['state_key']][rows] == H[sim_specs['state_key']][rows[0]]
+
+    return ok
+
+
+def batch_prefix(H, rows, sim_specs):
+    """
+    The first of rows and those after it up to the first that can't be
+    batched with it
+    """
+    ok = batchable(H, rows, sim_specs)
+    ok[0] = True
+    n = len(rows) if np.all(ok) else np.argmin(ok)
+
+    return rows[:n]
+
+
+def take_top_batch(hist, H, k, sim_specs):
+    """
+    Takes up to k of the highest priority rows, in order, stopping at the
+    first that can't be batched with the top row
+    """
+    rows = []
+    while len(rows) < k:
+        row = hist.priority.top(H)
+        if row is None or (rows and not batchable(H, [rows[0], row], sim_specs)[1]):
+            break
+        hist.take(row)
+        rows.append(row)
+
+    return np.array(rows, dtype=int)
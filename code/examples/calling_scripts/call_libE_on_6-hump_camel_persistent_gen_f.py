@@ -3,8 +3,9 @@
 #    https://www.sfu.ca/~ssurjano/camel6.html 
 # 
 # Execute via the following command:
-#    mpiexec -np 4 python3 call_libE_on_GKLS.py
-# The number of concurrent evaluations of the objective function will be 4-1=3.
+#    mpiexec -np 4 python3 call_libE_on_6-hump_camel_persistent_gen_f.py
+# One worker runs the persistent gen, so the number of concurrent evaluations
+# of the objective function will be 4-2=2.
 # """
 
 from __future__ import division
@@ -19,8 +20,8 @@ from libE import libE
 
 from message_numbers import STOP_TAG 
 
-def six_hump_camel(H, sim_out, obj_params):
-    O = np.zeros(1,dtype=sim_out)
+def six_hump_camel(H, gen_info, sim_specs, libE_info):
+    O = np.zeros(1,dtype=sim_specs['out'])
 
     # x1 = H['x'][i][0]
     # x2 = H['x'][i][1]
@@ -33,28 +34,32 @@ def six_hump_camel(H, sim_out, obj_params):
     # v = np.random.uniform(0,10)
     # print('About to sleep for :' + str(v))
     # time.sleep(v)
-    O['f'] = 0.5*sum(H['x']*H['x'])
+    O['f'] = 0.5*np.sum(H['x']*H['x'])
     O['grad'] = H['x']
-    O['Hess_inv'] = np.eye(len(H['x']))
+    O['Hess_inv'] = np.eye(H['x'].shape[1])
     
-    return O
+    return O, gen_info
 
-def persistent_Newton(g_in,gen_out,params,info):
-    import ipdb; ipdb.set_trace()
-    x = params['x0']
+def persistent_Newton(H, gen_info, gen_specs, libE_info):
+    """
+    Takes a Newton step from each point as its evaluation is streamed back,
+    until the manager stops the run.
+    """
+    comm = libE_info['comm']
+
+    O = np.zeros(1, dtype=gen_specs['out'])
+    O['x'] = gen_specs['x0']
+    O['priority'] = 1
 
     while 1:
-        D = comm.recv(buf=None, source=0, tag=MPI.ANY_TAG, status=status)
-        if status.Get_tag() == STOP_TAG: break
-                
-        x = x - g_in['Hess_inv']*g_in['grad']
+        comm.send(O)
 
-        O = np.zeros(1, dtype=gen_out)
-        O['x'] = x
-        O['priority'] = 1
+        tag, libE_info, g_in = comm.recv()
+        if tag == STOP_TAG: break
+                
+        O['x'] = O['x'] - np.dot(g_in['Hess_inv'][0], g_in['grad'][0])
 
-    print(O)
-    return O
+    return O, gen_info
 
 n = 2
 
@@ -65,7 +70,6 @@ sim_specs = {'sim_f': [six_hump_camel], # This is the function whose output is b
                      ('grad',float,n),
                      ('Hess_inv',float,(n,n))
                     ],
-             'x0': np.array([1, 2]),
              }
 
 # State the generating function, its arguments, output, and necessary parameters.
@@ -74,6 +78,7 @@ gen_specs = {'gen_f': persistent_Newton,
              'out': [('x',float,n),
                      ('priority',float),
                     ],
+             'x0': np.array([1, 2]),
              'num_inst': 1,
              'persistent': True,
              }
@@ -84,7 +89,7 @@ exit_criteria = {'sim_max': 10}
 np.random.seed(1)
 
 # Perform the run
-H = libE(sim_specs, gen_specs, exit_criteria)
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria)
 
 if MPI.COMM_WORLD.Get_rank() == 0:
     filename = '6-hump_camel_results_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_ranks=' + str(MPI.COMM_WORLD.Get_size())
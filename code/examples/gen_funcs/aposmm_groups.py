@@ -0,0 +1,214 @@
+"""
+Rows of H grouped by pt_id, for APOSMM and its queue_update_function when
+one component of each point is evaluated at a time (the rows of a point
+share its pt_id), and the (possibly partial) combined values of the points
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+
+
+class PtIdGroups(object):
+    """
+    The rows of H with each pt_id, in CSR form: the rows of group g (with
+    pt_id ids[g]) are rows[offsets[g]:offsets[g+1]], in increasing order.
+    Also counts the returned rows of each group.
+
+    update adds the rows H has gained since the last update. Rows for new
+    pt_ids (larger than any before, as APOSMM and the samplers give them)
+    are appended to the groups, otherwise the groups are built again.
+
+    Attributes
+    ----------
+    ids: numpy array
+        The pt_ids, in increasing order
+
+    group: numpy array
+        Group of each row
+
+    num_returned: numpy array
+        Number of returned rows in each group
+
+    changed: numpy array
+        Groups with rows added or returned by the last update
+    """
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=int)
+        self.offsets = np.zeros(1, dtype=int)
+        self.rows = np.zeros(0, dtype=int)
+        self.group = np.zeros(0, dtype=int)
+        self.num_returned = np.zeros(0, dtype=int)
+        self.pending = np.zeros(0, dtype=int) # Rows not yet returned
+        self.changed = np.zeros(0, dtype=int)
+        self.rebuilt = True
+
+    def update(self, H):
+        """
+        Adds new rows of H and counts rows that have since been returned.
+        Sets changed to the groups with new or newly returned rows, and
+        rebuilt to whether the groups were (re)numbered from scratch
+        """
+        old = len(self.group)
+        self.rebuilt = old == 0
+        if len(H) > old:
+            new_ids = H['pt_id'][old:]
+            if len(self.ids) and np.min(new_ids) <= self.ids[-1]:
+                self.build(H)
+                old = 0
+                self.rebuilt = True
+            else:
+                self.append(new_ids, old)
+                self.pending = np.append(self.pending, np.arange(old, len(H)))
+
+        returned = H['returned'][self.pending]
+        np.add.at(self.num_returned, self.group[self.pending[returned]], 1)
+        self.changed = np.unique(np.append(self.group[old:], self.group[self.pending[returned]]))
+        self.pending = self.pending[~returned]
+
+    def append(self, new_ids, first_row):
+        """
+        Adds groups for the rows from first_row (with pt_ids new_ids, all
+        larger than the current pt_ids)
+        """
+        order = np.argsort(new_ids, kind='mergesort')
+        ids, starts = np.unique(new_ids[order], return_index=True)
+
+        self.group = np.append(self.group, len(self.ids) + np.searchsorted(ids, new_ids))
+        self.offsets = np.append(self.offsets, len(self.rows) + np.append(starts[1:], len(new_ids)))
+        self.rows = np.append(self.rows, first_row + order)
+        self.ids = np.append(self.ids, ids)
+        self.num_returned = np.append(self.num_returned, np.zeros(len(ids), dtype=int))
+
+    def build(self, H):
+        """
+        Groups every row of H
+        """
+        self.__init__()
+        self.append(H['pt_id'], 0)
+        self.pending = np.arange(len(H))
+
+    def matches(self, H):
+        """
+        Whether the rows are the first rows of H: they have the same pt_ids,
+        and rows counted as returned are returned in H
+        """
+        n = len(self.group)
+        if n > len(H) or not np.array_equal(self.ids[self.group], H['pt_id'][:n]):
+            return False
+
+        counted = np.ones(n, dtype=bool)
+        counted[self.pending] = False
+        return np.all(H['returned'][:n][counted])
+
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def rows_of(self, g):
+        """
+        The rows of group g
+        """
+        return self.rows[self.offsets[g]:self.offsets[g+1]]
+
+    def groups_of(self, pt_ids):
+        """
+        The groups of pt_ids (which must be in H)
+        """
+        return np.searchsorted(self.ids, pt_ids)
+
+    def complete(self):
+        """
+        Whether every row of each group has been returned
+        """
+        return self.num_returned == self.sizes()
+
+
+def resident_groups(groups, H):
+    """
+    Returns groups (updated for H) if it matches the first rows of H, and
+    otherwise new groups for H
+    """
+    if groups is None or not groups.matches(H):
+        groups = PtIdGroups()
+
+    groups.update(H)
+    return groups
+
+
+class PartialFvals(object):
+    """
+    For each group of a PtIdGroups: whether any f_i is NaN and, given
+    combine_component_func, the combined f_i (with f_i = 0 for rows not yet
+    returned). Also keeps the best combined value of the complete groups
+    without NaNs.
+
+    Only the groups changed by each update of the groups are recomputed.
+
+    Attributes
+    ----------
+    fvals: numpy array
+        Combined, possibly partial, value of each group
+
+    has_nan: numpy array
+        Whether a group has a NaN component
+
+    complete: numpy array
+        Whether a group is completely returned and has no NaN component
+
+    best_complete: float
+        Smallest non-NaN fval of the complete groups (inf if none)
+    """
+
+    def __init__(self, combine_component_func=None):
+        self.combine = combine_component_func
+        self.groups = None
+        self.reset()
+
+    def reset(self):
+        self.fvals = np.zeros(0)
+        self.has_nan = np.zeros(0, dtype=bool)
+        self.complete = np.zeros(0, dtype=bool)
+        self.best_complete = np.inf
+
+    def update(self, H):
+        """
+        Updates the groups for H and then the values of the changed groups.
+        Returns the groups whose standing against best_complete may have
+        changed: the changed groups, or every group if best_complete fell.
+        """
+        groups = resident_groups(self.groups, H)
+        if groups is not self.groups or groups.rebuilt:
+            self.reset()
+        self.groups = groups
+
+        n = len(groups.ids) - len(self.fvals)
+        self.fvals = np.append(self.fvals, np.zeros(n))
+        self.has_nan = np.append(self.has_nan, np.zeros(n, dtype=bool))
+        self.complete = np.append(self.complete, np.zeros(n, dtype=bool))
+
+        changed = groups.changed
+        for g in changed:
+            f_i = H['f_i'][groups.rows_of(g)]
+            self.has_nan[g] = np.any(np.isnan(f_i))
+            if self.combine is not None:
+                self.fvals[g] = self.combine(f_i)
+
+        done = changed[(groups.num_returned[changed] == groups.offsets[changed+1] - groups.offsets[changed]) & ~self.has_nan[changed]]
+        self.complete[done] = True
+
+        best = np.append(self.fvals[done], self.best_complete)
+        best = np.min(best[~np.isnan(best)])
+        if best < self.best_complete:
+            self.best_complete = best
+            return np.arange(len(groups.ids))
+
+        return changed
+
+    def worse(self, gs):
+        """
+        The groups in gs that are not complete and whose (partial) fvals are
+        worse than best_complete
+        """
+        return gs[(self.fvals[gs] > self.best_complete) & ~self.complete[gs]]
@@ -0,0 +1,340 @@
+"""
+Spatial index over the x_on_cube of the evaluated points in APOSMM's
+History, answering the queries behind dist_to_better_l/dist_to_better_s
+(see update_dists_to_better) without computing the distance from each new
+point to every point.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+
+# Levels of rows with an infinite or zero dist_to_better
+INF_LEVEL = 2**30
+NO_LEVEL = -2**30
+
+# Tree queries are widened by this factor, so rounding in the tree's
+# distances can't drop a candidate. Candidates are then checked with cdist.
+SLACK = 1 + 1e-9
+
+# With fewer members than this, the distances from each new point to every
+# member are computed instead (which is faster than searching the trees)
+BRUTE_FORCE_MAX = 20000
+
+
+class PointSet(object):
+    """
+    Rows whose points are in a cKDTree, and rows added since the tree was
+    built (which are searched directly). The tree is rebuilt from the rows
+    for which live(rows) is True once the added rows number a quarter of the
+    rows in the tree, so adding a row costs amortized O(log N).
+    """
+
+    def __init__(self, X, live):
+        self.X = X
+        self.live = live
+        self.rows = np.zeros(0, dtype=int)
+        self.tree = None
+        self.added = []
+
+    def add(self, rows):
+        self.added.extend(rows)
+        if len(self.added) > max(32, len(self.rows)//4):
+            self.rebuild()
+
+    def rebuild(self):
+        rows = np.unique(np.append(self.rows, self.added).astype(int))
+        self.rows = rows[self.live(rows)]
+        self.tree = cKDTree(self.X[self.rows]) if len(self.rows) else None
+        self.added = []
+
+    def all_rows(self):
+        return np.append(self.rows, self.added).astype(int)
+
+    def ball(self, x, r):
+        """
+        Rows within (about) r of x. May include rows a little farther away.
+        """
+        found = [self.rows[np.array(self.tree.query_ball_point(x, r*SLACK), dtype=int)]] if self.tree is not None else []
+        if self.added:
+            added = np.array(self.added, dtype=int)
+            found.append(added[np.sqrt(np.sum((self.X[added] - x)**2, axis=1)) <= r*SLACK])
+
+        return np.concatenate(found) if found else np.zeros(0, dtype=int)
+
+    def nearest(self, x, k):
+        """
+        The k rows in the tree nearest to x and all added rows, and their
+        distances to x (about, as the tree computes them)
+        """
+        rows = [np.array(self.added, dtype=int)]
+        dists = [np.sqrt(np.sum((self.X[rows[0]] - x)**2, axis=1))]
+        if self.tree is not None:
+            d, i = self.tree.query(x, k=min(k, len(self.rows)))
+            rows.append(self.rows[np.atleast_1d(i)])
+            dists.append(np.atleast_1d(d))
+
+        return np.concatenate(rows), np.concatenate(dists)
+
+
+class BetterPointIndex(object):
+    """
+    Index of the points APOSMM has evaluated (the rows in p of
+    update_history_dist), kept between calls to APOSMM.
+
+    Rows are partitioned into local and sample points for nearest-better
+    queries. For the reverse queries (which points is a new point closer to
+    than their nearest better point), rows are also grouped by level, the
+    exponent e with dist_to_better < 2**e, for each of dist_to_better_l and
+    dist_to_better_s. A new point only needs to search each level within
+    2**e of itself. Rows whose dist_to_better falls to a lower level are
+    added there, and their old entry is ignored.
+
+    sync brings the index up to date with H at the start of each call, so
+    it stays correct if H was changed elsewhere (e.g., another worker ran
+    APOSMM). The trees aren't kept until there are BRUTE_FORCE_MAX members.
+    """
+
+    def __init__(self, n):
+        self.X = np.zeros((0, n))
+        self.member = np.zeros(0, dtype=bool)
+        self.members = np.zeros(0, dtype=int)
+        self.in_trees = np.zeros(0, dtype=bool)
+        self.local = np.zeros(0, dtype=bool)
+        self.level = {'l': np.zeros(0, dtype=int), 's': np.zeros(0, dtype=int)}
+
+        self.by_type = {True: PointSet(self.X, self.is_member), False: PointSet(self.X, self.is_member)}
+        self.levels = {'l': {}, 's': {}}
+        self.inf_rows = {'l': [], 's': []}
+
+    def is_member(self, rows):
+        return self.member[rows]
+
+    def grow(self, H):
+        """
+        Makes room for (and copies the points of) the rows of H
+        """
+        old = len(self.X)
+        X = np.zeros((len(H), self.X.shape[1]))
+        X[:old] = self.X
+        X[old:] = H['x_on_cube'][old:]
+
+        self.X = X
+        self.member = np.append(self.member, np.zeros(len(H) - old, dtype=bool))
+        self.in_trees = np.append(self.in_trees, np.zeros(len(H) - old, dtype=bool))
+        self.local = np.append(self.local, H['local_pt'][old:])
+        for t in self.level:
+            self.level[t] = np.append(self.level[t], NO_LEVEL*np.ones(len(H) - old, dtype=int))
+
+        for S in list(self.by_type.values()) + [S for t in self.levels for S in self.levels[t].values()]:
+            S.X = X
+
+    def sync(self, H, p):
+        """
+        Makes the members the rows in p, and places every member at the
+        level of its current dist_to_better_l/dist_to_better_s in H
+        """
+        if len(H) > len(self.X):
+            self.grow(H)
+
+        self.member[:len(p)] = p
+        self.members = np.flatnonzero(p)
+        if not self.use_trees():
+            return
+
+        added = np.flatnonzero(p & ~self.in_trees[:len(p)])
+        removed = np.flatnonzero(~p & self.in_trees[:len(p)])
+        self.in_trees[:len(p)] = p
+        for t in self.level:
+            # So they are placed again if they come back
+            self.level[t][removed] = NO_LEVEL
+        for local in [True, False]:
+            rows = added[self.local[added] == local]
+            if len(rows):
+                self.by_type[local].add(rows)
+
+        for t in self.level:
+            new_level = levels_of(H['dist_to_better_' + t][self.members])
+            self.place(t, self.members, new_level)
+
+    def use_trees(self):
+        return len(self.members) >= BRUTE_FORCE_MAX
+
+    def place(self, t, rows, new_level):
+        """
+        Records that rows are at new_level for dist_to_better_t
+        """
+        moved = new_level != self.level[t][rows]
+        rows, new_level = rows[moved], new_level[moved]
+        self.level[t][rows] = new_level
+
+        self.inf_rows[t].extend(rows[new_level == INF_LEVEL])
+        finite = (new_level != INF_LEVEL) & (new_level != NO_LEVEL)
+        for e in np.unique(new_level[finite]):
+            if e not in self.levels[t]:
+                self.levels[t][e] = PointSet(self.X, lambda r, t=t, e=e: self.member[r] & (self.level[t][r] == e))
+            self.levels[t][e].add(rows[new_level == e])
+
+    def nearest_better(self, H, row, local):
+        """
+        The nearest member other than row that is local (or a sample point)
+        with f no larger than row's, ties broken by the lowest row, and its
+        distance to row (by cdist). Returns None if there is no such member.
+        """
+        S = self.by_type[local]
+        x = self.X[row]
+        f = H['f'][row]
+        better = lambda rows: self.member[rows] & (H['f'][rows] <= f) & (rows != row)
+
+        cand = near_candidates(S, x, better)
+        if cand is None:
+            return None
+
+        cand = np.unique(cand[better(cand)])
+        if not len(cand):
+            return None
+
+        d = cdist(np.atleast_2d(x), self.X[cand], 'euclidean').flatten()
+        i = np.argmin(d)
+        return cand[i], d[i]
+
+    def closer_and_worse(self, H, row, t):
+        """
+        The members with f larger than row's that are closer to row than to
+        their current better point (dist_to_better_t), and their distances
+        to row (by cdist)
+        """
+        x = self.X[row]
+        level = self.level[t]
+
+        inf_rows = np.array(self.inf_rows[t], dtype=int)
+        inf_rows = inf_rows[level[inf_rows] == INF_LEVEL]
+        self.inf_rows[t] = list(inf_rows)
+
+        cand = [inf_rows]
+        for e, S in self.levels[t].items():
+            rows = S.ball(x, 2.0**e)
+            cand.append(rows[level[rows] == e])
+
+        cand = np.unique(np.concatenate(cand))
+
+        cand = cand[self.member[cand] & (H['f'][cand] > H['f'][row])]
+
+        d = cdist(np.atleast_2d(x), self.X[cand], 'euclidean').flatten()
+        closer = d < H['dist_to_better_' + t][cand]
+
+        return cand[closer], d[closer]
+
+
+def resident_index(index, H):
+    """
+    Returns index if its points are the first rows of H, and otherwise a
+    new (empty) index
+    """
+    if index is None or len(index.X) > len(H) or not np.array_equal(index.X, H['x_on_cube'][:len(index.X)]):
+        index = BetterPointIndex(len(H['x_on_cube'][0]))
+
+    return index
+
+
+def near_candidates(S, x, better):
+    """
+    Rows of S that may be the nearest to x for which better(rows) is True:
+    those within (about) the distance to the nearest such row among the k
+    nearest rows, for increasing k. Returns None if there are no such rows.
+    """
+    k = 16
+    while k <= 1024:
+        rows, d = S.nearest(x, k)
+        ok = better(rows)
+        if np.any(ok):
+            return S.ball(x, np.min(d[ok]))
+        if k >= len(S.rows):
+            return None
+        k *= 4
+
+    # Few rows are better, so just check them all
+    return S.all_rows()
+
+
+def levels_of(r):
+    """
+    The level of each dist_to_better in r: the exponent e with r < 2**e
+    (INF_LEVEL if r is infinite and NO_LEVEL if r is 0, when no point can
+    be closer)
+    """
+    level = np.frexp(r)[1]
+    level[np.isinf(r)] = INF_LEVEL
+    level[r == 0] = NO_LEVEL
+
+    return level
+
+
+def update_dists_to_better(H, new_inds, p, index):
+    """
+    For each new point in p (in order), updates the points it is closer to
+    (and better than) than their nearest better local/sample point, and
+    finds its own nearest local and sample points with f no larger than its.
+    Gives the same H as computing the distances from each new point to every
+    point in p with cdist.
+
+    Returns the rows of H whose nearest better point changed.
+    """
+    index.sync(H, p)
+    updated_inds = set()
+
+    for new_ind in new_inds:
+        if not p[new_ind]:
+            continue
+
+        if not index.use_trees():
+            updated_inds.update(update_by_all_dists(H, new_ind, p))
+            continue
+
+        # Update any other points if new_ind is closer and better
+        t = 'l' if H['local_pt'][new_ind] else 's'
+        updates, d = index.closer_and_worse(H, new_ind, t)
+        H['dist_to_better_' + t][updates] = d
+        H['ind_of_better_' + t][updates] = new_ind
+        index.place(t, updates, levels_of(d))
+        updated_inds.update(updates)
+
+        # Who is closest to new_ind and better (or as good)
+        for t, local in [('l', True), ('s', False)]:
+            found = index.nearest_better(H, new_ind, local)
+            if found is not None:
+                H['ind_of_better_' + t][new_ind] = H['sim_id'][found[0]]
+                H['dist_to_better_' + t][new_ind] = found[1]
+                index.place(t, np.array([new_ind]), levels_of(np.array([found[1]])))
+
+    return updated_inds
+
+
+def update_by_all_dists(H, new_ind, p):
+    """
+    Does what update_dists_to_better does for new_ind, from the distances
+    from new_ind to every point in p. Returns the rows updated.
+    """
+    dist_to_all = cdist(np.atleast_2d(H['x_on_cube'][new_ind]), H['x_on_cube'][p], 'euclidean').flatten()
+    new_better_than = H['f'][new_ind] < H['f'][p]
+
+    # Update any other points if new_ind is closer and better
+    t = 'l' if H['local_pt'][new_ind] else 's'
+    inds_of_p = np.logical_and(dist_to_all < H['dist_to_better_' + t][p], new_better_than)
+    updates = np.where(p)[0][inds_of_p]
+    H['dist_to_better_' + t][updates] = dist_to_all[inds_of_p]
+    H['ind_of_better_' + t][updates] = new_ind
+
+    # Since we allow equality when deciding better_than_new, we have to
+    # prevent new_ind from being its own better point.
+    for t, local in [('l', H['local_pt'][p]), ('s', ~H['local_pt'][p])]:
+        better_than_new = np.logical_and.reduce((~new_better_than, local, H['sim_id'][p] != new_ind))
+        if np.any(better_than_new):
+            ind = dist_to_all[better_than_new].argmin()
+            H['ind_of_better_' + t][new_ind] = H['sim_id'][p][np.nonzero(better_than_new)[0][ind]]
+            H['dist_to_better_' + t][new_ind] = dist_to_all[better_than_new][ind]
+
+    return updates
@@ -2,10 +2,10 @@ from __future__ import division
 from __future__ import absolute_import
 
 import sys, os
+import atexit
 import numpy as np
 # import scipy as sp
 from scipy.spatial.distance import cdist
-from mpi4py import MPI
 
 from numpy.lib.recfunctions import merge_arrays
 
@@ -14,6 +14,28 @@ from math import log, gamma, pi, sqrt
 from petsc4py import PETSc
 import nlopt
 
+from aposmm_index import resident_index, update_dists_to_better
+from aposmm_runs import resident_run, RunPool, OptimizerError
+from aposmm_groups import resident_groups, PartialFvals
+
+# Index of the evaluated points for update_history_dist
+better_point_index = None
+
+# The suspended local optimization method of each run (see aposmm_runs.py)
+local_opt_runs = {}
+
+# With c_flag, the rows of H grouped by pt_id (updated by initialize_APOSMM)
+pt_id_groups = None
+
+# With gen_specs['localopt_processes'], the RunPool advancing runs (and the
+# gen_specs and c_flag it was made for)
+localopt_pool = None
+
+# What NLopt and TAO raise when a local optimization method fails (NLopt
+# raises ValueError and RuntimeError, or subclasses of nlopt.exception in
+# newer versions; PETSc.Error is a RuntimeError)
+LOCALOPT_ERRORS = (nlopt.RoundoffLimited, nlopt.ForcedStop, ValueError, RuntimeError) + ((nlopt.exception,) if hasattr(nlopt, 'exception') else ())
+
 def aposmm_logic(H,gen_info,gen_specs,libE_info):
     """
     Receives the following data from H:
@@ -33,6 +55,10 @@ def aposmm_logic(H,gen_info,gen_specs,libE_info):
     - storing the combined objective function value
     - etc
 
+    With gen_specs['localopt_processes'], the active local optimization runs
+    are advanced in parallel on that many processes (NLopt methods only). The
+    new points are added in the same order either way.
+
     """
 
     """
@@ -45,9 +71,7 @@ def aposmm_logic(H,gen_info,gen_specs,libE_info):
     O:                new points to be sent back to the history
                      
                      
-    x_new:            when re-running a local opt method to get the next point: stores the first new point requested by a local optimization method
-    pt_in_run:        when re-running a local opt method to get the next point: counts function evaluations to know when a new point is given
-    total_pts_in_run: when re-running a local opt method to get the next point: total evaluations in run to be incremented
+    x_new:            the next point requested by a local optimization method (all inf if the method finished)
 
     starting_inds:    indices where a runs should be started.
     active_runs:      indices of active local optimization runs (currently saved to disk between calls to APOSMM)
@@ -62,14 +86,16 @@ def aposmm_logic(H,gen_info,gen_specs,libE_info):
 
     n, n_s, c_flag, O, rk_const, lhs_divisions, mu, nu = initialize_APOSMM(H, gen_specs)
 
+    # The worker's rank (not the MPI.COMM_WORLD rank, which is 0 on every
+    # worker with the local backend)
+    rand_stream = gen_info['rand_stream'][libE_info['rank']]
+
     # np.savez('H'+str(len(H)),H=H,gen_specs=gen_specs)
     # import ipdb; ipdb.set_trace()
     if n_s < gen_specs['initial_sample']:
         updated_inds = set() 
 
     else:
-        global x_new, pt_in_run, total_pts_in_run # Used to generate a next local opt point
-
         updated_inds = update_history_dist(H, gen_specs, c_flag)        
 
         starting_inds = decide_where_to_start_localopt(H, n_s, rk_const, lhs_divisions, mu, nu)        
@@ -97,11 +123,28 @@ def aposmm_logic(H,gen_info,gen_specs,libE_info):
                 
         inactive_runs = set()
 
-        for run in gen_info['active_runs']:
+        # Runs are advanced independently (in parallel, with
+        # gen_specs['localopt_processes']), and their new points are added in
+        # this order
+        runs = list(gen_info['active_runs'])
+        if 'localopt_processes' in gen_specs:
+            results, run_order = run_pool(gen_specs, c_flag).advance(H, runs, gen_info['run_order'])
+            gen_info['run_order'].update(run_order)
+            results = [(x_opt, exit_code, gen_info, gen_info['run_order'][run], x_new) for run, (x_opt, exit_code, x_new) in zip(runs, results)]
+        else:
+            results = [advance_localopt_method(H, gen_specs, c_flag, run, gen_info) for run in runs]
+
+        for run, result in zip(runs, results):
             
-            x_opt, exit_code, gen_info, sorted_run_inds = advance_localopt_method(H, gen_specs, c_flag, run, gen_info)
+            x_opt, exit_code, gen_info, sorted_run_inds, x_new = result
+
+            if np.isinf(x_new).all() and x_opt is None:
+                # The local optimization method failed, so the run is dropped
+                H['num_active_runs'][sorted_run_inds] -= 1
+                inactive_runs.add(run)
+                updated_inds.update(sorted_run_inds) 
 
-            if np.isinf(x_new).all():
+            elif np.isinf(x_new).all():
                 assert exit_code>0, "Exit code not zero, but no information in x_new.\n Local opt run " + str(run) + " after " + str(len(sorted_run_inds)) + " evaluations.\n Worker crashing!"
                 # No new point was added. Hopefully at a minimum 
                 update_history_optimal(x_opt, H, sorted_run_inds)
@@ -109,7 +152,7 @@ def aposmm_logic(H,gen_info,gen_specs,libE_info):
                 updated_inds.update(sorted_run_inds) 
 
             else: 
-                gen_info = add_points_to_O(O, x_new, len(H), gen_specs, c_flag, gen_info, local_flag=1, sorted_run_inds=sorted_run_inds, run=run)
+                gen_info = add_points_to_O(O, x_new, len(H), gen_specs, c_flag, gen_info, rand_stream, local_flag=1, sorted_run_inds=sorted_run_inds, run=run)
 
         for i in inactive_runs:
             gen_info['active_runs'].remove(i)
@@ -123,9 +166,9 @@ def aposmm_logic(H,gen_info,gen_specs,libE_info):
 
     if samples_needed > 0:
         # x_new = np.random.uniform(0,1,(samples_needed,n))
-        x_new = gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(0,1,(samples_needed,n))
+        x_new = rand_stream.uniform(0,1,(samples_needed,n))
 
-        gen_info = add_points_to_O(O, x_new, len(H), gen_specs, c_flag, gen_info)
+        gen_info = add_points_to_O(O, x_new, len(H), gen_specs, c_flag, gen_info, rand_stream)
 
     # O = np.append(H[[o[0] for o in gen_specs['out']]][np.array(list(updated_inds),dtype=int)],O)
 
@@ -142,9 +185,10 @@ def aposmm_logic(H,gen_info,gen_specs,libE_info):
     #     O = np.append(B,O)
     return O, gen_info
 
-def add_points_to_O(O, pts, len_H, gen_specs, c_flag, gen_info, local_flag=0, sorted_run_inds=[], run=[]):
+def add_points_to_O(O, pts, len_H, gen_specs, c_flag, gen_info, rand_stream, local_flag=0, sorted_run_inds=[], run=[]):
     """
     Adds points to O, the numpy structured array to be sent back to the manager
+    (with priorities drawn from rand_stream, this worker's random stream)
     """
 
     assert not local_flag or len(pts) == 1, "add_points_to_O does not support this functionality"
@@ -183,17 +227,17 @@ def add_points_to_O(O, pts, len_H, gen_specs, c_flag, gen_info, local_flag=0, so
         O['num_active_runs'][-num_pts] += 1
         # O['priority'][-num_pts:] = 1
         # O['priority'][-num_pts:] = np.random.uniform(0,1,num_pts) 
-        O['priority'][-num_pts:] = gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(0,1,num_pts)
+        O['priority'][-num_pts:] = rand_stream.uniform(0,1,num_pts)
         gen_info['run_order'][run].append(O[-num_pts]['sim_id'])
     else:
         if c_flag:
             # p_tmp = np.sort(np.tile(np.random.uniform(0,1,num_pts/m),(m,1))) # If you want all "duplicate points" to have the same priority (meaning libEnsemble gives them all at once)
             # p_tmp = np.random.uniform(0,1,num_pts)
-            p_tmp = gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(0,1,num_pts)
+            p_tmp = rand_stream.uniform(0,1,num_pts)
         else:
             # p_tmp = np.random.uniform(0,1,num_pts)
-            # gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(lb,ub,(1,n))
-            p_tmp = gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(0,1,num_pts)
+            # rand_stream.uniform(lb,ub,(1,n))
+            p_tmp = rand_stream.uniform(0,1,num_pts)
         O['priority'][-num_pts:] = p_tmp
         # O['priority'][-num_pts:] = 1
 
@@ -205,17 +249,13 @@ def update_history_dist(H, gen_specs, c_flag):
     Update distances for any new points that have been evaluated
     """
 
-    n = len(H['x_on_cube'][0])
-
-    updated_inds = set()
-
     new_inds = np.where(~H['known_to_aposmm'])[0]
 
     if c_flag:
-        for v in np.unique(H['pt_id'][new_inds]):
-            inds = H['pt_id']==v
+        for g in pt_id_groups.groups_of(np.unique(H['pt_id'][new_inds])):
+            inds = pt_id_groups.rows_of(g)
             H['f'][inds] = np.inf
-            H['f'][np.where(inds)[0][0]] = gen_specs['combine_component_func'](H['f_i'][inds])
+            H['f'][inds[0]] = gen_specs['combine_component_func'](H['f_i'][inds])
 
         p = np.logical_and.reduce((H['returned'],H['obj_component']==0,~np.isnan(H['f'])))
     else:
@@ -223,55 +263,15 @@ def update_history_dist(H, gen_specs, c_flag):
 
     H['known_to_aposmm'][new_inds] = True # These points are now known to APOSMM
 
-    for new_ind in new_inds:
-        # Compute distance to boundary
-        H['dist_to_unit_bounds'][new_ind] = min(min(np.ones(n) - H['x_on_cube'][new_ind]),min(H['x_on_cube'][new_ind] - np.zeros(n)))
-
-        # Loop over new returned points and update their distances
-        if p[new_ind]:
-            dist_to_all = cdist(np.atleast_2d(H['x_on_cube'][new_ind]), H['x_on_cube'][p], 'euclidean').flatten()
-            new_better_than = H['f'][new_ind] < H['f'][p]
-
-            # Update any other points if new_ind is closer and better
-            if H['local_pt'][new_ind]:
-                inds_of_p = np.logical_and(dist_to_all < H['dist_to_better_l'][p], new_better_than)
-                updates = np.where(p)[0][inds_of_p]
-                H['dist_to_better_l'][updates] = dist_to_all[inds_of_p]
-                H['ind_of_better_l'][updates] = new_ind
-            else:
-                inds_of_p = np.logical_and(dist_to_all < H['dist_to_better_s'][p], new_better_than)
-                updates = np.where(p)[0][inds_of_p]
-                H['dist_to_better_s'][updates] = dist_to_all[inds_of_p]
-                H['ind_of_better_s'][updates] = new_ind
-            updated_inds.update(updates)
-
-            # Since we allow equality when deciding better_than_new_l and
-            # better_than_new_s, we have to prevent new_ind from being its own
-            # better point.
-            better_than_new_l = np.logical_and.reduce((~new_better_than,  H['local_pt'][p], H['sim_id'][p] != new_ind))
-            better_than_new_s = np.logical_and.reduce((~new_better_than, ~H['local_pt'][p], H['sim_id'][p] != new_ind))
-
-            # Who is closest to ind and better 
-            if np.any(better_than_new_l):
-                ind = dist_to_all[better_than_new_l].argmin()
-                H['ind_of_better_l'][new_ind] = H['sim_id'][p][np.nonzero(better_than_new_l)[0][ind]]
-                H['dist_to_better_l'][new_ind] = dist_to_all[better_than_new_l][ind]
-
-            if np.any(better_than_new_s):
-                ind = dist_to_all[better_than_new_s].argmin()
-                H['ind_of_better_s'][new_ind] = H['sim_id'][p][np.nonzero(better_than_new_s)[0][ind]]
-                H['dist_to_better_s'][new_ind] = dist_to_all[better_than_new_s][ind]
-
-            # if not ignore_L8:
-            #     r_k = calc_rk(len(H['x_on_cube'][0]), n_s, rk_const, lhs_divisions)
-            #     H['worse_within_rk'][new_ind][p] = np.logical_and.reduce((H['f'][new_ind] <= H['f'][p], dist_to_all <= r_k))
-
-            #     # Add trues if new point is 'worse_within_rk' 
-            #     inds_to_change = np.logical_and.reduce((H['dist_to_all'][p,new_ind] <= r_k, H['f'][new_ind] >= H['f'][p], H['sim_id'][p] != new_ind))
-            #     H['worse_within_rk'][inds_to_change,new_ind] = True
-
-            #     if not H['local_pt'][new_ind]:
-            #         H['worse_within_rk'][H['dist_to_all'] > r_k] = False 
+    # Compute distance to boundary
+    X = H['x_on_cube'][new_inds]
+    H['dist_to_unit_bounds'][new_inds] = np.minimum(1 - X, X).min(axis=1)
+
+    # Update distances using the index of evaluated points, which stays
+    # resident between calls
+    global better_point_index
+    better_point_index = resident_index(better_point_index, H)
+    updated_inds = update_dists_to_better(H, new_inds, p, better_point_index)
 
     updated_inds.update(new_inds)
     return updated_inds
@@ -294,80 +294,148 @@ def update_history_optimal(x_opt, H, run_inds):
 
 def advance_localopt_method(H, gen_specs, c_flag, run, gen_info):
     """
-    Moves a local optimization method one iteration forward. We currently do
-    this by feeding all past evaluations from a run to the method and then
-    storing the first new point generated
+    Moves a local optimization method one iteration forward. The method
+    stays suspended between calls (see aposmm_runs.py), so it is only given
+    the values of the points added to the run since the last call. (If it
+    isn't resident, e.g., when another worker advanced the run last or its
+    settings in gen_specs changed, it is started again and given every value
+    in the run.)
+
+    Returns x_opt and exit_code (which are only meaningful if the method
+    finished), gen_info, the indices of the run, and x_new, the next point
+    (all inf if the method finished). If the method failed (raised one of
+    LOCALOPT_ERRORS), the run is returned as finished with x_opt None and
+    exit_code 0; other errors are raised.
     """
 
-    global x_new, pt_in_run, total_pts_in_run # Used to generate a next local opt point
+    sorted_run_inds = gen_info['run_order'][run]
+    assert all(H['returned'][sorted_run_inds])
+
+    x0 = H['x_on_cube'][sorted_run_inds[0]].copy()
+    if gen_specs['localopt_method'] in ['LN_SBPLX', 'LN_BOBYQA', 'LN_NELDERMEAD', 'LD_MMA']:
+        solve = lambda objective: set_up_and_run_nlopt(x0, gen_specs, objective)
+    elif gen_specs['localopt_method'] in ['pounders']:
+        m = gen_specs['components'] if c_flag else len(H['fvec'][0])
+        solve = lambda objective: set_up_and_run_tao(x0, m, gen_specs, objective)
+    else:
+        sys.exit("Unknown localopt method. Exiting")
 
-    while 1:
-        sorted_run_inds = gen_info['run_order'][run]
-        assert all(H['returned'][sorted_run_inds])
+    try:
+        key = (c_flag,) + tuple(gen_specs.get(k) for k in ['localopt_method', 'xtol_rel', 'dist_to_bound_multiple', 'delta_0_mult', 'grtol', 'gatol'])
+        local_run = resident_run(local_opt_runs, run, key, sorted_run_inds, H['x_on_cube'], solve)
 
-        x_new = np.ones((1,len(gen_specs['ub'])))*np.inf; pt_in_run = 0; total_pts_in_run = len(sorted_run_inds)
+        while 1:
+            for ind in sorted_run_inds[len(local_run.told):]:
+                if local_run.x is None:
+                    break
+                local_run.tell(ind, H['x_on_cube'][ind], run_value(H, ind, gen_specs, c_flag))
 
-        if gen_specs['localopt_method'] in ['LN_SBPLX', 'LN_BOBYQA', 'LN_NELDERMEAD', 'LD_MMA']:
+            if local_run.x is None:
+                break
 
-            if gen_specs['localopt_method'] in ['LD_MMA']:
-                Run_H = H[['x_on_cube','f','grad']][sorted_run_inds] 
+            matching_ind = np.equal(local_run.x, H['x_on_cube']).all(1)
+            if ~matching_ind.any():
+                # Generated a new point
+                break 
             else:
-                Run_H = H[['x_on_cube','f']][sorted_run_inds] 
+                # We need to add a previously evaluated point into this run
+                gen_info['run_order'][run].append(np.nonzero(matching_ind)[0][0])
+
+    except OptimizerError as e:
+        local_opt_runs.pop(run, None)
+        if not isinstance(e.args[0], LOCALOPT_ERRORS):
+            raise e.args[0]
+
+        # The method failed, so the run is returned as finished with exit_code 0
+        print("Local opt run " + str(run) + " after " + str(len(sorted_run_inds)) + " evaluations failed and is dropped: " + repr(e.args[0]))
+        sys.stdout.flush()
+        return None, 0, gen_info, sorted_run_inds, np.ones((1,len(gen_specs['ub'])))*np.inf
+
+    if local_run.x is None:
+        # The method finished without a new point
+        del local_opt_runs[run]
+        x_opt, exit_code = local_run.result
+        x_new = np.ones((1,len(gen_specs['ub'])))*np.inf
+    else:
+        x_opt, exit_code = None, 0
+        x_new = np.atleast_2d(local_run.x)
 
-            try:
-                # import ipdb; ipdb.set_trace() 
-                x_opt, exit_code = set_up_and_run_nlopt(Run_H, gen_specs)
-            except Exception as e:
-                exit_code = 0
-                print(e.__doc__)
-                print(e.args)
-                print(Run_H['x_on_cube'])
+    return x_opt, exit_code, gen_info, sorted_run_inds, x_new
 
 
-        elif gen_specs['localopt_method'] in ['pounders']:
-                
-            if c_flag:
-                Run_H_F = np.zeros(len(sorted_run_inds),dtype=[('fvec',float,gen_specs['components'])])
-                for i,ind in enumerate(sorted_run_inds):
-                    for j in range(gen_specs['components']):
-                        Run_H_F['fvec'][i][j] = H['f_i'][np.logical_and(H['pt_id']==H['pt_id'][ind], H['obj_component']==j)]
-                Run_H = merge_arrays([H[['x_on_cube']][sorted_run_inds],Run_H_F],flatten=True)
-            else: 
-                Run_H = H[['x_on_cube','fvec']][sorted_run_inds]
+def run_pool(gen_specs, c_flag):
+    """
+    Returns the RunPool of gen_specs['localopt_processes'] processes for
+    advancing runs (made again if gen_specs or c_flag changed, or the pool
+    was closed after an error). The pool processes only run NLopt, so they
+    make no MPI calls.
+    """
+    global localopt_pool
 
-            try: 
-                x_opt, exit_code = set_up_and_run_tao(Run_H, gen_specs)
-            except Exception as e:
-                exit_code = 0
-                print(e.__doc__)
-                print(e.args)
+    assert gen_specs['localopt_method'] not in ['pounders'], "localopt_processes is only supported for NLopt methods"
 
-        else:
-            sys.exit("Unknown localopt method. Exiting")
+    if localopt_pool is None or localopt_pool[0] is not gen_specs or localopt_pool[1] != c_flag or not localopt_pool[2].procs:
+        close_run_pool()
 
-        matching_ind = np.equal(x_new,H['x_on_cube']).all(1)
-        if ~matching_ind.any():
-            # Generated a new point
-            break 
-        else:
-            # We need to add a previously evaluated point into this run
-            gen_info['run_order'][run].append(np.nonzero(matching_ind)[0][0])
+        # The runs advanced here aren't used with the pool (and their threads
+        # shouldn't be running when the pool processes are forked)
+        for local_run in local_opt_runs.values():
+            local_run.stop()
+        local_opt_runs.clear()
+
+        def advance(H, run, run_order):
+            x_opt, exit_code, _, _, x_new = advance_localopt_method(H, gen_specs, c_flag, run, {'run_order': run_order})
+            return x_opt, exit_code, x_new
+
+        fields = ['x_on_cube','f','returned'] + (['grad'] if gen_specs['localopt_method'] in ['LD_MMA'] else [])
+        localopt_pool = (gen_specs, c_flag, RunPool(gen_specs['localopt_processes'], advance, local_opt_runs, fields))
+
+    return localopt_pool[2]
+
+
+def close_run_pool():
+    """
+    Ends the processes of the RunPool (if any); called when the gen's process
+    exits
+    """
+    global localopt_pool
 
+    if localopt_pool is not None:
+        localopt_pool[2].close()
+        localopt_pool = None
 
-    return x_opt, exit_code, gen_info, sorted_run_inds
+atexit.register(close_run_pool)
 
 
+def run_value(H, ind, gen_specs, c_flag):
+    """
+    The value the local optimization method gets for the point in row ind:
+    f (and grad, for LD_MMA) or fvec (combined from the f_i of each
+    component if c_flag)
+    """
+    if gen_specs['localopt_method'] in ['LD_MMA']:
+        return H['f'][ind], H['grad'][ind].copy()
 
+    if gen_specs['localopt_method'] in ['pounders']:
+        if c_flag:
+            rows = pt_id_groups.rows_of(pt_id_groups.group[ind])
+            fvec = np.zeros(gen_specs['components'])
+            fvec[H['obj_component'][rows]] = H['f_i'][rows]
+            return fvec
+        return H['fvec'][ind].copy()
 
-def set_up_and_run_nlopt(Run_H, gen_specs):
+    return H['f'][ind]
+
+
+def set_up_and_run_nlopt(x0, gen_specs, objective):
     """ Set up objective and runs nlopt
 
-    Declares the appropriate syntax for our special objective function to read
-    through Run_H, sets the parameters and starting points for the run.
+    Declares the appropriate syntax for objective (which returns f, or f and
+    grad for LD_MMA), sets the parameters and starting point for the run.
     """
 
-    def nlopt_obj_fun(x, grad, Run_H):
-        out = look_in_history(x, Run_H)
+    def nlopt_obj_fun(x, grad):
+        out = objective(x)
 
         if gen_specs['localopt_method'] in ['LD_MMA']:
             grad[:] = out[1]
@@ -383,7 +451,6 @@ def set_up_and_run_nlopt(Run_H, gen_specs):
     ub = np.ones(n)
     opt.set_lower_bounds(lb)
     opt.set_upper_bounds(ub)
-    x0 = Run_H['x_on_cube'][0]
 
     # Care must be taken here because a too-large initial step causes nlopt to move the starting point!
     dist_to_bound = min(min(ub-x0),min(x0-lb))
@@ -393,8 +460,7 @@ def set_up_and_run_nlopt(Run_H, gen_specs):
     else:
         opt.set_initial_step(dist_to_bound)
 
-    opt.set_maxeval(len(Run_H)+1) # evaluate one more point
-    opt.set_min_objective(lambda x, grad: nlopt_obj_fun(x, grad, Run_H))
+    opt.set_min_objective(nlopt_obj_fun)
     opt.set_xtol_rel(gen_specs['xtol_rel'])
     
     x_opt = opt.optimize(x0)
@@ -406,18 +472,17 @@ def set_up_and_run_nlopt(Run_H, gen_specs):
     return x_opt, exit_code
 
 
-def set_up_and_run_tao(Run_H, gen_specs):
+def set_up_and_run_tao(x0, m, gen_specs, objective):
     """ Set up objective and runs PETSc on the comm_self communicator
 
-    Declares the appropriate syntax for our special objective function to read
-    through Run_H, sets the parameters and starting points for the run.
+    Declares the appropriate syntax for objective (which returns fvec, of
+    length m), sets the parameters and starting point for the run.
     """
-    tao_comm = MPI.COMM_SELF
+    tao_comm = PETSc.COMM_SELF
     n = len(gen_specs['ub'])
-    m = len(Run_H['fvec'][0])
 
-    def pounders_obj_func(tao, X, F, Run_H):
-        F.array = look_in_history(X.array, Run_H, vector_return=True)
+    def pounders_obj_func(tao, X, F):
+        F.array = objective(X.array)
         return F
 
     # def blmvm_obj_func(tao, X, G, Run_H):
@@ -429,7 +494,7 @@ def set_up_and_run_tao(Run_H, gen_specs):
     x = PETSc.Vec().create(tao_comm)
     x.setSizes(n)
     x.setFromOptions()
-    x.array = Run_H['x_on_cube'][0]
+    x.array = x0
     lb = x.duplicate()
     ub = x.duplicate()
     lb.array = 0*np.ones(n)
@@ -446,7 +511,7 @@ def set_up_and_run_tao(Run_H, gen_specs):
 
     PETSc.Options().setValue('-tao_pounders_delta',str(delta_0))
     # PETSc.Options().setValue('-pounders_subsolver_tao_type','bqpip')
-    tao.setSeparableObjective(lambda tao, x, f: pounders_obj_func(tao, x, f, Run_H), f)
+    tao.setSeparableObjective(pounders_obj_func, f)
     # elif gen_specs['localopt_method'] == 'blmvm':
     #     g = PETSc.Vec().create(tao_comm)
     #     g.setSizes(n)
@@ -454,7 +519,6 @@ def set_up_and_run_tao(Run_H, gen_specs):
     #     tao.setObjectiveGradient(lambda tao, x, g: blmvm_obj_func(tao, x, g, Run_H))
 
     # Set everything for tao before solving
-    PETSc.Options().setValue('-tao_max_funcs',str(total_pts_in_run+1))
     tao.setFromOptions()
     tao.setVariableBounds((lb,ub))
     # tao.setObjectiveTolerances(fatol=gen_specs['fatol'], frtol=gen_specs['frtol'])
@@ -658,44 +722,6 @@ def decide_where_to_start_localopt(H, n_s, rk_const, lhs_divisions=0, mu=0, nu=0
     start_inds = list(sample_start_inds) + local_start_inds2
     return start_inds
 
-def look_in_history(x, Run_H, vector_return=False):
-    """ See if Run['x_on_cube'][pt_in_run] matches x, returning f or fvec, or saves x to
-    x_new if every point in Run_H has been checked.
-    """
-    
-    global pt_in_run, total_pts_in_run, x_new
-
-    if vector_return:
-        to_return = 'fvec'
-    else:
-        if 'grad' in Run_H.dtype.names:
-            to_return = ['f','grad']
-        else:
-            to_return = 'f'
-
-    if pt_in_run < total_pts_in_run:
-        # Return the value in history to the localopt algorithm. 
-        assert np.allclose(x, Run_H['x_on_cube'][pt_in_run], rtol=1e-08, atol=1e-08), \
-            "History point does not match Localopt point"
-        f_out = Run_H[to_return][pt_in_run]
-    else:
-        if pt_in_run == total_pts_in_run:
-            # The history of points is exhausted. Save the requested point x to
-            # x_new. x_new will be returned to the manager.
-            x_new[:] = x
-
-        # Just in case the local opt method requests more points after a new
-        # point has been identified.
-        # f_out = np.finfo(np.float64).max
-        # f_out = Run_H[to_return][total_pts_in_run-1] 
-        f_out = Run_H[to_return][total_pts_in_run-1] 
-
-    pt_in_run += 1
-
-    return f_out
-
-
-
 def calc_rk(n, n_s, rk_const, lhs_divisions=0):
     """ Calculate the critical distance r_k """ 
 
@@ -725,8 +751,11 @@ def initialize_APOSMM(H, gen_specs):
 
 
     if c_flag:
-        completely_returned_pt_ids = np.where([np.all(H['returned'][H['pt_id']==j]) for j in np.unique(H['pt_id'])])[0]
-        n_s = np.sum(np.logical_and.reduce((~H['local_pt'], np.in1d(H['pt_id'],completely_returned_pt_ids), H['obj_component']==0 ))) # Number of returned sampled points
+        global pt_id_groups
+        pt_id_groups = resident_groups(pt_id_groups, H)
+
+        completely_returned = pt_id_groups.complete()[pt_id_groups.group]
+        n_s = np.sum(np.logical_and.reduce((~H['local_pt'], completely_returned, H['obj_component']==0 ))) # Number of returned sampled points
     else:
         n_s = np.sum(np.logical_and(~H['local_pt'], H['returned'])) # Number of returned sampled points
 
@@ -764,63 +793,45 @@ def queue_update_function(H, gen_specs, persistent_data):
     """
 
     if len(persistent_data) == 0:
-        persistent_data['complete'] = set() 
-        persistent_data['has_nan'] = set() 
         persistent_data['already_paused'] = set() 
         persistent_data['H_len'] = 0
+        if 'stop_partial_fvec_eval' in gen_specs and gen_specs['stop_partial_fvec_eval']:
+            persistent_data['fvals'] = PartialFvals(gen_specs['combine_component_func'])
+        else:
+            persistent_data['fvals'] = PartialFvals()
 
     if len(H)==persistent_data['H_len']:
         return H, persistent_data
     else:
         persistent_data['H_len']=len(H)
 
+    if not gen_specs.get('stop_on_NaNs') and not gen_specs.get('stop_partial_fvec_eval'):
+        return H, persistent_data
+
+    # Only the points with rows added or returned since the last call are
+    # recomputed (and all points compared again when best_complete falls)
+    fvals = persistent_data['fvals']
+    to_check = fvals.update(H)
+    groups = fvals.groups
+
     pt_ids_to_pause = set()
 
     # Pause entries in H if one component is evaluated at a time and there are
     # any NaNs for some components.
     if 'stop_on_NaNs' in gen_specs and gen_specs['stop_on_NaNs']:
-        pt_ids_to_pause.update(H['pt_id'][np.isnan(H['f_i'])])
+        pt_ids_to_pause.update(groups.ids[groups.changed[fvals.has_nan[groups.changed]]])
 
     # Pause entries in H if a partial combine_component_func evaluation is
     # worse than the best, known, complete evaluation (and the point is not a
     # local_opt point).
     if 'stop_partial_fvec_eval' in gen_specs and gen_specs['stop_partial_fvec_eval']:
-        pt_ids = np.unique(H['pt_id'])
-
-        complete_fvals_flag = np.zeros(len(pt_ids),dtype=bool)
-        for i,pt_id in enumerate(pt_ids):
-            if pt_id in persistent_data['has_nan']:
-                continue 
-
-            a1 = H['pt_id']==pt_id
-            if np.any(np.isnan(H['f_i'][a1])):
-                persistent_data['has_nan'].add(pt_id)
-                continue
-
-            if np.all(H['returned'][a1]):
-                complete_fvals_flag[i] = True
-                persistent_data['complete'].add(pt_id)
-
-        # complete_fvals_flag = np.array([np.all(H['returned'][H['pt_id']==i]) for i in pt_ids],dtype=bool)
-
-        if np.any(complete_fvals_flag) and len(pt_ids)>1:
-            # Ensure combine_component_func calculates partial fevals correctly
-            # with H['f_i'] = 0 for non-returned point
-            possibly_partial_fvals = np.array([gen_specs['combine_component_func'](H['f_i'][H['pt_id']==i]) for i in pt_ids])
-
-            best_complete = np.nanmin(possibly_partial_fvals[complete_fvals_flag])
-
-            worse_flag = np.zeros(len(pt_ids),dtype=bool)
-            for i in range(len(pt_ids)):
-                if not np.isnan(possibly_partial_fvals[i]) and possibly_partial_fvals[i] > best_complete: 
-                    worse_flag[i] = True
-
-            # Pause incompete evaluations with worse_flag==True
-            pt_ids_to_pause.update(pt_ids[np.logical_and(worse_flag,~complete_fvals_flag)])
+        pt_ids_to_pause.update(groups.ids[fvals.worse(to_check)])
 
-    if not pt_ids_to_pause.issubset(persistent_data['already_paused']):
+    pt_ids_to_pause -= persistent_data['already_paused']
+    if len(pt_ids_to_pause):
         persistent_data['already_paused'].update(pt_ids_to_pause)
-        H['paused'][np.in1d(H['pt_id'],list(pt_ids_to_pause))] = True
+        for g in groups.groups_of(list(pt_ids_to_pause)):
+            H['paused'][groups.rows_of(g)] = True
 
     return H, persistent_data
 
@@ -0,0 +1,316 @@
+"""
+Local optimization runs for APOSMM whose optimizer (NLopt or TAO) stays
+suspended between calls to APOSMM, so advancing a run costs one optimizer
+step rather than replaying the whole run, and a pool of processes to
+advance runs in parallel.
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import threading
+import multiprocessing
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Fork, so the pool processes get advance (and what it uses) without pickling
+if hasattr(multiprocessing, 'get_context'):
+    mp = multiprocessing.get_context('fork')
+else:
+    mp = multiprocessing
+
+
+class StopRun(Exception):
+    """
+    Raised in a suspended optimizer to end its thread (the optimizer may
+    raise something else in turn)
+    """
+
+
+class OptimizerError(Exception):
+    """
+    Raised by LocalOptRun when its optimizer raised an exception (which is
+    args[0])
+    """
+
+
+class LocalOptRun(object):
+    """
+    A local optimization run whose optimizer runs in its own thread. Each
+    time the optimizer evaluates the objective, the thread stops and the
+    point is available in x, until tell gives its value. Only one of the
+    thread and the caller runs at a time.
+
+    Parameters
+    ----------
+    solve: function
+        solve(objective) runs the optimizer, with objective(x) giving the
+        value at x, and returns (x_opt, exit_code)
+
+    key:
+        Anything identifying the run's setup (a run is only resumed with the
+        same key)
+
+    Attributes
+    ----------
+    x: numpy array
+        The point the optimizer is waiting on (None if it has finished)
+
+    told: list
+        The rows of H whose values have been given to the optimizer
+
+    told_x: list
+        The points of those rows
+
+    result: tuple
+        (x_opt, exit_code) once the optimizer has finished
+    """
+
+    def __init__(self, solve, key=None):
+        self.key = key
+        self.x = None
+        self.told = []
+        self.told_x = []
+        self.result = None
+        self.stopping = False
+
+        self.asks = queue.Queue(1)
+        self.tells = queue.Queue(1)
+
+        # Daemon, so a run that is never finished doesn't keep the process
+        # alive
+        self.thread = threading.Thread(target=self.main, args=(solve,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.wait()
+
+    def main(self, solve):
+        try:
+            result = solve(self.objective)
+        except Exception as e:
+            if not self.stopping:
+                self.asks.put(('error', e))
+            return
+
+        self.asks.put(('done', result))
+
+    def objective(self, x):
+        """
+        Called by the optimizer (in the thread): waits for the value at x
+        """
+        if self.stopping:
+            raise StopRun
+
+        self.asks.put(('x', np.array(x, dtype=float)))
+        value = self.tells.get()
+        if value is None:
+            raise StopRun
+
+        return value
+
+    def wait(self):
+        """
+        Waits for the optimizer to ask for a point or finish
+        """
+        kind, value = self.asks.get()
+        if kind == 'x':
+            self.x = value
+        else:
+            self.x = None
+            self.thread.join()
+            if kind == 'error':
+                raise OptimizerError(value)
+            self.result = value
+
+    def tell(self, row, x, value):
+        """
+        Gives the optimizer the value of row of H (at x, the point it is
+        waiting on) and waits for it to ask for the next point or finish
+        """
+        assert self.x is not None, "Local opt run has finished"
+        assert np.allclose(x, self.x, rtol=1e-08, atol=1e-08), "History point does not match Localopt point"
+
+        self.told.append(row)
+        self.told_x.append(np.array(x))
+        self.tells.put(value)
+        self.wait()
+
+    def stop(self):
+        """
+        Ends the thread (if the optimizer hasn't finished)
+        """
+        if self.x is not None:
+            self.x = None
+            self.stopping = True
+            self.tells.put(None)
+            self.thread.join()
+
+    def resumes(self, key, run_inds, X):
+        """
+        True if the run can be continued for the rows run_inds (with points
+        X, the x_on_cube of H): it has the same key and was told the first
+        rows of run_inds, with the same points
+        """
+        if self.key != key or list(run_inds[:len(self.told)]) != self.told:
+            return False
+
+        return np.array_equal(np.reshape(self.told_x, X[self.told].shape), X[self.told])
+
+
+def resident_run(runs, run, key, run_inds, X, solve):
+    """
+    Returns runs[run] if it can be continued for run_inds (see
+    LocalOptRun.resumes), and otherwise stops it and puts a new LocalOptRun
+    for solve in runs[run]
+    """
+    local_run = runs.get(run)
+    if local_run is not None and local_run.resumes(key, run_inds, X):
+        return local_run
+
+    if local_run is not None:
+        local_run.stop()
+
+    runs[run] = LocalOptRun(solve, key)
+    return runs[run]
+
+
+class RunPool(object):
+    """
+    Processes that advance local optimization runs in parallel. Run r is
+    always advanced by process r % nprocs, so its optimizer stays suspended
+    there (in the process's copy of runs, which starts empty).
+
+    Each process keeps a copy of the fields of H that advance uses, and is
+    sent only the rows added to H, or returned, since the last call (rows
+    must only change until they are returned).
+
+    Parameters
+    ----------
+    nprocs: integer
+        Number of processes
+
+    advance: function
+        advance(H, run, run_order) advances run (whose rows are run_order[run])
+        in a pool process, and returns its result
+
+    runs: dict
+        The resident LocalOptRuns that advance uses
+
+    fields: list
+        The fields of H that advance uses (including 'returned')
+    """
+
+    def __init__(self, nprocs, advance, runs, fields):
+        self.fields = fields
+        self.num_rows = 0
+        self.pending = np.zeros(0, dtype=int) # Rows not yet returned
+        self.conns = []
+        self.procs = []
+        for i in range(nprocs):
+            conn, child_conn = mp.Pipe()
+            # The process closes the pool's ends of the pipes (its own and
+            # those of the processes before it), so it sees EOF if the pool's
+            # process dies
+            proc = mp.Process(target=serve_runs, args=(child_conn, self.conns + [conn], advance, runs))
+            proc.daemon = True
+            proc.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def advance(self, H, runs, run_order):
+        """
+        Advances each of runs on its process. Returns their results, in the
+        order of runs, and the rows of each run (which may have grown). If a
+        process fails, the pool is closed and the error raised.
+        """
+        if len(H) < self.num_rows:
+            # A new H, so all of it is sent
+            self.num_rows = 0
+            self.pending = np.zeros(0, dtype=int)
+
+        new = np.arange(self.num_rows, len(H))
+        returned = H['returned'][self.pending]
+        rows = np.append(self.pending[returned], new)
+        H_rows = H[rows][self.fields]
+        self.pending = np.append(self.pending[~returned], new[~H['returned'][new]])
+        self.num_rows = len(H)
+
+        nprocs = len(self.conns)
+        by_proc = dict((i, []) for i in range(nprocs))
+        for run in runs:
+            by_proc[run % nprocs].append(run)
+
+        results = {}
+        new_order = {}
+        error = None
+        try:
+            for i, proc_runs in by_proc.items():
+                self.conns[i].send((len(H), rows, H_rows, proc_runs, dict((run, run_order[run]) for run in proc_runs)))
+
+            for i in by_proc:
+                out = self.conns[i].recv()
+                if isinstance(out, Exception):
+                    error = out
+                else:
+                    results.update(out[0])
+                    new_order.update(out[1])
+        except (EOFError, IOError):
+            self.close()
+            raise
+
+        if error is not None:
+            self.close()
+            raise error
+
+        return [results[run] for run in runs], new_order
+
+    def close(self):
+        """
+        Ends the processes (if they haven't been ended). Closing the pipes
+        ends them, so nothing is written to a process that may have exited.
+        """
+        for conn, proc in zip(self.conns, self.procs):
+            conn.close()
+            proc.join()
+
+        self.conns = []
+        self.procs = []
+
+
+def serve_runs(conn, pool_conns, advance, runs):
+    """
+    Loop of a RunPool process: updates its copy of H and advances the runs it
+    is sent, until the pool's end of the pipe is closed (or its process dies)
+    """
+    for pool_conn in pool_conns:
+        pool_conn.close()
+
+    # These runs' threads weren't forked
+    runs.clear()
+
+    H = None
+    while 1:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+
+        num_rows, rows, H_rows, proc_runs, run_order = msg
+        if H is None or num_rows > len(H):
+            old = H
+            H = np.zeros(max(num_rows, 2*len(H) if H is not None else 0), dtype=H_rows.dtype)
+            if old is not None:
+                H[:len(old)] = old
+        H[rows] = H_rows
+
+        try:
+            results = dict((run, advance(H[:num_rows], run, run_order)) for run in proc_runs)
+        except Exception as e:
+            conn.send(e)
+        else:
+            conn.send((results, run_order))
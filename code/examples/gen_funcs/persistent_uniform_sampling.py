@@ -0,0 +1,38 @@
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+from message_numbers import STOP_TAG
+
+def persistent_uniform(H,gen_info,gen_specs,libE_info):
+    """
+    A persistent gen_f (gen_specs['persistent'] = True) that generates points
+    uniformly over the domain defined by gen_specs['ub'] and gen_specs['lb'].
+    It sends gen_specs['gen_batch_size'] points and then, for every point
+    whose evaluation is streamed back to it, sends a new point, until the
+    manager stops the run.
+    """
+
+    ub = gen_specs['ub']
+    lb = gen_specs['lb']
+
+    n = len(lb)
+    b = gen_specs['gen_batch_size']
+    comm = libE_info['comm']
+    rand_stream = gen_info['rand_stream'][libE_info['rank']]
+
+    while 1:
+        O = np.zeros(b, dtype=gen_specs['out'])
+        O['x'] = rand_stream.uniform(lb,ub,(b,n))
+        comm.send(O)
+
+        tag, libE_info, calc_in = comm.recv()
+        if tag == STOP_TAG:
+            break
+
+        b = len(calc_in)
+
+    return O, gen_info
@@ -2,7 +2,6 @@ from __future__ import division
 from __future__ import absolute_import
 
 import numpy as np
-from mpi4py import MPI
 
 def uniform_random_sample_with_different_nodes_and_ranks(H,gen_info,gen_specs,libE_info):
     """
@@ -11,8 +10,6 @@ def uniform_random_sample_with_different_nodes_and_ranks(H,gen_info,gen_specs,li
     used in the evaluation of the generated point.
     """
 
-    del libE_info # Ignored parameter
-
     ub = gen_specs['ub']
     lb = gen_specs['lb']
     n = len(lb)
@@ -23,7 +20,7 @@ def uniform_random_sample_with_different_nodes_and_ranks(H,gen_info,gen_specs,li
         O = np.zeros(b, dtype=gen_specs['out'])
         for i in range(0,b):
             # x = np.random.uniform(lb,ub,(1,n))
-            x = gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(lb,ub,(1,n))
+            x = gen_info['rand_stream'][libE_info['rank']].uniform(lb,ub,(1,n))
             O['x'][i] = x
             O['num_nodes'][i] = 1
             O['ranks_per_node'][i] = 16
@@ -44,7 +41,6 @@ def uniform_random_sample_obj_components(H,gen_info,gen_specs,libE_info):
     Generates points uniformly over the domain defined by gen_specs['ub'] and
     gen_specs['lb'] but requests each component be evaluated separately.
     """
-    del libE_info # Ignored parameter
 
     ub = gen_specs['ub']
     lb = gen_specs['lb']
@@ -56,11 +52,12 @@ def uniform_random_sample_obj_components(H,gen_info,gen_specs,libE_info):
     O = np.zeros(b*m, dtype=gen_specs['out'])
     for i in range(0,b):
         # x = np.random.uniform(lb,ub,(1,n))
-        x = gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(lb,ub,(1,n))
+        x = gen_info['rand_stream'][libE_info['rank']].uniform(lb,ub,(1,n))
 
         O['x'][i*m:(i+1)*m,:] = np.tile(x,(m,1))
         # O['priority'][i*m:(i+1)*m] = np.random.uniform(0,1,m)
-        O['priority'][i*m:(i+1)*m] = gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(0,1,m)
+        if 'priority' in O.dtype.names:
+            O['priority'][i*m:(i+1)*m] = gen_info['rand_stream'][libE_info['rank']].uniform(0,1,m)
         O['obj_component'][i*m:(i+1)*m] = np.arange(0,m)
 
         O['pt_id'][i*m:(i+1)*m] = len(H)//m+i
@@ -72,7 +69,6 @@ def uniform_random_sample(H,gen_info,gen_specs,libE_info):
     Generates points uniformly over the domain defined by gen_specs['ub'] and
     gen_specs['lb'].
     """
-    del libE_info # Ignored parameter
 
     ub = gen_specs['ub']
     lb = gen_specs['lb']
@@ -83,7 +79,7 @@ def uniform_random_sample(H,gen_info,gen_specs,libE_info):
     O = np.zeros(b, dtype=gen_specs['out'])
     for i in range(0,b):
         # x = np.random.uniform(lb,ub,(1,n))
-        x = gen_info['rand_stream'][MPI.COMM_WORLD.Get_rank()].uniform(lb,ub,(1,n))
+        x = gen_info['rand_stream'][libE_info['rank']].uniform(lb,ub,(1,n))
 
         O['x'][i] = x
 
@@ -272,6 +272,39 @@ def libE_func_wrapper(H,gen_info,sim_specs,libE_info):
             O['f'][i] = sim_specs['combine_component_func'](O['fvec'][i])
 
     return O, gen_info
+
+
+def setup_component(sim_specs, component):
+    """
+    Setup function (sim_specs['setup_f']) for libE_component_with_state. The
+    returned state holds the data for one component; the worker keeps it
+    while it evaluates that component.
+    """
+    del sim_specs # Ignored parameter
+
+    return {'component': component, 't': t[component], 'y': y[component], 'evals': 0}
+
+
+def libE_component_with_state(H,gen_info,sim_specs,libE_info):
+    """
+    Evaluates one component of the chwirut function at each point, using the
+    component data from the worker's persistent sim state
+    (libE_info['sim_state']). The number of evaluations made with the state
+    is returned in 'state_evals'.
+    """
+    state = libE_info['sim_state']
+
+    batch = len(H['x'])
+    O = np.zeros(batch,dtype=sim_specs['out'])
+
+    for i,x in enumerate(H['x']):
+        assert H['obj_component'][i] == state['component'], "Sim state is for a different component"
+
+        O['f_i'][i] = state['y'] - np.exp(-x[0]*state['t'])/(x[1] + x[2]*state['t'])
+        state['evals'] += 1
+        O['state_evals'][i] = state['evals']
+
+    return O, gen_info
         
 # if __name__ == '__main__':
 #     x = np.zeros(3)
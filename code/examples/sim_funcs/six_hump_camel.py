@@ -1,7 +1,6 @@
 from __future__ import division
 from __future__ import absolute_import
 
-from mpi4py import MPI # for libE communicator
 import subprocess, os
 import numpy as np
 
@@ -19,9 +18,9 @@ def six_hump_camel_with_different_ranks_and_nodes(H, gen_info, sim_specs, libE_i
     for i,x in enumerate(H['x']):
 
         if 'blocking' in libE_info:
-            ranks_involved = [MPI.COMM_WORLD.Get_rank()] +  list(libE_info['blocking'])
+            ranks_involved = [libE_info['rank']] +  list(libE_info['blocking'])
         else:
-            ranks_involved = [MPI.COMM_WORLD.Get_rank()] 
+            ranks_involved = [libE_info['rank']] 
 
         machinefilename = 'machinefile_for_sim_id=' + str(libE_info['H_rows'][i] )+ '_ranks='+'_'.join([str(r) for r in ranks_involved])
 
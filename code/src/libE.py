@@ -28,8 +28,8 @@ from __future__ import absolute_import
 
 from libE_manager import manager_main
 from libE_worker import worker_main
-
-from mpi4py import MPI
+from libE_sub_manager import sub_manager_main
+from libE_comms import MPIComm, MPI
 
 import numpy as np
 import sys,os 
@@ -42,31 +42,69 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../examples/alloc_funcs
 from give_sim_work_first import give_sim_work_first
 
 def libE(sim_specs, gen_specs, exit_criteria, failure_processing={},
-        alloc_specs={'alloc_f': give_sim_work_first, 'manager_ranks': set([0]), 'worker_ranks': set(range(1,MPI.COMM_WORLD.Get_size()))},
-        c={'comm': MPI.COMM_WORLD, 'color': 0}, 
-        H0=[]):
+        alloc_specs=None, c=None, H0=[]):
     """ 
     This is the outer libEnsemble routine. It checks each rank in c['comm']
     against alloc_specs['manager_ranks'] or alloc_specs['worker_ranks'] and
     either runs manager_main or worker_main 
     (Some subroutines currently assume that the manager is always (only) rank 0.)
+
+    Ranks in alloc_specs['sub_managers'] (a dict mapping each sub-manager
+    rank to the set of its worker ranks) run sub_manager_main, and their
+    workers get work from them (see libE_sub_manager.py).
+
+    With alloc_specs['queue_depth'] = d > 1, up to d sim work items can be
+    queued on a worker, so it starts the next one as soon as its current one
+    returns (see libE_manager.send_to_worker_and_update_active_and_idle).
+
+    c['comm'] is an MPI communicator, another communicator backend (see
+    libE_comms) or 'local', in which case this process is the manager and the
+    workers are started as local processes (see libE_local).
+
+    By default, c['comm'] is MPI.COMM_WORLD and alloc_specs gives sim work
+    first, with rank 0 the manager and the other ranks workers. MPI is only
+    initialized when it is used (see libE_comms.LazyMPI).
     """
+    if c is None:
+        c = {'comm': MPI.COMM_WORLD, 'color': 0}
+    if alloc_specs is None:
+        alloc_specs = {'alloc_f': give_sim_work_first, 'manager_ranks': set([0]), 'worker_ranks': set(range(1,MPI.COMM_WORLD.Get_size()))}
+
     check_inputs(c, alloc_specs, sim_specs, gen_specs, failure_processing, exit_criteria, H0)
     
-    comm = c['comm']
+    procs = []
+    if c['comm'] == 'local':
+        from libE_local import start_workers
+        comm, procs = start_workers(alloc_specs['worker_ranks'], c['color'], sim_specs, gen_specs)
+    elif isinstance(c['comm'], MPI.Comm):
+        comm = MPIComm(c['comm'])
+    else:
+        comm = c['comm']
+    c = dict(c, comm=comm)
+
     # When timing libEnsemble, uncomment barrier to ensure manager and workers are in sync
     # comm.Barrier()
 
+    sub_managers = alloc_specs.get('sub_managers', {})
+    sub_worker_ranks = dict((w, s) for s in sub_managers for w in sub_managers[s])
+
     if comm.Get_rank() in alloc_specs['manager_ranks']:
         H, gen_info, exit_flag = manager_main(comm, alloc_specs, sim_specs, gen_specs, failure_processing, exit_criteria, H0)
         # if exit_flag == 0:
         #     comm.Barrier()
+    elif comm.Get_rank() in sub_managers:
+        sub_manager_main(comm, sub_managers[comm.Get_rank()], sim_specs, alloc_specs); H=gen_info=exit_flag=[]
     elif comm.Get_rank() in alloc_specs['worker_ranks']:
         worker_main(c, sim_specs, gen_specs); H=gen_info=exit_flag=[]
         # comm.Barrier()
+    elif comm.Get_rank() in sub_worker_ranks:
+        worker_main(dict(c, manager=sub_worker_ranks[comm.Get_rank()]), sim_specs, gen_specs); H=gen_info=exit_flag=[]
     else:
         print("Rank: %d not manager or worker" % comm.Get_rank()); H=gen_info=exit_flag=[]
 
+    for p in procs:
+        p.join()
+
     return H, gen_info, exit_flag
 
 
@@ -81,10 +119,34 @@ def check_inputs(c, alloc_specs, sim_specs, gen_specs, failure_processing, exit_
     assert isinstance(sim_specs,dict), "sim_specs must be a dictionary"
     assert isinstance(gen_specs,dict), "gen_specs must be a dictionary"
     assert isinstance(c,dict), "c must be a dictionary"
+    if c.get('comm') == 'local':
+        assert alloc_specs['manager_ranks'] == set([0]), "The manager must be rank 0 when c['comm'] is 'local'"
     assert isinstance(alloc_specs,dict), "alloc_specs must be a dictionary"
     assert isinstance(exit_criteria,dict), "exit_criteria must be a dictionary"
     assert isinstance(alloc_specs['worker_ranks'],set), "alloc_specs['worker_ranks'] must be a dictionary"
     assert isinstance(alloc_specs['manager_ranks'],set), "alloc_specs['manager_ranks'] must be a dictionary"
+    if 'H_file' in alloc_specs:
+        assert isinstance(alloc_specs['H_file'],str), "alloc_specs['H_file'] must be a string (the file to map H from)"
+    if 'sub_managers' in alloc_specs:
+        sub_workers = [w for s in alloc_specs['sub_managers'] for w in alloc_specs['sub_managers'][s]]
+        assert set(alloc_specs['sub_managers']).issubset(alloc_specs['worker_ranks']), "Sub-managers must be in alloc_specs['worker_ranks']"
+        assert len(set(sub_workers)) == len(sub_workers) and not alloc_specs['worker_ranks'].intersection(sub_workers), \
+               "Each sub-manager's workers must be distinct and not in alloc_specs['worker_ranks']"
+        assert c.get('comm') != 'local', "Sub-managers need a communicator between all ranks"
+    if 'store' in sim_specs:
+        assert 'file' in sim_specs['store'] and 'version' in sim_specs['store'], "sim_specs['store'] must have a 'file' and a sim 'version' tag"
+    if 'batch_efficiency' in sim_specs:
+        assert 0 < sim_specs['batch_efficiency'] < 1, "sim_specs['batch_efficiency'] must be in (0, 1)"
+    for specs in [sim_specs, gen_specs]:
+        if 'journal_file' in specs:
+            assert isinstance(specs['journal_file'],str), "'journal_file' must be a string (the file to write the History journal to)"
+            assert 'save_every_k' in sim_specs or 'save_every_k' in gen_specs, "'journal_file' is only written when 'save_every_k' is set"
+    if 'memo_tol' in sim_specs:
+        assert sim_specs['memo_tol'] >= 0, "sim_specs['memo_tol'] must be nonnegative"
+    if 'queue_depth' in alloc_specs:
+        assert alloc_specs['queue_depth'] >= 1, "alloc_specs['queue_depth'] must be at least 1"
+    if alloc_specs.get('share_H'):
+        assert 'H_file' in alloc_specs, "alloc_specs['share_H'] requires alloc_specs['H_file'] (e.g., a file in /dev/shm)"
 
     assert len(exit_criteria)>0, "Must have some exit criterion"
     valid_term_fields = ['sim_max','gen_max','elapsed_wallclock_time','stop_val']
@@ -100,6 +162,10 @@ def check_inputs(c, alloc_specs, sim_specs, gen_specs, failure_processing, exit_
                "Can't stop on " + exit_criteria['stop_val'][0] + " if it's not \
                returned from sim_specs['out'] or gen_specs['out']"
     
+    if 'state_key' in sim_specs:
+        assert 'setup_f' in sim_specs, "sim_specs['state_key'] is only used with a persistent sim state from sim_specs['setup_f']"
+        assert sim_specs['state_key'] in [e[0] for e in gen_specs['out']], "sim_specs['state_key'] must be a field in gen_specs['out']"
+
     if 'num_inst' in gen_specs and 'batch_mode' in gen_specs:
         assert gen_specs['num_inst'] <= 1 or not gen_specs['batch_mode'],\
                "Can't have more than one 'num_inst' for 'batch_mode' generator"
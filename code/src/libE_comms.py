@@ -0,0 +1,513 @@
+"""
+libEnsemble communication routines
+====================================================
+
+The manager and workers talk through a communicator backend with the methods
+of MPIComm (the default, over an mpi4py communicator): Get_rank, Get_size,
+send/recv of picklable objects, send_envelope/recv_envelope,
+isend_envelope/wait_sends and result_receiver. libE_local.LocalComm is a backend over multiprocessing
+pipes, for running on one node without MPI. Workers are stopped with
+stop_workers, which receives whatever they still send until each replies to
+STOP_TAG.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+import time
+
+from message_numbers import STOP_TAG
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class LazyMPI(object):
+    """
+    Stands in for mpi4py's MPI module, which is imported (initializing MPI)
+    only when one of its attributes is first used. Importing libEnsemble then
+    doesn't initialize MPI, so the local backend can fork its workers first.
+    """
+
+    def __getattr__(self, name):
+        from mpi4py import MPI as module
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+MPI = LazyMPI()
+
+# Every message between the manager and a worker is a single envelope: a
+# header of HEADER_LEN int64 values (tag, length of the pickled metadata,
+# number of typed rows, total length), the pickled metadata padded to a
+# multiple of 8 bytes, and the raw bytes of the typed rows. Receive buffers
+# hold ENVELOPE_SIZE bytes. A longer envelope is sent as a first message that
+# fills the receive buffer and a second message with the rest.
+HEADER_LEN = 4
+HEADER_BYTES = HEADER_LEN*8
+ENVELOPE_SIZE = 2**13
+
+
+def packed_dtype(dtype, fields):
+    """
+    Returns a dtype containing only the given fields of dtype, with no padding
+    between them. (Selecting fields from a structured array keeps the
+    itemsize and offsets of the full array, which is not what should be sent.)
+    """
+    return np.dtype([(field, dtype.fields[field][0]) for field in fields])
+
+
+def pack_envelope(tag, meta, num_rows=-1, dtype=None):
+    """
+    Builds an envelope for the (picklable) meta and num_rows rows of dtype.
+
+    Returns the envelope and a structured array of num_rows rows that is a
+    view into its payload. The caller fills this array in place, so rows are
+    copied only once, directly into the message. With num_rows=-1 the
+    envelope carries no rows and None is returned in place of the array.
+    """
+    meta_bytes = pickle.dumps(meta, pickle.HIGHEST_PROTOCOL)
+    meta_len = len(meta_bytes)
+    start = HEADER_BYTES + 8*((meta_len + 7)//8)
+
+    if num_rows >= 0:
+        total = start + num_rows*dtype.itemsize
+    else:
+        total = start
+
+    buf = np.empty(total, dtype=np.uint8)
+    buf[:HEADER_BYTES].view(np.int64)[:] = [tag, meta_len, num_rows, total]
+    buf[HEADER_BYTES:HEADER_BYTES+meta_len] = np.frombuffer(meta_bytes, dtype=np.uint8)
+
+    return buf, rows_view(buf, start, num_rows, dtype)
+
+
+def unpack_envelope(buf, dtype):
+    """
+    Returns the metadata in an envelope and its rows as a structured array of
+    dtype (or None if it has no rows). The rows are a view into buf.
+    """
+    tag, meta_len, num_rows, total = buf[:HEADER_BYTES].view(np.int64)
+
+    meta = pickle.loads(buf[HEADER_BYTES:HEADER_BYTES+meta_len].tobytes())
+    start = HEADER_BYTES + 8*((meta_len + 7)//8)
+
+    return meta, rows_view(buf, start, num_rows, dtype)
+
+
+def rows_view(buf, start, num_rows, dtype):
+    """
+    Views num_rows rows of dtype in buf, starting at byte start
+    """
+    if num_rows < 0:
+        return None
+
+    if dtype.itemsize == 0:
+        # Nothing to send when no fields are requested
+        return np.zeros(num_rows, dtype=dtype)
+
+    return buf[start:start+num_rows*dtype.itemsize].view(dtype)
+
+
+def send_envelope(comm, buf, dest, tag):
+    """
+    Sends an envelope, splitting it in two if it is longer than the receive
+    buffer
+    """
+    if len(buf) <= ENVELOPE_SIZE:
+        comm.Send([buf, MPI.BYTE], dest=dest, tag=tag)
+    else:
+        comm.Send([buf[:ENVELOPE_SIZE], MPI.BYTE], dest=dest, tag=tag)
+        comm.Send([buf[ENVELOPE_SIZE:], MPI.BYTE], dest=dest, tag=tag)
+
+
+def isend_envelope(comm, buf, dest, tag):
+    """
+    Nonblocking version of send_envelope. Returns the MPI requests.
+    """
+    if len(buf) <= ENVELOPE_SIZE:
+        return [comm.Isend([buf, MPI.BYTE], dest=dest, tag=tag)]
+    else:
+        return [comm.Isend([buf[:ENVELOPE_SIZE], MPI.BYTE], dest=dest, tag=tag),
+                comm.Isend([buf[ENVELOPE_SIZE:], MPI.BYTE], dest=dest, tag=tag)]
+
+
+def complete_envelope(comm, buf, source, tag):
+    """
+    Given a receive buffer whose first part of an envelope has arrived,
+    receives the rest of the envelope if it didn't fit. Returns the full
+    envelope.
+    """
+    total = buf[:HEADER_BYTES].view(np.int64)[3]
+
+    if total <= len(buf):
+        return buf
+
+    full = np.empty(total, dtype=np.uint8)
+    full[:len(buf)] = buf
+    comm.Recv([full[len(buf):], MPI.BYTE], source=source, tag=tag)
+
+    return full
+
+
+def recv_envelope(comm, buf, source, status):
+    """
+    Blocking receive of an envelope into the preallocated buffer buf (unless
+    it doesn't fit). The tag of the envelope is set in status.
+    """
+    comm.Recv([buf, MPI.BYTE], source=source, tag=MPI.ANY_TAG, status=status)
+
+    return complete_envelope(comm, buf, source, status.Get_tag())
+
+
+class MPIComm(object):
+    """
+    Communicator backend over an mpi4py communicator
+
+    Parameters
+    ----------
+    comm: MPI communicator
+        Communicator shared by the manager and workers
+    """
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.status = MPI.Status()
+        # Envelopes sent with isend_envelope (kept alive until they complete)
+        # and their requests
+        self.pending = []
+
+    def Get_rank(self):
+        return self.comm.Get_rank()
+
+    def Get_size(self):
+        return self.comm.Get_size()
+
+    def send(self, obj, dest):
+        """
+        Sends a picklable object
+        """
+        self.comm.send(obj=obj, dest=dest)
+
+    def recv(self, source):
+        """
+        Blocking receive of a picklable object
+        """
+        return self.comm.recv(buf=None, source=source)
+
+    def send_envelope(self, buf, dest, tag):
+        """
+        Sends an envelope (see pack_envelope)
+        """
+        send_envelope(self.comm, buf, dest, tag)
+
+    def isend_envelope(self, buf, dest, tag):
+        """
+        Sends an envelope without waiting for dest to receive it (e.g., when
+        dest is busy and will receive it after its current calculation).
+        Envelopes are received in the order they are sent.
+        """
+        self.pending = [(b, reqs) for b, reqs in self.pending if not MPI.Request.Testall(reqs)]
+        self.pending.append((buf, isend_envelope(self.comm, buf, dest, tag)))
+
+    def wait_sends(self):
+        """
+        Waits until every envelope sent with isend_envelope has been received
+        """
+        for _, reqs in self.pending:
+            MPI.Request.Waitall(reqs)
+        self.pending = []
+
+    def recv_envelope(self, buf, source):
+        """
+        Blocking receive of an envelope into the preallocated buffer buf
+        (unless it doesn't fit). Returns the envelope and its tag.
+        """
+        msg = recv_envelope(self.comm, buf, source, self.status)
+        return msg, self.status.Get_tag()
+
+    def result_receiver(self, worker_ranks, out_dtypes, deadline=None):
+        """
+        Returns a ResultReceiver for calculation output from worker_ranks
+        """
+        return ResultReceiver(self.comm, worker_ranks, out_dtypes, deadline)
+
+
+def is_typed_output(calc_out, out_dtype):
+    """
+    True if calc_out is a structured array with exactly the fields of
+    out_dtype
+    """
+    return isinstance(calc_out, np.ndarray) and calc_out.dtype.names is not None and set(calc_out.dtype.names) == set(out_dtype.names)
+
+
+def pack_result(data_out, calc_tag, out_dtype):
+    """
+    Packs calculation output into one envelope.
+
+    If calc_out has exactly the fields of out_dtype, it is copied into the
+    typed rows of the envelope and gen_info and libE_info are pickled.
+    Otherwise all of data_out is pickled. (data_out has no calc_out when a
+    worker has written it into a shared H.)
+    """
+    calc_out = data_out.get('calc_out')
+
+    if is_typed_output(calc_out, out_dtype):
+        buf, rows = pack_envelope(calc_tag, {'gen_info': data_out['gen_info'], 'libE_info': data_out['libE_info']}, len(calc_out), out_dtype)
+        for field in out_dtype.names:
+            rows[field] = calc_out[field]
+    else:
+        buf, _ = pack_envelope(calc_tag, data_out)
+
+    return buf
+
+
+def send_result(comm, data_out, calc_tag, out_dtype, dest=0):
+    """
+    Sends calculation output from a worker to the manager in one envelope
+    (see pack_result) through the communicator backend comm.
+    """
+    comm.send_envelope(pack_result(data_out, calc_tag, out_dtype), dest, calc_tag)
+
+
+class ResultReceiver(object):
+    """
+    Collects calculation output on the manager with posted nonblocking receives.
+
+    A nonblocking receive of a worker's output envelope (see send_result) into
+    a preallocated buffer is posted when work is given to the worker. wait()
+    then sleeps in MPI Waitsome until at least one envelope has arrived and
+    unpacks the output from every worker whose receive has completed, so all
+    results available at a wakeup are handled together.
+
+    The calc_out rows returned by wait() are a view into the worker's receive
+    buffer, so they must be used before the next receive from that worker is
+    posted.
+
+    Parameters
+    ----------
+    comm: MPI communicator
+        Communicator shared by the manager and workers
+
+    worker_ranks: set
+        Ranks that may be given work
+
+    out_dtypes: dict
+        The dtype of calc_out for each calculation tag
+
+    deadline: float
+        If given, wait() never sleeps past this time (in seconds since the
+        epoch). Waitsome can't time out, so a deadline makes wait() poll with
+        Testsome and a sleep that doubles up to max_delay.
+
+    Attributes
+    ----------
+    wakeups: integer
+        Number of times wait() returned output
+
+    completions: integer
+        Number of results returned by wait()
+    """
+
+    def __init__(self, comm, worker_ranks, out_dtypes, deadline=None, max_delay=0.01):
+        self.comm = comm
+        self.ranks = sorted(worker_ranks)
+        self.slots = dict((w, i) for i, w in enumerate(self.ranks))
+        self.out_dtypes = out_dtypes
+        self.buffers = np.empty((len(self.ranks), ENVELOPE_SIZE), dtype=np.uint8)
+        self.requests = [MPI.REQUEST_NULL]*len(self.ranks)
+        self.statuses = [MPI.Status() for _ in self.ranks]
+        self.num_posted = 0
+
+        self.deadline = deadline
+        self.max_delay = max_delay
+
+        self.wakeups = 0
+        self.completions = 0
+
+    def post(self, w):
+        """
+        Posts a receive for the next output envelope from worker w
+        """
+        i = self.slots[w]
+        assert self.requests[i] == MPI.REQUEST_NULL, "Worker " + str(w) + " already has a posted receive"
+
+        self.requests[i] = self.comm.Irecv([self.buffers[i], MPI.BYTE], source=w, tag=MPI.ANY_TAG)
+        self.num_posted += 1
+
+    def is_posted(self, w):
+        """
+        True if a receive is posted for worker w
+        """
+        return self.requests[self.slots[w]] != MPI.REQUEST_NULL
+
+    def wait(self):
+        """
+        Blocks until at least one posted receive completes (or the deadline
+        passes) and returns a list of (worker, tag, output) tuples, one for
+        each completed receive.
+        """
+        if self.num_posted == 0:
+            return []
+
+        if self.deadline is None:
+            inds = MPI.Request.Waitsome(self.requests, self.statuses)
+        else:
+            inds = self.poll(self.deadline - time.time())
+
+        if not inds:
+            return []
+
+        received = []
+        for i, status in zip(inds, self.statuses):
+            w = self.ranks[i]
+            tag = status.Get_tag()
+
+            buf = complete_envelope(self.comm, self.buffers[i], w, tag)
+            D, calc_out = unpack_envelope(buf, self.out_dtypes.get(tag))
+            if calc_out is not None:
+                D['calc_out'] = calc_out
+
+            received.append((w, tag, D))
+
+        self.num_posted -= len(inds)
+        self.wakeups += 1
+        self.completions += len(inds)
+
+        return received
+
+    def poll(self, timeout):
+        """
+        Calls Testsome until some receive completes or timeout seconds pass.
+        Returns the indices of completed requests.
+        """
+        end = time.time() + timeout
+        delay = 1e-5
+
+        while 1:
+            inds = MPI.Request.Testsome(self.requests, self.statuses)
+            if inds:
+                return inds
+
+            remaining = end - time.time()
+            if remaining <= 0:
+                return []
+
+            time.sleep(min(delay, remaining))
+            delay = min(2*delay, self.max_delay)
+
+    def cancel(self):
+        """
+        Cancels all posted receives. (A worker whose output doesn't fit in
+        one message may then block forever sending it, so workers are stopped
+        with stop_workers instead.)
+        """
+        for i, req in enumerate(self.requests):
+            if req != MPI.REQUEST_NULL:
+                req.Cancel()
+                req.Wait()
+                self.requests[i] = MPI.REQUEST_NULL
+        self.num_posted = 0
+
+    def completions_per_wakeup(self):
+        """
+        Average number of results handled each time wait() returned output
+        """
+        if self.wakeups == 0:
+            return 0.0
+        return self.completions/self.wakeups
+
+
+def stop_workers(comm, receiver, ranks):
+    """
+    Sends STOP_TAG to each of ranks, then receives (and discards) whatever
+    they still send until each has replied with STOP_TAG, which a worker does
+    as it exits. So no worker is left blocked sending output (e.g., the
+    second part of an envelope longer than ENVELOPE_SIZE) that nothing will
+    receive.
+
+    A worker finishes the work it was given before it reads STOP_TAG, so this
+    waits for calculations that are still running.
+    """
+    buf, _ = pack_envelope(STOP_TAG, None)
+    for w in ranks:
+        comm.send_envelope(buf, w, STOP_TAG)
+
+    receiver.deadline = None
+    stopping = set(ranks)
+    for w in stopping:
+        if not receiver.is_posted(w):
+            receiver.post(w)
+
+    while stopping:
+        for w, tag, _ in receiver.wait():
+            if tag == STOP_TAG:
+                stopping.remove(w)
+            else:
+                receiver.post(w)
+
+    comm.wait_sends()
+
+
+class ManagerChannel(object):
+    """
+    Lets a persistent gen_f exchange data with the manager while it runs. A
+    worker gives one to the gen_f as libE_info['comm'] when the work has
+    libE_info['persistent'] set.
+
+    Parameters
+    ----------
+    comm: communicator backend (e.g., MPIComm)
+        Communicator shared by the manager and workers
+
+    in_dtype, out_dtype: numpy dtype
+        The dtypes of the rows the calculation receives/sends
+
+    calc_tag: integer
+        The tag of the calculation (EVAL_GEN_TAG)
+
+    manager: integer
+        Rank of the manager
+
+    Attributes
+    ----------
+    stopped: boolean
+        True once the manager has sent STOP_TAG. The calculation should then
+        return, and the worker exits.
+    """
+
+    def __init__(self, comm, in_dtype, out_dtype, calc_tag, manager=0):
+        self.comm = comm
+        self.manager = manager
+        self.in_dtype = in_dtype
+        self.out_dtype = out_dtype
+        self.calc_tag = calc_tag
+        self.buf = np.empty(ENVELOPE_SIZE, dtype=np.uint8)
+        self.stopped = False
+
+    def send(self, calc_out, gen_info={}):
+        """
+        Sends rows of output to the manager without waiting for the manager
+        to receive them (the manager may be sending to this worker at the
+        same time). The manager adds them to H and the calculation keeps
+        running. The worker waits for these sends to complete before it exits.
+        """
+        buf = pack_result({'calc_out': calc_out, 'gen_info': gen_info, 'libE_info': {'persistent': True}}, self.calc_tag, self.out_dtype)
+        self.comm.isend_envelope(buf, self.manager, self.calc_tag)
+
+    def recv(self):
+        """
+        Blocks until the manager sends something. Returns the tag, libE_info
+        and rows of H (a copy, typed with in_dtype). After STOP_TAG, libE_info
+        and the rows are None.
+        """
+        msg, tag = self.comm.recv_envelope(self.buf, self.manager)
+
+        if tag == STOP_TAG:
+            self.stopped = True
+            return tag, None, None
+
+        D, calc_in = unpack_envelope(msg, self.in_dtype)
+        return tag, D['libE_info'], calc_in.copy()
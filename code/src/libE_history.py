@@ -0,0 +1,593 @@
+"""
+libEnsemble history routines
+====================================================
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+import time
+
+from libE_fields import libE_fields
+from libE_priority import PriorityQueue
+from libE_memo import EvaluationCache
+from libE_store import EvaluationStore
+
+
+class History(object):
+    """
+    The History array H and the number of points recorded in it.
+
+    H is over-allocated: rows [0, index) hold points and the remaining rows
+    are spare capacity (with sim_id = -1 and given_time = inf). When a gen_func
+    returns more points than there are spare rows, the capacity of H is at
+    least doubled, so adding a point costs amortized O(1) instead of a copy of
+    all of H.
+
+    If H_file is given, H is a np.memmap backed by that file, so the operating
+    system can page rows that aren't being used out of memory. Growing H then
+    extends the file and maps it again rather than copying H. Workers on the
+    same node can also map the file (see map_H), and then read their input
+    rows and write sim output without the rows being sent.
+
+    Attributes
+    ----------
+    H: numpy structured array
+        History array storing rows for each point (and spare rows). Field
+        names are in code/src/libE_fields.py
+
+    index: integer
+        Where libEnsemble should start filling in H (the number of points in H)
+
+    given_count, returned_count: integer
+        Number of points that have been given out/returned (including H0)
+
+    stop_field: string
+        The field in exit_criteria['stop_val'] (or None)
+
+    stop_min: float
+        Smallest non-NaN value of stop_field recorded in H
+
+    The counts and stop_min are updated with H, so checking the exit criteria
+    doesn't require scanning H. The counts include points given to memo,
+    but those raise given_max, so they don't count toward sim_max.
+
+    journal: HistoryJournal
+        If not None, is told which rows change (see libE_journal.py)
+
+    ready: ReadyRows
+        The rows that can be given out to be evaluated
+
+    priority: PriorityQueue
+        The same rows ordered by H['priority'] (or None if H has no priority
+        field)
+
+    epoch: integer
+        Incremented each time rows are sent to a gen worker's replica of H
+
+    modified: numpy integer array
+        modified[i] is the epoch in which row i was last updated
+
+    replica_epochs: dict
+        The epoch in which each gen worker's replica was last updated
+
+    shared_w: set
+        Workers that map H_file
+
+    queue_fields: numpy structured array
+        The paused and priority fields of H as the History last set them, so
+        changes a queue_update_function makes directly to H can be found
+        (see update_queue_fields)
+
+    given_max: integer or inf
+        The given_count at which sim_max is reached (counting the points
+        given to memo)
+
+    memo: EvaluationCache
+        If sim_specs['memo'] is set, new points matching a point that has
+        been given out get its sim output instead of being evaluated (see
+        libE_memo.py). If sim_specs['store'] is set, points evaluated in
+        earlier runs are matched too (see libE_store.py). Otherwise None.
+
+    sim_row_time, sim_overhead: float
+        Moving averages of the sim_f time per row and of the time a worker
+        waits for sim work after returning output (None until measured; see
+        update_sim_timing)
+    """
+
+    def __init__(self, sim_specs, gen_specs, exit_criteria, H0, H_file=None):
+        """
+        Forms the History array, prepended with the rows of H0. Space is
+        reserved for sim_max points (or 100 if sim_max is not given).
+        """
+        if 'sim_max' in exit_criteria:
+            L = exit_criteria['sim_max']
+        else:
+            L = 100
+
+        self.H_file = H_file
+        H = self.allocate(L + len(H0), np.dtype(list(set(libE_fields + sim_specs['out'] + gen_specs['out']))))
+
+        if len(H0):
+            fields = H0.dtype.names
+
+            for field in fields:
+                H[field][:len(H0)] = H0[field]
+                # for ind, val in np.ndenumerate(H0[field]): # Works if H0[field] has arbitrary dimension but is slow
+                #     H[field][ind] = val
+
+        # Prepend H with H0
+        H['sim_id'][:len(H0)] = np.arange(0,len(H0))
+        H['given'][:len(H0)] = 1
+        H['returned'][:len(H0)] = 1
+
+        H['sim_id'][-L:] = -1
+        H['given_time'][-L:] = np.inf
+
+        self.H = H
+        self.index = len(H0)
+
+        self.given_count = len(H0)
+        self.returned_count = len(H0)
+        self.given_max = exit_criteria.get('sim_max', np.inf) + len(H0)
+
+        if 'stop_val' in exit_criteria:
+            self.stop_field = exit_criteria['stop_val'][0]
+        else:
+            self.stop_field = None
+        self.stop_min = np.inf
+        if len(H0):
+            self.update_stop_min(H0)
+
+        self.journal = None
+
+        self.epoch = 0
+        self.modified = np.zeros(len(H), dtype=int)
+        self.replica_epochs = {}
+        self.shared_w = set()
+
+        self.queue_fields = np.zeros(len(H), dtype=packed_queue_dtype(H.dtype))
+        self.save_queue_fields(np.arange(len(H0)))
+
+        self.ready = ReadyRows(len(H))
+
+        self.sim_row_time = None
+        self.sim_overhead = None
+
+        if 'priority' in H.dtype.names:
+            self.priority = PriorityQueue(len(H))
+        else:
+            self.priority = None
+
+        if sim_specs.get('memo') or 'store' in sim_specs:
+            if 'store' in sim_specs:
+                s = sim_specs['store']
+                store = EvaluationStore(s['file'], s['version'], sim_specs['out'], s.get('max_entries'), s.get('prefetch'))
+            else:
+                store = None
+            self.memo = EvaluationCache(sim_specs['in'], [f[0] for f in sim_specs['out']], sim_specs.get('memo_tol', 0), store)
+            self.memo.add(H, np.arange(len(H0)))
+        else:
+            self.memo = None
+
+    def trim(self):
+        """
+        Returns the rows of H holding points (a view, not a copy)
+        """
+        return self.H[:self.index]
+
+    def update_history_f(self, D):
+        """
+        Updates the history (in place) after points have been evaluated. If
+        D has no calc_out, a worker mapping H_file has already written it.
+
+        Returns the points that were waiting in memo for these points, which
+        now have their output too.
+        """
+
+        new_inds = D['libE_info']['H_rows']
+
+        if 'calc_out' in D:
+            scatter_rows(self.H, new_inds, D['calc_out'])
+            self.update_stop_min(D['calc_out'])
+        elif self.stop_field is not None:
+            self.update_stop_min(self.H[new_inds])
+        self.modified[new_inds] = self.epoch
+
+        self.returned_count += np.count_nonzero(~self.H['returned'][new_inds])
+        self.H['returned'][new_inds] = True
+
+        if self.journal is not None:
+            self.journal.mark(new_inds)
+
+        if self.memo is None:
+            return np.zeros(0, dtype=int)
+
+        filled = self.memo.release(self.H, new_inds)
+        self.mark_filled(filled)
+        return filled
+
+    def update_sim_timing(self, libE_info, weight=0.25):
+        """
+        Updates sim_row_time and sim_overhead with the calc_time and
+        wait_time a worker measured for a sim call (see libE_worker.py).
+        Older measurements count for (1 - weight) of the averages.
+        """
+        if 'calc_time' in libE_info and len(libE_info['H_rows']):
+            t = libE_info['calc_time']/len(libE_info['H_rows'])
+            self.sim_row_time = t if self.sim_row_time is None else (1-weight)*self.sim_row_time + weight*t
+
+        if 'wait_time' in libE_info:
+            t = libE_info['wait_time']
+            self.sim_overhead = t if self.sim_overhead is None else (1-weight)*self.sim_overhead + weight*t
+
+    def update_history_x_out(self, q_inds, sim_rank):
+        """
+        Updates the history (in place) when new points have been given out to be
+        evaluated. All points in a dispatch share one given_time.
+
+        """
+
+        self.given_count += np.count_nonzero(~self.H['given'][q_inds])
+        self.H['given'][q_inds] = True
+        self.take(q_inds)
+        self.H['given_time'][q_inds] = time.time()
+        self.H['sim_rank'][q_inds] = sim_rank
+        self.modified[q_inds] = self.epoch
+
+        if self.journal is not None:
+            self.journal.mark(q_inds)
+
+        if self.memo is not None:
+            self.mark_memo_given(self.memo.add(self.H, q_inds))
+
+    def update_history_x_in(self, gen_rank, O):
+        """
+        Updates the history when new points have been returned from a gen.
+        H is reallocated (see grow_H) if it doesn't have room for them.
+
+        New points that match a point in memo aren't made ready (see
+        libE_memo.py). Returns those that got their sim output from memo.
+
+        Parameters
+        ----------
+        gen_rank: integer
+            The rank of the worker who generated these points
+        O: numpy array
+            Output from gen_func
+        """
+
+        H_ind = self.index
+
+        if 'sim_id' not in O.dtype.names:
+            # gen method must not be adjusting sim_id, just append to H
+            num_new = len(O)
+            self.grow_H(num_new)
+
+            update_inds = np.arange(H_ind,H_ind+num_new)
+            self.H['sim_id'][H_ind:H_ind+num_new] = update_inds
+        else:
+            # gen method is building sim_id.
+            num_new = len(np.setdiff1d(O['sim_id'],self.H['sim_id']))
+            self.grow_H(num_new)
+
+            update_inds = O['sim_id']
+
+        scatter_rows(self.H, update_inds, O)
+        self.update_stop_min(O)
+
+        self.index += num_new
+        self.H['gen_rank'][update_inds] = gen_rank
+        self.modified[update_inds] = self.epoch
+        self.save_queue_fields(update_inds)
+        ready_inds = update_inds[~self.H['given'][update_inds]]
+
+        filled = np.zeros(0, dtype=int)
+        if self.memo is not None and len(ready_inds):
+            filled, waiting, held = self.memo.match(self.H, ready_inds)
+            self.mark_memo_given(np.append(filled, waiting))
+            self.mark_filled(filled)
+            ready_inds = ready_inds[~self.H['given'][ready_inds]]
+            ready_inds = np.setdiff1d(ready_inds, held)
+
+        self.ready.add(ready_inds)
+        if self.priority is not None:
+            self.priority.add(ready_inds, self.H['priority'][ready_inds])
+
+        if self.journal is not None:
+            self.journal.mark(update_inds)
+
+        return filled
+
+    def save_queue_fields(self, rows):
+        """
+        Records the paused and priority fields of rows as the History has set
+        them
+        """
+        for field in self.queue_fields.dtype.names:
+            self.queue_fields[field][rows] = self.H[field][rows]
+
+    def update_queue_fields(self):
+        """
+        Finds the rows whose paused or priority field has been changed
+        directly in H (by a queue_update_function) since the History last set
+        them, and records those changes like its own updates of H (so they
+        are journaled). Returns the rows.
+
+        Paused rows are dropped from the ready rows, so rows that have been
+        unpaused (and not given out) are made ready again. Rows in the
+        priority queue whose priority changed are reordered.
+        """
+        if self.priority is not None:
+            self.priority.refresh(self.H)
+
+        n = self.index
+        changed = np.zeros(n, dtype=bool)
+        for field in self.queue_fields.dtype.names:
+            old, new = self.queue_fields[field][:n], self.H[field][:n]
+            changed |= (old != new) & ~(is_nan(old) & is_nan(new))
+
+        rows = np.flatnonzero(changed)
+        if not len(rows):
+            return rows
+
+        unpaused = rows[self.queue_fields['paused'][rows] & ~self.H['paused'][rows] & ~self.H['given'][rows]]
+        if self.memo is not None:
+            unpaused = unpaused[~self.memo.holds(unpaused)]
+        self.ready.add(unpaused)
+        if self.priority is not None:
+            self.priority.add(unpaused, self.H['priority'][unpaused])
+
+        self.save_queue_fields(rows)
+        self.modified[rows] = self.epoch
+        if self.journal is not None:
+            self.journal.mark(rows)
+
+        return rows
+
+    def mark_memo_given(self, rows):
+        """
+        Records that rows (not given before) are given to memo, to get the
+        output of another row, rather than to a worker
+        """
+        if len(rows):
+            self.H['given'][rows] = True
+            self.given_count += len(rows)
+            self.given_max += len(rows)
+            self.modified[rows] = self.epoch
+            if self.journal is not None:
+                self.journal.mark(rows)
+
+    def mark_filled(self, rows):
+        """
+        Records that rows got their sim output from memo
+        """
+        if len(rows):
+            if self.stop_field is not None:
+                self.update_stop_min(self.H[rows])
+            self.returned_count += len(rows)
+            self.modified[rows] = self.epoch
+            if self.journal is not None:
+                self.journal.mark(rows)
+
+    def update_stop_min(self, O):
+        """
+        Lowers stop_min if O has a smaller (non-NaN) value of stop_field
+        """
+        if self.stop_field is None or O.dtype.names is None or self.stop_field not in O.dtype.names:
+            return
+
+        vals = O[self.stop_field]
+        vals = vals[~np.isnan(vals)]
+        if len(vals):
+            self.stop_min = min(self.stop_min, np.min(vals))
+
+    def allocate(self, n, dtype):
+        """
+        Returns n zeroed rows of dtype, in memory or (if H_file was given)
+        mapped from H_file
+        """
+        if self.H_file is None:
+            return np.zeros(n, dtype=dtype)
+
+        return np.memmap(self.H_file, dtype=dtype, mode='w+', shape=(max(n,1),))[:n]
+
+    def grow_H(self, k):
+        """
+        Makes room for k rows past index. If there aren't enough spare rows,
+        H is copied into an array with at least twice the capacity. (A
+        memory-mapped H is instead extended in place, see History.)
+        """
+        needed = self.index + k
+        capacity = len(self.H)
+
+        if needed <= capacity:
+            return
+
+        new_capacity = max(needed, 2*capacity)
+
+        if self.H_file is None:
+            H = np.zeros(new_capacity, dtype=self.H.dtype)
+            H[:capacity] = self.H
+        else:
+            # The file grows with zeros, and rows already in it keep their place
+            self.H.flush()
+            with open(self.H_file, 'r+b') as f:
+                f.truncate(new_capacity*self.H.dtype.itemsize)
+            H = np.memmap(self.H_file, dtype=self.H.dtype, mode='r+', shape=(new_capacity,))
+
+        H['sim_id'][capacity:] = -1
+        H['given_time'][capacity:] = np.inf
+
+        self.H = H
+        self.modified = np.append(self.modified, np.zeros(new_capacity-capacity, dtype=int))
+        self.queue_fields = np.append(self.queue_fields, np.zeros(new_capacity-capacity, dtype=self.queue_fields.dtype))
+        self.ready.grow(new_capacity)
+        if self.priority is not None:
+            self.priority.grow(new_capacity)
+
+    def replica_delta(self, w):
+        """
+        Returns the rows that were updated since they were last sent to the
+        replica of H on gen worker w (all rows, the first time), and starts a
+        new epoch. (Changes a queue_update_function makes directly to H are
+        tracked once update_queue_fields has found them.)
+        """
+        since = self.replica_epochs.get(w, -1)
+        rows = np.flatnonzero(self.modified[:self.index] > since)
+
+        self.replica_epochs[w] = self.epoch
+        self.epoch += 1
+
+        return rows
+
+    def take(self, inds):
+        """
+        Removes rows inds from the ready rows (e.g., when an alloc function
+        puts them in Work, or they are given out)
+        """
+        self.ready.remove(inds)
+        if self.priority is not None:
+            self.priority.remove(inds)
+
+    def take_next(self, k):
+        """
+        Takes and returns up to k ready rows: those with the highest priority
+        if H has a priority field, otherwise the oldest
+        """
+        if self.priority is None:
+            rows = self.ready.next(self.H, k)
+            self.take(rows)
+            return rows
+
+        rows = []
+        while len(rows) < k:
+            row = self.priority.top(self.H)
+            if row is None:
+                break
+            self.take(row)
+            rows.append(row)
+
+        return np.array(rows, dtype=int)
+
+
+
+class ReadyRows(object):
+    """
+    Index of the rows of H that are ready to be given out (not given and not
+    paused), so alloc functions don't have to search all of H for them.
+
+    Rows are added when a gen returns them and removed when they are given
+    out (or put in Work). Since queue_update_function pauses rows by setting
+    H['paused'] directly, paused rows are dropped when next() reaches them,
+    and added again if they are unpaused (see History.update_queue_fields).
+    The oldest ready row is found in amortized O(1), and the next k in O(k).
+
+    Attributes
+    ----------
+    flags: numpy boolean array
+        flags[i] is True if row i is ready (or paused since it was added)
+
+    head: integer
+        No row before head is ready
+    """
+
+    def __init__(self, capacity):
+        self.flags = np.zeros(capacity, dtype=bool)
+        self.head = capacity
+
+    def grow(self, capacity):
+        """
+        Makes room for rows up to capacity
+        """
+        flags = np.zeros(capacity, dtype=bool)
+        flags[:len(self.flags)] = self.flags
+        self.flags = flags
+
+    def add(self, inds):
+        """
+        Marks rows inds as ready
+        """
+        if len(inds):
+            self.flags[inds] = True
+            self.head = min(self.head, np.min(inds))
+
+    def remove(self, inds):
+        """
+        Marks rows inds as not ready
+        """
+        self.flags[inds] = False
+
+    def next(self, H, k=1):
+        """
+        Returns (up to) the k oldest ready rows, without removing them
+        """
+        found = []
+        i = self.head
+        chunk = max(k, 64)
+
+        while len(found) < k and i < len(self.flags):
+            block = i + np.flatnonzero(self.flags[i:i+chunk])
+            paused = H['paused'][block]
+            self.flags[block[paused]] = False
+
+            found.extend(block[~paused][:k-len(found)])
+            i += chunk
+            chunk *= 2
+
+        self.head = found[0] if found else min(i, len(self.flags))
+
+        return np.array(found, dtype=int)
+
+    def mask(self, H, H_ind):
+        """
+        Returns a boolean array marking the ready rows among the first H_ind
+        """
+        return np.logical_and(self.flags[:H_ind], ~H['paused'][:H_ind])
+
+
+def packed_queue_dtype(dtype):
+    """
+    The dtype of the fields of H a queue_update_function may change (paused,
+    and priority if H has it)
+    """
+    return np.dtype([(field, dtype.fields[field][0]) for field in ['paused', 'priority'] if field in dtype.names])
+
+
+def is_nan(a):
+    """
+    Elementwise isnan for float arrays (all False otherwise)
+    """
+    if a.dtype.kind == 'f':
+        return np.isnan(a)
+    return np.zeros(a.shape, dtype=bool)
+
+
+def map_H(H_file, dtype):
+    """
+    Maps all rows of the History in H_file (e.g., on a worker). The manager
+    only ever extends the file, so mapping it again gives any new rows.
+    """
+    return np.memmap(H_file, dtype=dtype, mode='r+')
+
+
+def read_rows(H, rows, dtype):
+    """
+    Returns the fields of dtype for rows of H, as an array of dtype
+    """
+    out = np.empty(len(rows), dtype=dtype)
+    for field in dtype.names:
+        out[field] = H[field][rows]
+
+    return out
+
+
+def scatter_rows(H, inds, O):
+    """
+    Writes every field of O into rows inds of H (in place) with one
+    fancy-indexed assignment per field, rather than looping over rows.
+    """
+
+    for field in O.dtype.names:
+        H[field][inds] = O[field]
@@ -0,0 +1,188 @@
+"""
+libEnsemble history journal
+====================================================
+
+Checkpoints the History by appending the rows that changed since the last
+checkpoint to a journal file, instead of saving all of H each time.
+
+The journal starts with an int64 length and the pickled dtype of H. After
+that come fixed-size records: an int64 row index followed by the bytes of
+that row of H. A row appears once for every checkpoint it changed in, so the
+full History is rebuilt (see compact_journal) by keeping the last record of
+each row. Execute via the following command to write the rebuilt History
+to an .npy file:
+   python libE_journal.py libE_history_journal.bin libE_history.npy
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+import threading
+import sys
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def record_dtype(dtype):
+    """
+    The dtype of a journal record for rows of dtype
+    """
+    return np.dtype([('row', np.int64), ('data', dtype)])
+
+
+class HistoryJournal(object):
+    """
+    Appends changed rows of H to a journal file on a background thread.
+
+    The History calls mark() with the rows it changes. checkpoint() is called
+    by the manager after receiving output; every sim_k returned points (or
+    gen_k generated points) it copies the marked rows into one of two record
+    buffers and hands it to the writer thread. The manager fills one buffer
+    while the thread writes the other, so it never waits on the filesystem:
+    if both buffers are busy, the rows stay marked and are written at the
+    next checkpoint.
+
+    Parameters
+    ----------
+    filename: string
+        The journal file (overwritten)
+
+    hist: History
+        The History being journaled. Its current rows are marked, so the
+        first checkpoint includes H0.
+
+    sim_k, gen_k: integer
+        Checkpoint every sim_k returned points/gen_k generated points (or
+        never, if None)
+    """
+
+    def __init__(self, filename, hist, sim_k=None, gen_k=None):
+        self.dtype = record_dtype(hist.H.dtype)
+        self.sim_k = sim_k
+        self.gen_k = gen_k
+        self.last_sim = hist.returned_count//sim_k if sim_k else 0
+        self.last_gen = hist.index//gen_k if gen_k else 0
+        self.changed = [np.arange(hist.index)]
+        self.pending = False
+
+        self.buffers = [np.empty(0, dtype=self.dtype), np.empty(0, dtype=self.dtype)]
+        self.free = [0, 1]
+        self.todo = queue.Queue()
+        self.done = queue.Queue()
+
+        self.f = open(filename, 'wb')
+        header = pickle.dumps(hist.H.dtype, pickle.HIGHEST_PROTOCOL)
+        np.array([len(header)], dtype=np.int64).tofile(self.f)
+        self.f.write(header)
+
+        self.writer = threading.Thread(target=self.write_records)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def mark(self, inds):
+        """
+        Records that rows inds of H have changed
+        """
+        self.changed.append(np.atleast_1d(inds))
+
+    def checkpoint(self, hist):
+        """
+        Flushes the changed rows if sim_k more points have been returned or
+        gen_k more generated since the last checkpoint (or if the last flush
+        had to be skipped)
+        """
+        if self.sim_k is not None and hist.returned_count//self.sim_k > self.last_sim:
+            self.last_sim = hist.returned_count//self.sim_k
+            self.pending = True
+
+        if self.gen_k is not None and hist.index//self.gen_k > self.last_gen:
+            self.last_gen = hist.index//self.gen_k
+            self.pending = True
+
+        if self.pending:
+            self.pending = not self.flush(hist.H)
+
+    def flush(self, H):
+        """
+        Hands the changed rows of H to the writer thread. Returns False
+        (leaving the rows marked) if no buffer is free.
+        """
+        while not self.done.empty():
+            self.free.append(self.done.get())
+
+        if not self.free:
+            return False
+
+        if not self.changed:
+            return True
+
+        inds = np.unique(np.concatenate(self.changed))
+        self.changed = []
+
+        i = self.free.pop()
+        if len(self.buffers[i]) < len(inds):
+            self.buffers[i] = np.empty(max(len(inds), 2*len(self.buffers[i])), dtype=self.dtype)
+
+        records = self.buffers[i][:len(inds)]
+        records['row'] = inds
+        records['data'] = H[inds]
+        self.todo.put((i, len(inds)))
+
+        return True
+
+    def write_records(self):
+        """
+        The writer thread: appends the records it is handed to the file
+        """
+        while 1:
+            item = self.todo.get()
+            if item is None:
+                break
+
+            i, n = item
+            self.buffers[i][:n].tofile(self.f)
+            self.f.flush()
+            self.done.put(i)
+
+    def close(self, H):
+        """
+        Writes all remaining changed rows of H and closes the journal. (Waits
+        for the writer thread.)
+        """
+        while not self.flush(H):
+            self.free.append(self.done.get())
+
+        self.todo.put(None)
+        self.writer.join()
+        self.f.close()
+
+
+def compact_journal(filename):
+    """
+    Rebuilds the History from a journal, keeping the last record of each row
+    """
+    with open(filename, 'rb') as f:
+        header_len = np.fromfile(f, dtype=np.int64, count=1)[0]
+        dtype = pickle.loads(f.read(header_len))
+        records = np.fromfile(f, dtype=record_dtype(dtype))
+
+    H = np.zeros(np.max(records['row'])+1 if len(records) else 0, dtype=dtype)
+
+    # np.unique returns the first occurrence of each row, so reverse
+    rows, last = np.unique(records['row'][::-1], return_index=True)
+    H[rows] = records['data'][::-1][last]
+
+    return H
+
+
+if __name__ == "__main__":
+    np.save(sys.argv[2], compact_journal(sys.argv[1]))
@@ -0,0 +1,298 @@
+"""
+libEnsemble local communication backend
+====================================================
+
+Runs the workers as local processes that talk to the manager over
+multiprocessing pipes, so libEnsemble can run on one node without mpiexec.
+Pass c={'comm': 'local', 'color': 0} to libE; one worker process is started
+for each of alloc_specs['worker_ranks'] (which must be 1, ..., n).
+
+Envelopes (see libE_comms) are sent as raw bytes over the pipes; their tag is
+read from the envelope header. Envelopes sent with isend_envelope are written
+by a thread for each destination, so the sender never blocks on a full pipe.
+
+The workers are forked from the calling process, which must not have
+initialized MPI: a forked copy of an MPI process isn't a valid MPI process.
+libEnsemble only imports mpi4py when MPI is used (see libE_comms.LazyMPI), so
+the calling script must not import mpi4py.MPI (or an MPI-based library, e.g.
+petsc4py) before libE returns. sim_f and gen_f get their worker rank as
+libE_info['rank'].
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+import time
+import threading
+import multiprocessing
+import sys
+
+from libE_comms import ResultReceiver, unpack_envelope, ENVELOPE_SIZE, HEADER_BYTES
+from libE_worker import worker_main
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from multiprocessing.connection import wait as wait_connections
+except ImportError:
+    # Python 2: select on the pipes' file descriptors
+    import select
+
+    def wait_connections(conns, timeout=None):
+        return select.select(conns, [], [], timeout)[0]
+
+# Fork, so sim_f/gen_f defined in the calling script needn't be importable
+if hasattr(multiprocessing, 'get_context'):
+    mp = multiprocessing.get_context('fork')
+else:
+    mp = multiprocessing
+
+
+def envelope_tag(buf):
+    """
+    The tag in the header of an envelope
+    """
+    return int(buf[:HEADER_BYTES].view(np.int64)[0])
+
+
+def recv_bytes_into(conn, buf):
+    """
+    Receives a message from conn into buf (or into a new array if it doesn't
+    fit). Returns the message.
+    """
+    try:
+        n = conn.recv_bytes_into(buf)
+    except multiprocessing.BufferTooShort as e:
+        return np.frombuffer(bytearray(e.args[0]), dtype=np.uint8)
+
+    return buf[:n]
+
+
+class LocalComm(object):
+    """
+    Communicator backend over multiprocessing pipes. The manager (rank 0) has
+    a connection to each worker, and each worker has one to the manager.
+
+    Parameters
+    ----------
+    rank: integer
+        Rank of this process
+
+    size: integer
+        Number of ranks (the manager and the workers)
+
+    conns: dict
+        Connection to each rank this process talks to
+    """
+
+    def __init__(self, rank, size, conns):
+        self.rank = rank
+        self.size = size
+        self.conns = conns
+        # Queue and thread writing the envelopes from isend_envelope to each
+        # destination (started on the first isend_envelope to it)
+        self.outgoing = {}
+        self.senders = {}
+        self.send_error = None
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+    def send(self, obj, dest):
+        """
+        Sends a picklable object (after any envelopes queued for dest)
+        """
+        self.wait_sends(dest)
+        self.conns[dest].send(obj)
+
+    def recv(self, source):
+        """
+        Blocking receive of a picklable object
+        """
+        return self.conns[source].recv()
+
+    def send_envelope(self, buf, dest, tag):
+        """
+        Sends an envelope (whose header already holds tag). If envelopes are
+        queued for dest, it is queued after them instead.
+        """
+        if dest in self.outgoing:
+            self.isend_envelope(buf, dest, tag)
+        else:
+            self.conns[dest].send_bytes(buf)
+
+    def isend_envelope(self, buf, dest, tag):
+        """
+        Queues an envelope for dest's sender thread and returns. (buf must not
+        change until wait_sends.)
+        """
+        self.raise_send_error()
+        if dest not in self.senders:
+            self.outgoing[dest] = queue.Queue()
+            self.senders[dest] = threading.Thread(target=self.write_envelopes, args=(dest,))
+            self.senders[dest].daemon = True
+            self.senders[dest].start()
+        self.outgoing[dest].put(buf)
+
+    def write_envelopes(self, dest):
+        """
+        Loop of the sender thread for dest
+        """
+        while 1:
+            buf = self.outgoing[dest].get()
+            try:
+                self.conns[dest].send_bytes(buf)
+            except Exception as e:
+                self.send_error = e
+            self.outgoing[dest].task_done()
+
+    def wait_sends(self, dest=None):
+        """
+        Waits until the envelopes queued (for dest, or for every rank) are in
+        the pipes
+        """
+        for d in ([dest] if dest is not None else list(self.outgoing)):
+            if d in self.outgoing:
+                self.outgoing[d].join()
+        self.raise_send_error()
+
+    def raise_send_error(self):
+        if self.send_error is not None:
+            e, self.send_error = self.send_error, None
+            raise e
+
+    def recv_envelope(self, buf, source):
+        """
+        Blocking receive of an envelope into the preallocated buffer buf
+        (unless it doesn't fit). Returns the envelope and its tag.
+        """
+        msg = recv_bytes_into(self.conns[source], buf)
+        return msg, envelope_tag(msg)
+
+    def result_receiver(self, worker_ranks, out_dtypes, deadline=None):
+        """
+        Returns a LocalResultReceiver for calculation output from worker_ranks
+        """
+        return LocalResultReceiver(self, worker_ranks, out_dtypes, deadline)
+
+
+class LocalResultReceiver(ResultReceiver):
+    """
+    ResultReceiver for LocalComm. A posted receive just marks the worker's
+    pipe to be waited on; wait() sleeps until at least one of the marked
+    pipes has output (or the deadline passes) and receives from every one
+    that does.
+    """
+
+    def __init__(self, comm, worker_ranks, out_dtypes, deadline=None):
+        self.comm = comm
+        self.out_dtypes = out_dtypes
+        self.buffers = dict((w, np.empty(ENVELOPE_SIZE, dtype=np.uint8)) for w in worker_ranks)
+        self.posted = set()
+        self.num_posted = 0
+
+        self.deadline = deadline
+
+        self.wakeups = 0
+        self.completions = 0
+
+    def post(self, w):
+        """
+        Marks worker w's pipe to be received from
+        """
+        assert w not in self.posted, "Worker " + str(w) + " already has a posted receive"
+
+        self.posted.add(w)
+        self.num_posted += 1
+
+    def is_posted(self, w):
+        """
+        True if worker w's pipe is marked to be received from
+        """
+        return w in self.posted
+
+    def wait(self):
+        """
+        Blocks until at least one posted receive can complete (or the
+        deadline passes) and returns a list of (worker, tag, output) tuples
+        """
+        if self.num_posted == 0:
+            return []
+
+        ranks = dict((self.comm.conns[w], w) for w in self.posted)
+        timeout = None if self.deadline is None else max(0, self.deadline - time.time())
+
+        ready = wait_connections(list(ranks), timeout)
+        if not ready:
+            return []
+
+        received = []
+        for conn in sorted(ready, key=lambda conn: ranks[conn]):
+            w = ranks[conn]
+            try:
+                buf = recv_bytes_into(conn, self.buffers[w])
+            except EOFError:
+                raise RuntimeError("Worker " + str(w) + " exited before returning its output")
+
+            tag = envelope_tag(buf)
+            D, calc_out = unpack_envelope(buf, self.out_dtypes.get(tag))
+            if calc_out is not None:
+                D['calc_out'] = calc_out
+
+            received.append((w, tag, D))
+            self.posted.remove(w)
+
+        self.num_posted -= len(received)
+        self.wakeups += 1
+        self.completions += len(received)
+
+        return received
+
+    def cancel(self):
+        """
+        Forgets all posted receives
+        """
+        self.posted.clear()
+        self.num_posted = 0
+
+
+def start_workers(worker_ranks, color, sim_specs, gen_specs):
+    """
+    Starts a process running worker_main for each worker rank (1, ..., n),
+    connected to the manager by a pipe.
+
+    Returns the manager's LocalComm and the worker processes.
+    """
+    size = len(worker_ranks) + 1
+    assert set(worker_ranks) == set(range(1, size)), "Worker ranks must be 1, ..., n for the local backend"
+    assert not mpi_initialized(), "The local backend forks its workers, so MPI must not be initialized (don't import mpi4py.MPI before libE)"
+
+    conns = {}
+    procs = []
+    for w in sorted(worker_ranks):
+        conns[w], worker_conn = mp.Pipe()
+        c = {'comm': LocalComm(w, size, {0: worker_conn}), 'color': color}
+        p = mp.Process(target=worker_main, args=(c, sim_specs, gen_specs))
+        p.daemon = True
+        p.start()
+        # The worker holds its own end, so closing ours lets the manager see
+        # EOF if the worker dies
+        worker_conn.close()
+        procs.append(p)
+
+    return LocalComm(0, size, conns), procs
+
+
+def mpi_initialized():
+    """
+    True if mpi4py has initialized MPI in this process
+    """
+    MPI = sys.modules.get('mpi4py.MPI')
+    return MPI is not None and MPI.Is_initialized() and not MPI.Is_finalized()
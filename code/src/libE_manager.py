@@ -10,36 +10,51 @@ from __future__ import absolute_import
 from message_numbers import EVAL_SIM_TAG 
 from message_numbers import EVAL_GEN_TAG 
 from message_numbers import STOP_TAG # manager tells worker run is over
+from message_numbers import LEASE_TAG
+
+from libE_comms import packed_dtype, pack_envelope, stop_workers
+from libE_history import History
+from libE_journal import HistoryJournal
 
-from mpi4py import MPI
 import numpy as np
 
 import time, sys, os
 import copy
+import socket
 
 def manager_main(comm, alloc_specs, sim_specs, gen_specs, failure_processing, exit_criteria, H0):
     """
-    Manager routine to coordinate the generation and simulation evaluations
+    Manager routine to coordinate the generation and simulation evaluations.
+    comm is a communicator backend (see libE_comms).
     """
 
-    H, H_ind, term_test, idle_w, active_w = initialize(sim_specs, gen_specs, alloc_specs, exit_criteria, H0)
+    hist, term_test, idle_w, active_w = initialize(sim_specs, gen_specs, alloc_specs, exit_criteria, H0)
     persistent_queue_data = {}; gen_info = {}
 
-    send_initial_info_to_workers(comm, H, sim_specs, gen_specs, idle_w)
+    if 'elapsed_wallclock_time' in exit_criteria:
+        deadline = time.time() + exit_criteria['elapsed_wallclock_time']
+    else:
+        deadline = None
+    out_dtypes = {EVAL_SIM_TAG: np.dtype(sim_specs['out']), EVAL_GEN_TAG: np.dtype(gen_specs['out'])}
+    receiver = comm.result_receiver(alloc_specs['worker_ranks'], out_dtypes, deadline)
 
+    in_dtypes = send_initial_info_to_workers(comm, hist, sim_specs, gen_specs, alloc_specs, alloc_specs['worker_ranks'])
     ### Continue receiving and giving until termination test is satisfied
-    while not term_test(H, H_ind):
+    while not term_test():
+
+        active_w, idle_w, gen_info = receive_from_sim_and_gen(comm, receiver, in_dtypes, active_w, idle_w, hist, sim_specs, gen_specs, gen_info)
 
-        H, H_ind, active_w, idle_w, gen_info = receive_from_sim_and_gen(comm, active_w, idle_w, H, H_ind, sim_specs, gen_specs, gen_info)
+        persistent_queue_data = update_active_and_queue(active_w, idle_w, hist, gen_specs, persistent_queue_data)
 
-        persistent_queue_data = update_active_and_queue(active_w, idle_w, H[:H_ind], gen_specs, persistent_queue_data)
+        if active_w['sub_man']:
+            lease_to_sub_managers(comm, receiver, in_dtypes, hist, active_w, alloc_specs, hist.given_max - hist.given_count)
 
-        Work, gen_info = alloc_specs['alloc_f'](active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_test, gen_info)
+        Work, gen_info = alloc_specs['alloc_f'](active_w, idle_w, hist, sim_specs, gen_specs, term_test, gen_info)
 
         for w in Work:
-            active_w, idle_w = send_to_worker_and_update_active_and_idle(comm, H, Work[w], w, sim_specs, gen_specs, active_w, idle_w)
+            active_w, idle_w = send_to_worker_and_update_active_and_idle(comm, receiver, in_dtypes, hist, Work[w], w, sim_specs, gen_specs, active_w, idle_w)
 
-    H, gen_info, exit_flag = final_receive_and_kill(comm, active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_test, alloc_specs, gen_info)
+    H, gen_info, exit_flag = final_receive_and_kill(comm, receiver, in_dtypes, active_w, idle_w, hist, sim_specs, gen_specs, term_test, alloc_specs, gen_info)
 
     return H, gen_info, exit_flag
 
@@ -50,213 +65,307 @@ def manager_main(comm, alloc_specs, sim_specs, gen_specs, failure_processing, ex
 ######################################################################
 # Manager subroutines
 ######################################################################
-def send_initial_info_to_workers(comm, H, sim_specs, gen_specs, idle_w):
+def send_initial_info_to_workers(comm, hist, sim_specs, gen_specs, alloc_specs, worker_ranks):
     """
-    Communicate the gen dtype to workers to save time on future communications.
-    (Must communicate this when workers are requesting libE_fields that aren't
-    in sim_specs['out'] or gen_specs['out'].)
-    """
-    for w in idle_w:
-        comm.send(obj=H[sim_specs['in']].dtype, dest=w)
-        comm.send(obj=H[gen_specs['in']].dtype, dest=w)
+    Communicate the sim and gen input dtypes to workers so that rows of H can
+    be sent as typed buffers. (Must communicate this when workers are
+    requesting libE_fields that aren't in sim_specs['out'] or gen_specs['out'].)
 
+    If alloc_specs['share_H'] is set, workers are also sent H_file, the dtype
+    of H and the manager's host name. Workers on the same host map H_file
+    (and reply True) and are added to hist.shared_w.
 
-def send_to_worker_and_update_active_and_idle(comm, H, Work, w, sim_specs, gen_specs, active_w, idle_w):
-    """
-    Sends calculation information to the workers and updates the sets of
-    active/idle workers
+    Returns the dtypes for each calculation tag.
     """
+    in_dtypes = {EVAL_SIM_TAG: packed_dtype(hist.H.dtype, sim_specs['in']),
+                 EVAL_GEN_TAG: packed_dtype(hist.H.dtype, gen_specs['in'])}
 
-    comm.send(obj=Work['libE_info'], dest=w, tag=Work['tag'])
-    comm.send(obj=Work['gen_info'], dest=w, tag=Work['tag'])
-    if len(Work['libE_info']['H_rows']):
-        comm.send(obj=H[Work['H_fields']][Work['libE_info']['H_rows']],dest=w)
-    #     for i in Work['H_fields']:
-    #         # comm.send(obj=H[i][0].dtype,dest=w)
-    #         comm.Send(H[i][Work['libE_info']['H_rows']], dest=w)
+    if alloc_specs.get('share_H'):
+        share_info = {'H_file': os.path.abspath(hist.H_file), 'dtype': hist.H.dtype, 'host': socket.gethostname()}
+    else:
+        share_info = None
 
-    active_w[Work['tag']].add(w)
-    idle_w.remove(w)
+    for w in worker_ranks:
+        comm.send(in_dtypes[EVAL_SIM_TAG], w)
+        comm.send(in_dtypes[EVAL_GEN_TAG], w)
+        comm.send(share_info, w)
 
-    if 'blocking' in Work['libE_info']:
-        active_w['blocked'].update(Work['libE_info']['blocking'])
-        idle_w.difference_update(Work['libE_info']['blocking'])
+    if share_info is not None:
+        for w in worker_ranks:
+            if comm.recv(w):
+                hist.shared_w.add(w)
 
-    if Work['tag'] == EVAL_SIM_TAG:
-        update_history_x_out(H, Work['libE_info']['H_rows'], w)
+    return in_dtypes
 
-    return active_w, idle_w
 
-
-def receive_from_sim_and_gen(comm, active_w, idle_w, H, H_ind, sim_specs, gen_specs, gen_info):
+def send_to_worker_and_update_active_and_idle(comm, receiver, in_dtypes, hist, Work, w, sim_specs, gen_specs, active_w, idle_w):
     """
-    Receive calculation output from workers. Loops over all active workers and
-    probes to see if worker is ready to communticate. If any output is
-    received, all other workers are looped back over.
+    Sends calculation information to the workers, posts a receive for the
+    output, and updates the sets of active/idle workers.
+
+    libE_info, gen_info and the requested rows of H go out in a single
+    envelope. The rows are typed with in_dtypes[Work['tag']] (the dtype the
+    worker received at startup), so they aren't pickled.
+
+    If sim_specs['state_key'] is set, the rows of sim work must share the
+    value of that field, which is sent as libE_info['state_key'] and recorded
+    in active_w['sim_state'], since the worker will set up its persistent sim
+    state for that key.
+
+    If gen_specs['replicate_H'] is set, gen work must be for all rows of H.
+    Gen workers then keep a replica of the gen 'in' fields of H, and only the
+    rows updated since the worker's last gen call are sent (see
+    History.replica_delta), with libE_info['H_len'] the length of H.
+
+    Workers in hist.shared_w read the rows from their mapping of H, so only
+    libE_info and gen_info are sent (except to persistent calculations).
+
+    Work is queued in one of the worker's slots (active_w['slots'][w]), and
+    the worker stays in idle_w while it has a free slot (see
+    has_free_slot). Work for a worker that is already busy is sent without
+    waiting for the worker to receive it, and the worker starts it as soon
+    as its earlier work returns.
     """
 
-    status = MPI.Status()
-
-    new_stuff = True
-    while new_stuff:
-        new_stuff = False
-        for w in active_w[EVAL_SIM_TAG].copy() | active_w[EVAL_GEN_TAG].copy(): 
-            if comm.Iprobe(source=w, tag=MPI.ANY_TAG, status=status):
-                new_stuff = True
-
-                D_recv = comm.recv(source=w, tag=MPI.ANY_TAG, status=status)
-                recv_tag = status.Get_tag()
-                assert recv_tag in [EVAL_SIM_TAG, EVAL_GEN_TAG], 'Unknown calculation tag received. Exiting'
-
-                idle_w.add(w)
-                active_w[recv_tag].remove(w) 
+    dtype = in_dtypes[Work['tag']]
+    assert tuple(Work['H_fields']) == dtype.names, "Work['H_fields'] must match the 'in' fields for this calculation tag"
+
+    libE_info = Work['libE_info']
+    shared = w in hist.shared_w and not libE_info.get('persistent')
+
+    queued = len(active_w['slots'][w]) > 0
+    exclusive = Work['tag'] != EVAL_SIM_TAG or 'blocking' in libE_info
+    assert not (queued and exclusive), "Only sim work that blocks no other workers can be queued behind running work"
+
+    if Work['tag'] == EVAL_GEN_TAG and gen_specs.get('replicate_H') and not shared:
+        assert len(libE_info['H_rows']) == hist.index, "Gen work must be for all rows of H when gen_specs['replicate_H'] is set"
+        libE_info = dict(libE_info, H_rows=hist.replica_delta(w), H_len=hist.index)
+
+    if Work['tag'] == EVAL_SIM_TAG and 'state_key' in sim_specs and len(libE_info['H_rows']):
+        # The worker's persistent sim will hold the state for this key
+        key = hist.H[sim_specs['state_key']][libE_info['H_rows'][0]]
+        assert np.all(hist.H[sim_specs['state_key']][libE_info['H_rows']] == key), "The rows of a sim call must share their sim_specs['state_key']"
+        libE_info = dict(libE_info, state_key=key)
+        active_w['sim_state'][w] = key
+
+    meta = {'libE_info': libE_info, 'gen_info': Work['gen_info']}
+    if shared:
+        buf, _ = pack_envelope(Work['tag'], meta)
+        if queued:
+            comm.isend_envelope(buf, w, Work['tag'])
+        else:
+            comm.send_envelope(buf, w, Work['tag'])
+    else:
+        send_rows(comm, hist.H, dtype, Work['tag'], meta, libE_info['H_rows'], w, queued)
 
-                if recv_tag == EVAL_SIM_TAG:
-                    update_history_f(H, D_recv)
-                else: # recv_tag == EVAL_GEN_TAG:
-                    H, H_ind = update_history_x_in(H, H_ind, w, D_recv['calc_out'])
+    # Output returns in the order work was sent, so a receive is posted for
+    # the first slot only (and again as each slot returns)
+    if not queued:
+        receiver.post(w)
 
-                if 'blocking' in D_recv['libE_info']:
-                    active_w['blocked'].difference_update(D_recv['libE_info']['blocking'])
-                    idle_w.update(D_recv['libE_info']['blocking'])
+    kind = 'persis_gen' if libE_info.get('persistent') else Work['tag']
+    active_w[kind].add(w)
+    active_w['slots'][w].append((kind, exclusive))
+    if not has_free_slot(active_w, w):
+        idle_w.remove(w)
 
-                if 'gen_num' in D_recv['libE_info']:
-                    gen_info[D_recv['libE_info']['gen_num']] = D_recv['gen_info']
+    if 'blocking' in Work['libE_info']:
+        active_w['blocked'].update(Work['libE_info']['blocking'])
+        idle_w.difference_update(Work['libE_info']['blocking'])
 
-    if 'save_every_k' in sim_specs:
-        k = sim_specs['save_every_k']
-        count = k*(sum(H['returned'])//k)
-        filename = 'libE_history_after_sim_' + str(count) + '.npy'
+    if Work['tag'] == EVAL_SIM_TAG:
+        hist.update_history_x_out(Work['libE_info']['H_rows'], w)
 
-        if not os.path.isfile(filename) and count > 0:
-            np.save(filename,H)
+    return active_w, idle_w
 
-    if 'save_every_k' in gen_specs:
-        k = gen_specs['save_every_k']
-        count = k*(H_ind//k)
-        filename = 'libE_history_after_gen_' + str(count) + '.npy'
 
-        if not os.path.isfile(filename) and count > 0:
-            np.save(filename,H)
+def send_rows(comm, H, dtype, tag, meta, rows, w, queued=False):
+    """
+    Sends meta and the fields of dtype for rows of H to worker w in a single
+    envelope. If queued, the envelope is sent without waiting for w to
+    receive it (e.g., when w is busy with earlier work).
+    """
+    buf, calc_in = pack_envelope(tag, meta, len(rows), dtype)
+    if len(rows):
+        for field in dtype.names:
+            calc_in[field] = H[field][rows]
 
-    return H, H_ind, active_w, idle_w, gen_info
+    if queued:
+        comm.isend_envelope(buf, w, tag)
+    else:
+        comm.send_envelope(buf, w, tag)
 
 
-def update_active_and_queue(active_w, idle_w, H, gen_specs, data):
-    """ 
-    Call a user-defined function that decides if active work should be continued
-    and possibly updated the priority of points in H.
+def has_free_slot(active_w, w):
     """
-    if 'queue_update_function' in gen_specs and len(H):
-        H, data = gen_specs['queue_update_function'](H,gen_specs, data)
-    
-    return data
+    True if more work can be queued for worker w: it holds fewer than
+    active_w['queue_depth'] items, none of which is gen work or sim work
+    that blocks other workers
+    """
+    slots = active_w['slots'][w]
+    return len(slots) < active_w['queue_depth'] and not any(exclusive for _, exclusive in slots)
 
 
-def update_history_f(H, D): 
+def send_to_persistent_gens(comm, in_dtypes, hist, rows, active_w):
     """
-    Updates the history (in place) after a point has been evaluated
+    Streams newly returned rows to the persistent gens that generated them.
+    The rows are sent without waiting for the gen to receive them, since the
+    gen may itself be sending a large batch to the manager.
     """
+    rows = np.atleast_1d(rows)
+    gen_ranks = hist.H['gen_rank'][rows]
 
-    new_inds = D['libE_info']['H_rows']
-    H_0 = D['calc_out']
-
-    for j,ind in enumerate(new_inds): 
-        for field in H_0.dtype.names:
-            H[field][ind] = H_0[field][j]
+    for w in active_w['persis_gen']:
+        w_rows = rows[gen_ranks == w]
+        if len(w_rows):
+            send_rows(comm, hist.H, in_dtypes[EVAL_GEN_TAG], EVAL_GEN_TAG, {'libE_info': {'H_rows': w_rows}, 'gen_info': {}}, w_rows, w, queued=True)
 
-        H['returned'][ind] = True
 
-
-def update_history_x_out(H, q_inds, sim_rank):
+def lease_to_sub_managers(comm, receiver, in_dtypes, hist, active_w, alloc_specs, max_rows):
     """
-    Updates the history (in place) when a new point has been given out to be evaluated
-
+    Tops up the lease of each sub-manager that holds fewer rows than it has
+    workers, so it can keep its workers busy without waiting on the
+    manager. A sub-manager holds at most alloc_specs['lease_size'] rows
+    (default: twice its number of workers), and at most max_rows rows are
+    leased in total.
+
+    Leased rows are given out (with sim_rank the sub-manager's rank until the
+    output returns) and sent to the sub-manager in one envelope, without
+    waiting for the sub-manager to receive it (it may be sending a batch of
+    output at the same time). A receive from a sub-manager is posted while it
+    holds leased rows.
     """
+    for s in sorted(active_w['sub_man']):
+        num_workers = len(alloc_specs['sub_managers'][s])
+        if active_w['sub_man'][s] >= num_workers or max_rows <= 0:
+            continue
 
-    for i,j in zip(q_inds,range(len(q_inds))):
-        H['given'][i] = True
-        H['given_time'][i] = time.time()
-        H['sim_rank'][i] = sim_rank
+        k = min(alloc_specs.get('lease_size', 2*num_workers) - active_w['sub_man'][s], max_rows)
+        rows = hist.take_next(k)
+        if not len(rows):
+            return
 
+        send_rows(comm, hist.H, in_dtypes[EVAL_SIM_TAG], LEASE_TAG, {'libE_info': {'H_rows': rows}, 'gen_info': {}}, rows, s, queued=True)
+        hist.update_history_x_out(rows, s)
+        if active_w['sub_man'][s] == 0:
+            receiver.post(s)
+        active_w['sub_man'][s] += len(rows)
+        max_rows -= len(rows)
 
-def update_history_x_in(H, H_ind, gen_rank, O):
-    """
-    Updates the history (in place) when a new point has been returned from a gen
 
-    Parameters
-    ----------
-    H: numpy structured array
-        History array storing rows for each point.
-    H_ind: integer
-        The new point
-    gen_rank: integer
-        The rank of the worker who generated these points
-    O: numpy array
-        Output from gen_func
+def receive_from_sim_and_gen(comm, receiver, in_dtypes, active_w, idle_w, hist, sim_specs, gen_specs, gen_info):
     """
+    Receive calculation output from workers. Sleeps until at least one active
+    worker has returned output (or the elapsed_wallclock_time has passed) and
+    then processes the output from every worker that has completed. Returns
+    immediately if no workers are active.
 
-    rows_remaining = len(H)-H_ind
-    
-    if 'sim_id' not in O.dtype.names:
-        # gen method must not be adjusting sim_id, just append to H
-        num_new = len(O)
-
-        if num_new > rows_remaining:
-            H = grow_H(H,num_new-rows_remaining)
-            
-        update_inds = np.arange(H_ind,H_ind+num_new)
-        H['sim_id'][H_ind:H_ind+num_new] = range(H_ind,H_ind+num_new)
-    else:
-        # gen method is building sim_id. 
-        num_new = len(np.setdiff1d(O['sim_id'],H['sim_id']))
+    Persistent gens stay active when they send points (with
+    libE_info['persistent'] set), and the sim output for their points is
+    streamed back to them as it is received.
 
-        if num_new > rows_remaining:
-            H = grow_H(H,num_new-rows_remaining)
+    Points that get sim output from hist.memo are streamed to persistent
+    gens too.
 
-        update_inds = O['sim_id']
-        
-    for field in O.dtype.names:
-        H[field][update_inds] = O[field]
+    Sub-managers return batches of sim output for their leased rows, with
+    libE_info['sim_ranks'] the workers that evaluated them.
 
-    H_ind += num_new
-    H['gen_rank'] = gen_rank
+    Output from a worker completes its first slot. If the worker has more
+    work queued, a receive is posted for its next output.
 
-    return H, H_ind
-
-
-def grow_H(H, k):
-    """ 
-    libEnsemble is requesting k rows be added to H because the gen_func produced
-    more points than rows in H.
+    If save_every_k is set, the History journal is given a chance to
+    checkpoint the rows that have changed.
     """
-    H_1 = np.zeros(k, dtype=H.dtype)
-    H_1['sim_id'] = -1
-    H_1['given_time'] = np.inf
-
-    H = np.append(H,H_1)
 
-    return H
+    for w, recv_tag, D_recv in receiver.wait():
+        assert recv_tag in [EVAL_SIM_TAG, EVAL_GEN_TAG], 'Unknown calculation tag received. Exiting'
+
+        if w in active_w['persis_gen'] and D_recv['libE_info'].get('persistent'):
+            # New points from a persistent gen, which keeps running
+            filled = hist.update_history_x_in(w, D_recv['calc_out'])
+            receiver.post(w)
+            if len(filled):
+                send_to_persistent_gens(comm, in_dtypes, hist, filled, active_w)
+            continue
+
+        if w in active_w['sub_man']:
+            # Output from a sub-manager, which keeps running
+            rows = D_recv['libE_info']['H_rows']
+            hist.H['sim_rank'][rows] = D_recv['libE_info']['sim_ranks']
+            filled = hist.update_history_f(D_recv)
+            active_w['sub_man'][w] -= len(rows)
+            if active_w['persis_gen']:
+                send_to_persistent_gens(comm, in_dtypes, hist, np.append(rows, filled), active_w)
+            if active_w['sub_man'][w]:
+                receiver.post(w)
+            continue
+
+        kind, _ = active_w['slots'][w].pop(0)
+        if kind not in [k for k, _ in active_w['slots'][w]]:
+            active_w[kind].remove(w)
+        if has_free_slot(active_w, w):
+            idle_w.add(w)
+
+        if recv_tag == EVAL_SIM_TAG:
+            filled = hist.update_history_f(D_recv)
+            hist.update_sim_timing(D_recv['libE_info'])
+            if active_w['persis_gen']:
+                send_to_persistent_gens(comm, in_dtypes, hist, np.append(D_recv['libE_info']['H_rows'], filled), active_w)
+        else: # recv_tag == EVAL_GEN_TAG:
+            filled = hist.update_history_x_in(w, D_recv['calc_out'])
+            if active_w['persis_gen'] and len(filled):
+                send_to_persistent_gens(comm, in_dtypes, hist, filled, active_w)
+
+        if 'blocking' in D_recv['libE_info']:
+            active_w['blocked'].difference_update(D_recv['libE_info']['blocking'])
+            idle_w.update(D_recv['libE_info']['blocking'])
+
+        if 'gen_num' in D_recv['libE_info']:
+            gen_info[D_recv['libE_info']['gen_num']] = D_recv['gen_info']
+
+        # Only now, since D_recv is a view into the receive buffer
+        if active_w['slots'][w]:
+            receiver.post(w)
+
+    if hist.journal is not None:
+        hist.journal.checkpoint(hist)
+
+    return active_w, idle_w, gen_info
+
+
+def update_active_and_queue(active_w, idle_w, hist, gen_specs, data):
+    """ 
+    Call a user-defined function that decides if active work should be continued
+    and possibly updated the priority of points in H.
 
+    The rows whose paused or priority field the queue_update_function
+    changed are found afterwards (see History.update_queue_fields), so the
+    changes are journaled, unpaused rows are ready again and the priority
+    queue is reordered.
+    """
+    if 'queue_update_function' in gen_specs and hist.index:
+        H, data = gen_specs['queue_update_function'](hist.trim(),gen_specs, data)
+        hist.update_queue_fields()
+    
+    return data
 
 
-def termination_test(H, H_ind, exit_criteria, start_time, lenH0):
+def termination_test(hist, exit_criteria, start_time, lenH0):
     """
-    Return nonzero if the libEnsemble run should stop 
+    Return nonzero if the libEnsemble run should stop. Uses the counts kept by
+    the History, so this doesn't depend on the size of H.
     """
 
     if 'sim_max' in exit_criteria:
-        if np.sum(H['given']) >= exit_criteria['sim_max'] + lenH0:
+        if hist.given_count >= hist.given_max:
             return 1
 
     if 'gen_max' in exit_criteria:
-        if H_ind >= exit_criteria['gen_max'] + lenH0:
+        if hist.index >= exit_criteria['gen_max'] + lenH0:
             return 1 
 
     if 'stop_val' in exit_criteria:
-        key = exit_criteria['stop_val'][0]
-        val = exit_criteria['stop_val'][1]
-        if np.any(H[key][:H_ind][~np.isnan(H[key][:H_ind])] <= val): 
+        if hist.stop_min <= exit_criteria['stop_val'][1]:
             return 1
 
     if 'elapsed_wallclock_time' in exit_criteria:
@@ -268,89 +377,86 @@ def termination_test(H, H_ind, exit_criteria, start_time, lenH0):
 
 def initialize(sim_specs, gen_specs, alloc_specs, exit_criteria, H0):
     """
-    Forms the numpy structured array that records everything from the
-    libEnsemble run 
+    Forms the History that records everything from the libEnsemble run
 
     Returns
     ----------
-    H: numpy structured array
-        History array storing rows for each point. Field names are in
-        code/src/libE_fileds.py
-
-    H_ind: integer
-        Where libEnsemble should start filling in H
+    hist: History
+        The History array H (hist.H) and where libEnsemble should start
+        filling it in (hist.index). See libE_history.py
 
     term_test: lambda funciton
         Simplified termination test (doesn't require passing fixed quantities).
-        This is nice when calling term_test in multiple places.
+        This is nice when calling term_test in multiple places. It still takes
+        (H, H_ind) so alloc functions can call term_test(H, H_ind), but the
+        test only reads the counts kept by hist.
 
     idle_w: python set
-        Idle worker ranks (initially all worker ranks)
-
-    active_w: python set
-        Active worker ranks (initially empty)
+        Worker ranks with a free slot (initially all worker ranks, except
+        sub-managers)
+
+    active_w: python dict of sets
+        Active worker ranks for each calculation tag, workers blocked by
+        other calculations and persistent gen workers (initially empty).
+        active_w['sim_state'] maps workers to the state_key their persistent
+        sim state was set up for. active_w['sub_man'] maps each sub-manager
+        (see libE_sub_manager.py) to the number of rows leased to it that
+        haven't returned. active_w['slots'] maps each worker to the (kind,
+        exclusive) pairs of the work queued on it, oldest first, where kind
+        is EVAL_SIM_TAG, EVAL_GEN_TAG or 'persis_gen'. A worker holds at most
+        active_w['queue_depth'] (alloc_specs['queue_depth'], default 1)
+        items, and only sims that block no other workers are queued behind
+        running work.
     """
 
-    if 'sim_max' in exit_criteria:
-        L = exit_criteria['sim_max']
-    else:
-        L = 100
-
-    from libE_fields import libE_fields
+    hist = History(sim_specs, gen_specs, exit_criteria, H0, alloc_specs.get('H_file'))
 
-    H = np.zeros(L + len(H0), dtype=list(set(libE_fields + sim_specs['out'] + gen_specs['out'])))
+    if 'save_every_k' in sim_specs or 'save_every_k' in gen_specs:
+        journal_file = sim_specs.get('journal_file', gen_specs.get('journal_file', 'libE_history_journal.bin'))
+        hist.journal = HistoryJournal(journal_file, hist, sim_specs.get('save_every_k'), gen_specs.get('save_every_k'))
 
-    if len(H0):
-        fields = H0.dtype.names
-
-        for field in fields:
-            H[field][:len(H0)] = H0[field]
-            # for ind, val in np.ndenumerate(H0[field]): # Works if H0[field] has arbitrary dimension but is slow
-            #     H[field][ind] = val
-
-    # Prepend H with H0 
-    H['sim_id'][:len(H0)] = np.arange(0,len(H0))
-    H['given'][:len(H0)] = 1
-    H['returned'][:len(H0)] = 1
-
-    H['sim_id'][-L:] = -1
-    H['given_time'][-L:] = np.inf
-
-    H_ind = len(H0)
     start_time = time.time()
-    term_test = lambda H, H_ind: termination_test(H, H_ind, exit_criteria, start_time, len(H0))
+    term_test = lambda H=None, H_ind=None: termination_test(hist, exit_criteria, start_time, len(H0))
 
-    idle_w = alloc_specs['worker_ranks'].copy()
-    active_w = {EVAL_GEN_TAG:set(), EVAL_SIM_TAG:set(), 'blocked':set()}
+    sub_managers = alloc_specs.get('sub_managers', {})
+    idle_w = alloc_specs['worker_ranks'] - set(sub_managers)
+    active_w = {EVAL_GEN_TAG:set(), EVAL_SIM_TAG:set(), 'blocked':set(), 'persis_gen':set(), 'sim_state':{},
+                'sub_man':dict((s, 0) for s in sub_managers),
+                'slots':dict((w, []) for w in idle_w), 'queue_depth':alloc_specs.get('queue_depth', 1)}
 
-    return H, H_ind, term_test, idle_w, active_w
+    return hist, term_test, idle_w, active_w
 
-def final_receive_and_kill(comm, active_w, idle_w, H, H_ind, sim_specs, gen_specs, term_test, alloc_specs, gen_info):
+def final_receive_and_kill(comm, receiver, in_dtypes, active_w, idle_w, hist, sim_specs, gen_specs, term_test, alloc_specs, gen_info):
     """ 
     Tries to receive from any active workers. 
 
-    If time expires before all active workers have been received from, a
-    nonblocking receive is posted (though the manager will not receive this
-    data) and a kill signal is sent. 
+    If time expires before all active workers have been received from, the
+    manager stops adding output to H, and workers are stopped with
+    stop_workers, which keeps receiving (and discards) what the active
+    workers still send until each has stopped.
     """
 
     exit_flag = 0
 
     ### Receive from all active workers 
-    while len(active_w[EVAL_SIM_TAG] | active_w[EVAL_GEN_TAG]):
-        H, H_ind, active_w, idle_w, gen_info = receive_from_sim_and_gen(comm, active_w, idle_w, H, H_ind, sim_specs, gen_specs, gen_info)
-        if term_test(H, H_ind) == 2 and len(active_w[EVAL_SIM_TAG] | active_w[EVAL_GEN_TAG]):
-            for w in active_w[EVAL_SIM_TAG] | active_w[EVAL_GEN_TAG]:
-                comm.irecv(source=w, tag=MPI.ANY_TAG)
-
+    while len(active_w[EVAL_SIM_TAG] | active_w[EVAL_GEN_TAG]) or any(active_w['sub_man'].values()):
+        active_w, idle_w, gen_info = receive_from_sim_and_gen(comm, receiver, in_dtypes, active_w, idle_w, hist, sim_specs, gen_specs, gen_info)
+        if term_test() == 2 and (len(active_w[EVAL_SIM_TAG] | active_w[EVAL_GEN_TAG]) or any(active_w['sub_man'].values())):
             print("Termination due to elapsed_wallclock_time has occurred.\n"\
               "A last attempt has been made to receive any completed work.\n"\
-              "Posting nonblocking receives and kill messages for all active workers\n")
+              "Sending kill messages to all workers and discarding their remaining output\n")
             exit_flag = 2
             break
 
-    ### Stop all workers 
-    for w in alloc_specs['worker_ranks']:
-        comm.send(obj=None, dest=w, tag=STOP_TAG)
+    ### Stop all workers (persistent gens stop without sending output)
+    stop_workers(comm, receiver, alloc_specs['worker_ranks'])
+
+    if hist.journal is not None:
+        hist.journal.close(hist.H)
+
+    if hist.memo is not None:
+        print("Evaluation cache: " + str(hist.memo.hits) + " hits (" + str(hist.memo.store_hits) + " from the store), " + str(hist.memo.misses) + " misses")
+        if hist.memo.store is not None:
+            hist.memo.store.close()
 
-    return H[:H_ind], gen_info, exit_flag
+    return hist.trim(), gen_info, exit_flag
@@ -0,0 +1,183 @@
+"""
+libEnsemble evaluation cache
+====================================================
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+
+
+class EvaluationCache(object):
+    """
+    Memo of the rows of H that have been given out to be evaluated (or were
+    evaluated in H0), keyed on the bytes of their sim_specs['in'] fields.
+
+    The History looks up each new point from a gen. If a row with the same
+    key has returned, its sim_specs['out'] fields are copied to the point.
+    If that row is still being evaluated, the point waits for it, and gets
+    the same output when it returns. Either way no sim is dispatched for the
+    point. A point that matches no row is recorded, so later points with its
+    key (in the same batch or after) are held until it is given out, and then
+    wait for it.
+
+    If a store (see libE_store.py) is given, points that match no row are
+    looked up there, and the output of evaluated rows is added to it.
+
+    With tol > 0, float fields are rounded to multiples of tol before they
+    are hashed, so points that differ by much less than tol (and don't
+    straddle a multiple of tol/2) match.
+
+    Attributes
+    ----------
+    rows: dict
+        The first row given out (or looked up) for each key
+
+    waiting: dict
+        The rows waiting for each given row that hasn't returned
+
+    held: dict
+        The rows held for each row that hasn't been given out
+
+    held_rows: set
+        All rows in held
+
+    hits, misses: integer
+        Number of new points that did/didn't match a row (or an entry in
+        store). Looking up a row again (e.g., when a gen sends it again by
+        sim_id) counts neither, so each key misses at most once.
+
+    store_hits: integer
+        Number of hits from store
+    """
+
+    def __init__(self, in_fields, out_fields, tol=0, store=None):
+        self.in_fields = in_fields
+        self.out_fields = out_fields
+        self.tol = tol
+        self.store = store
+
+        self.rows = {}
+        self.waiting = {}
+        self.held = {}
+        self.held_rows = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+
+    def key(self, H, row):
+        """
+        The bytes of the sim_specs['in'] fields of row (with floats rounded
+        to multiples of tol, and -0.0 made 0.0)
+        """
+        parts = []
+        for field in self.in_fields:
+            v = np.asarray(H[field][row])
+            if v.dtype.kind == 'f':
+                if self.tol > 0:
+                    v = np.round(v/self.tol)
+                v = v + 0.0
+            parts.append(np.ascontiguousarray(v).tobytes())
+
+        return b''.join(parts)
+
+    def add(self, H, rows):
+        """
+        Records rows that are given out (unless a row with the same key was).
+        Returns the rows that were held for them, which now wait for them.
+        """
+        waiting = []
+        for row in np.atleast_1d(rows):
+            self.rows.setdefault(self.key(H, row), row)
+            if row in self.held:
+                dups = self.held.pop(row)
+                self.held_rows.difference_update(dups)
+                self.waiting.setdefault(row, []).extend(dups)
+                waiting.extend(dups)
+
+        return np.array(waiting, dtype=int)
+
+    def holds(self, rows):
+        """
+        Returns a boolean array marking which of rows are held
+        """
+        return np.array([row in self.held_rows for row in rows], dtype=bool)
+
+    def match(self, H, rows):
+        """
+        Looks up new rows. Rows matching a row that has returned (or an
+        entry in store) get its output. Rows matching a row that hasn't
+        returned wait for it, or are held until it is given out. Rows
+        matching nothing are recorded, to be evaluated.
+
+        Returns the rows that got output, the rows that are waiting and the
+        rows that are held.
+        """
+        filled = []
+        waiting = []
+        held = []
+        for row in np.atleast_1d(rows):
+            key = self.key(H, row)
+            src = self.rows.get(key)
+            if src == row:
+                continue
+
+            if src is None:
+                self.rows[key] = row
+                out = None if self.store is None else self.store.get(key)
+                if out is None:
+                    self.misses += 1
+                    continue
+
+                for field in self.out_fields:
+                    H[field][row] = out[field]
+                H['given'][row] = True
+                H['returned'][row] = True
+                self.hits += 1
+                self.store_hits += 1
+                filled.append(row)
+                continue
+
+            self.hits += 1
+            if H['returned'][src]:
+                copy_output(H, src, [row], self.out_fields)
+                filled.append(row)
+            elif H['given'][src]:
+                self.waiting.setdefault(src, []).append(row)
+                waiting.append(row)
+            else:
+                self.held.setdefault(src, []).append(row)
+                self.held_rows.add(row)
+                held.append(row)
+
+        return np.array(filled, dtype=int), np.array(waiting, dtype=int), np.array(held, dtype=int)
+
+    def release(self, H, rows):
+        """
+        Copies the output of returned rows to the rows waiting for them (and
+        adds it to store). Returns the rows that got output.
+        """
+        if self.store is not None and len(rows):
+            self.store.put([self.key(H, row) for row in rows], H[rows])
+
+        filled = []
+        for src in np.atleast_1d(rows):
+            if src in self.waiting:
+                dups = self.waiting.pop(src)
+                copy_output(H, src, dups, self.out_fields)
+                filled.extend(dups)
+
+        return np.array(filled, dtype=int)
+
+
+def copy_output(H, src, rows, out_fields):
+    """
+    Copies the sim output (and sim_rank) of row src to rows, and marks them
+    given and returned
+    """
+    for field in out_fields + ['sim_rank']:
+        H[field][rows] = H[field][src]
+    H['given'][rows] = True
+    H['returned'][rows] = True
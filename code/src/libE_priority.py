@@ -0,0 +1,184 @@
+"""
+libEnsemble priority queue
+====================================================
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+
+
+class PriorityQueue(object):
+    """
+    Indexed binary heap of the rows of H that are ready to be given out,
+    ordered by H['priority'] (highest first, ties broken by the lowest row,
+    as np.argmax would).
+
+    The History adds rows when a gen returns them and removes rows when they
+    are given out. A row's position in the heap is kept in pos, so a row can
+    be removed or have its priority changed in O(log N), and refresh finds
+    the rows whose H['priority'] was changed directly. Rows paused by
+    queue_update_function (which sets H['paused'] directly) are dropped when
+    they reach the top, and added again if they are unpaused (see
+    History.update_queue_fields).
+
+    Attributes
+    ----------
+    heap: numpy integer array
+        Rows in heap order in heap[:size]
+
+    pos: numpy integer array
+        pos[i] is the position of row i in heap (or -1)
+
+    keys: numpy float array
+        keys[i] is the priority row i was added with
+    """
+
+    def __init__(self, capacity):
+        self.heap = np.zeros(capacity, dtype=int)
+        self.pos = -np.ones(capacity, dtype=int)
+        self.keys = np.zeros(capacity)
+        self.size = 0
+
+    def grow(self, capacity):
+        """
+        Makes room for rows up to capacity
+        """
+        old = len(self.pos)
+        self.heap = np.append(self.heap, np.zeros(capacity-old, dtype=int))
+        self.pos = np.append(self.pos, -np.ones(capacity-old, dtype=int))
+        self.keys = np.append(self.keys, np.zeros(capacity-old))
+
+    def before(self, a, b):
+        """
+        True if row a should be given out before row b
+        """
+        return self.keys[a] > self.keys[b] or (self.keys[a] == self.keys[b] and a < b)
+
+    def add(self, inds, priorities):
+        """
+        Adds rows inds (or updates their priorities if they are in the heap)
+        """
+        for i, p in zip(inds, priorities):
+            if self.pos[i] >= 0:
+                self.update(i, p)
+                continue
+
+            self.keys[i] = p
+            self.heap[self.size] = i
+            self.pos[i] = self.size
+            self.size += 1
+            self.sift_up(self.size-1)
+
+    def update(self, i, p):
+        """
+        Changes the priority of row i (which must be in the heap)
+        """
+        self.keys[i] = p
+        self.sift_up(self.pos[i])
+        self.sift_down(self.pos[i])
+
+    def refresh(self, H):
+        """
+        Reorders the rows in the heap whose H['priority'] differs from the
+        priority they were added with (e.g., after a queue_update_function
+        changed it). Returns those rows. Finding them costs O(size).
+        """
+        rows = self.heap[:self.size]
+        old, new = self.keys[rows], H['priority'][rows]
+        changed = rows[(old != new) & ~(np.isnan(old) & np.isnan(new))]
+        for i in changed:
+            self.update(i, H['priority'][i])
+
+        return changed
+
+    def remove(self, inds):
+        """
+        Removes rows inds (rows not in the heap are ignored)
+        """
+        for i in np.atleast_1d(inds):
+            j = self.pos[i]
+            if j < 0:
+                continue
+
+            self.size -= 1
+            last = self.heap[self.size]
+            self.pos[i] = -1
+
+            if last != i:
+                self.heap[j] = last
+                self.pos[last] = j
+                self.sift_up(j)
+                self.sift_down(self.pos[last])
+
+    def top(self, H):
+        """
+        Returns the row with the highest priority (or None), without removing
+        it
+        """
+        while self.size and H['paused'][self.heap[0]]:
+            self.remove(self.heap[0])
+
+        if self.size:
+            return self.heap[0]
+        return None
+
+    def top_all(self, H):
+        """
+        Returns (in order) all rows sharing the highest priority, without
+        removing them. Costs O(m) for m such rows.
+        """
+        first = self.top(H)
+        if first is None:
+            return np.array([], dtype=int)
+
+        # Rows with the top key form a subtree at the root of the heap
+        key = self.keys[first]
+        rows = []
+        stack = [0]
+        while stack:
+            j = stack.pop()
+            i = self.heap[j]
+            if self.keys[i] != key:
+                continue
+            if not H['paused'][i]:
+                rows.append(i)
+            stack.extend(c for c in (2*j+1, 2*j+2) if c < self.size)
+
+        return np.sort(rows)
+
+    def sift_up(self, j):
+        """
+        Moves the row at position j up until its parent comes before it
+        """
+        i = self.heap[j]
+        while j > 0:
+            parent = (j-1)//2
+            p = self.heap[parent]
+            if not self.before(i, p):
+                break
+            self.heap[j] = p
+            self.pos[p] = j
+            j = parent
+        self.heap[j] = i
+        self.pos[i] = j
+
+    def sift_down(self, j):
+        """
+        Moves the row at position j down until it comes before its children
+        """
+        i = self.heap[j]
+        while 1:
+            c = 2*j+1
+            if c >= self.size:
+                break
+            if c+1 < self.size and self.before(self.heap[c+1], self.heap[c]):
+                c += 1
+            if not self.before(self.heap[c], i):
+                break
+            self.heap[j] = self.heap[c]
+            self.pos[self.heap[j]] = j
+            j = c
+        self.heap[j] = i
+        self.pos[i] = j
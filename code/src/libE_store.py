@@ -0,0 +1,122 @@
+"""
+libEnsemble evaluation store
+====================================================
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+import sqlite3
+import time
+
+
+class EvaluationStore(object):
+    """
+    SQLite file of sim output from earlier runs, so points that were already
+    evaluated (by a sim with the same version tag) aren't evaluated again.
+
+    Entries are keyed on the bytes of a point's sim_specs['in'] fields (see
+    EvaluationCache.key) and the version tag, and hold the bytes of its
+    sim_specs['out'] fields. At startup the most recently used entries for
+    this version and output dtype are read into memory, so lookups don't
+    touch the file. New entries and the times entries were used are written
+    in batches of flush_every, and when the store is closed. The least
+    recently used entries are then deleted to keep at most max_entries.
+
+    Parameters
+    ----------
+    path: string
+        The SQLite file (created if it doesn't exist)
+
+    version: string
+        Tag for the sim (entries for other tags aren't used)
+
+    out_dtype: numpy dtype
+        dtype of the sim output
+
+    max_entries: integer
+        Most entries kept in the file (default: no limit)
+
+    prefetch: integer
+        Most entries read at startup (default: all)
+
+    Attributes
+    ----------
+    entries: dict
+        The output bytes for each key
+    """
+
+    def __init__(self, path, version, out_dtype, max_entries=None, prefetch=None, flush_every=100):
+        self.conn = sqlite3.connect(path)
+        self.version = str(version)
+        self.out_dtype = np.dtype(out_dtype)
+        self.dtype_str = str(self.out_dtype.descr)
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+
+        self.conn.execute('CREATE TABLE IF NOT EXISTS evals (key BLOB, version TEXT, dtype TEXT, out BLOB, last_used REAL, '
+                          'PRIMARY KEY (key, version, dtype))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS evals_last_used ON evals (last_used)')
+
+        rows = self.conn.execute('SELECT key, out FROM evals WHERE version = ? AND dtype = ? ORDER BY last_used DESC LIMIT ?',
+                                 (self.version, self.dtype_str, -1 if prefetch is None else prefetch))
+        self.entries = dict((bytes(k), bytes(out)) for k, out in rows)
+
+        self.new = []
+        self.used = set()
+
+    def get(self, key):
+        """
+        Returns the output for key (as a row of out_dtype), or None
+        """
+        out = self.entries.get(key)
+        if out is None:
+            return None
+
+        self.used.add(key)
+        return np.frombuffer(out, dtype=self.out_dtype)[0]
+
+    def put(self, keys, calc_out):
+        """
+        Adds the output calc_out[i] (with the fields of out_dtype) for each
+        keys[i]
+        """
+        O = np.zeros(len(keys), dtype=self.out_dtype)
+        for field in self.out_dtype.names:
+            O[field] = calc_out[field]
+
+        for key, row in zip(keys, O):
+            if key not in self.entries:
+                self.entries[key] = row.tobytes()
+                self.new.append(key)
+
+        if len(self.new) + len(self.used) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes new entries and the times entries were used
+        """
+        now = time.time()
+        self.conn.executemany('INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?)',
+                              [(sqlite3.Binary(k), self.version, self.dtype_str, sqlite3.Binary(self.entries[k]), now) for k in self.new])
+        self.conn.executemany('UPDATE evals SET last_used = ? WHERE key = ? AND version = ? AND dtype = ?',
+                              [(now, sqlite3.Binary(k), self.version, self.dtype_str) for k in self.used])
+        self.conn.commit()
+        self.new = []
+        self.used = set()
+
+    def close(self):
+        """
+        Flushes, deletes the least recently used entries over max_entries
+        and closes the file
+        """
+        self.flush()
+
+        if self.max_entries is not None:
+            self.conn.execute('DELETE FROM evals WHERE rowid IN (SELECT rowid FROM evals ORDER BY last_used ASC LIMIT '
+                              'max(0, (SELECT COUNT(*) FROM evals) - ?))', (self.max_entries,))
+            self.conn.commit()
+
+        self.conn.close()
@@ -0,0 +1,113 @@
+"""
+libEnsemble sub-manager routines
+====================================================
+
+With alloc_specs['sub_managers'] = {rank: set of worker ranks}, the manager
+(rank 0) owns H and the gen, and each sub-manager rank runs its own
+dispatch loop for its workers. The manager leases batches of ready sim rows
+to a sub-manager (see libE_manager.lease_to_sub_managers), which gives them
+one at a time to its idle workers and returns the output to the manager in
+batches. Leases and batches are sent without waiting for the other side to
+receive them, so the two never block sending to each other. The manager's loop then scales with the number of sub-managers
+rather than the number of workers.
+
+Sub-manager ranks are in alloc_specs['worker_ranks'] (they are the
+manager's workers); their workers are not. Workers under a sub-manager only
+evaluate sims, and don't share H (alloc_specs['share_H']).
+"""
+
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy as np
+from collections import deque
+
+from message_numbers import STOP_TAG
+from message_numbers import EVAL_SIM_TAG
+from message_numbers import EVAL_GEN_TAG
+from message_numbers import LEASE_TAG
+
+from libE_comms import pack_envelope, pack_result, stop_workers
+
+
+def sub_manager_main(comm, workers, sim_specs, alloc_specs):
+    """
+    Sub-manager routine: dispatches the sim rows leased by the manager to
+    workers until the manager sends STOP_TAG
+
+    Parameters
+    ----------
+    comm: communicator backend (see libE_comms)
+
+    workers: set
+        Ranks of this sub-manager's workers
+
+    sim_specs: dict with parameters/information for simulation calculations
+
+    alloc_specs: dict
+        alloc_specs['return_batch'] (default: the number of workers) is how
+        many evaluations are collected before they are returned
+    """
+    in_dtypes = {EVAL_SIM_TAG: comm.recv(0), EVAL_GEN_TAG: comm.recv(0)}
+    if comm.recv(0) is not None:
+        comm.send(False, 0)
+
+    for w in workers:
+        comm.send(in_dtypes[EVAL_SIM_TAG], w)
+        comm.send(in_dtypes[EVAL_GEN_TAG], w)
+        comm.send(None, w)
+
+    out_dtype = np.dtype(sim_specs['out'])
+    receiver = comm.result_receiver(set([0]) | workers, {EVAL_SIM_TAG: out_dtype, LEASE_TAG: in_dtypes[EVAL_SIM_TAG], STOP_TAG: None})
+    receiver.post(0)
+
+    return_batch = alloc_specs.get('return_batch', len(workers))
+    idle = set(workers)
+
+    # Leased rows (and their sim input) not yet given to a worker
+    pending = deque()
+    # Returned rows, their output and the workers that evaluated them
+    done_rows, done_out, done_ranks = [], [], []
+
+    while 1:
+        stop = False
+        for src, tag, D in receiver.wait():
+            if src == 0:
+                if tag == STOP_TAG:
+                    stop = True
+                    break
+                # The rows are a view into the receive buffer, so copy them
+                pending.extend(zip(D['libE_info']['H_rows'], D['calc_out'].copy()))
+                receiver.post(0)
+            else:
+                done_rows.extend(D['libE_info']['H_rows'])
+                done_out.append(D['calc_out'].copy())
+                done_ranks.extend([src]*len(D['calc_out']))
+                idle.add(src)
+
+        if stop:
+            break
+
+        while idle and pending:
+            w = idle.pop()
+            row, calc_in = pending.popleft()
+
+            buf, rows = pack_envelope(EVAL_SIM_TAG, {'libE_info': {'H_rows': [row]}, 'gen_info': {}}, 1, in_dtypes[EVAL_SIM_TAG])
+            rows[0] = calc_in
+            comm.send_envelope(buf, w, EVAL_SIM_TAG)
+            receiver.post(w)
+
+        # Return a full batch, or whatever is done once all workers are idle
+        if len(done_rows) >= return_batch or (done_rows and len(idle) == len(workers)):
+            # Without waiting for the manager to receive it, since the
+            # manager may be sending a lease at the same time
+            buf = pack_result({'calc_out': np.concatenate(done_out), 'gen_info': {},
+                               'libE_info': {'H_rows': np.array(done_rows), 'sim_ranks': np.array(done_ranks)}},
+                              EVAL_SIM_TAG, out_dtype)
+            comm.isend_envelope(buf, 0, EVAL_SIM_TAG)
+            done_rows, done_out, done_ranks = [], [], []
+
+    stop_workers(comm, receiver, workers)
+
+    buf, _ = pack_envelope(STOP_TAG, None)
+    comm.send_envelope(buf, 0, STOP_TAG)
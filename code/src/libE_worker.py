@@ -6,21 +6,27 @@ from __future__ import division
 from __future__ import absolute_import
 
 
-from mpi4py import MPI
 import numpy as np
 import os, shutil 
+import socket
+import time
 
 from message_numbers import STOP_TAG # manager tells worker to stop
 from message_numbers import EVAL_SIM_TAG 
 from message_numbers import EVAL_GEN_TAG 
 
+from libE_comms import send_result, pack_envelope, unpack_envelope, is_typed_output, ManagerChannel, ENVELOPE_SIZE
+from libE_history import map_H, read_rows
+
 def worker_main(c, sim_specs, gen_specs):
     """ 
     Evaluate calculations given to it by the manager 
 
     Parameters
     ----------
-    c: dict containing fields 'comm' and 'color' for the communicator. 
+    c: dict containing fields 'comm' (a communicator backend, see libE_comms)
+    and 'color' for the communicator, and optionally 'manager', the rank
+    work comes from (0, unless the worker is under a sub-manager).
 
     sim_specs: dict with parameters/information for simulation calculations
 
@@ -30,12 +36,24 @@ def worker_main(c, sim_specs, gen_specs):
     comm = c['comm']
     comm_color = c['color']
     rank = comm.Get_rank()
-    status = MPI.Status()
+    manager = c.get('manager', 0)
 
     dtypes = {}
 
-    dtypes[EVAL_SIM_TAG] = comm.recv(buf=None, source=0)
-    dtypes[EVAL_GEN_TAG] = comm.recv(buf=None, source=0)
+    dtypes[EVAL_SIM_TAG] = comm.recv(manager)
+    dtypes[EVAL_GEN_TAG] = comm.recv(manager)
+
+    # With alloc_specs['share_H'], a worker on the manager's host maps the
+    # History file. It then reads its rows from H and writes sim output into
+    # H, instead of the rows being sent.
+    share_info = comm.recv(manager)
+    H_shared = None
+    if share_info is not None:
+        if share_info['host'] == socket.gethostname() and os.path.exists(share_info['H_file']):
+            H_shared = map_H(share_info['H_file'], share_info['dtype'])
+        comm.send(H_shared is not None, manager)
+
+    out_dtypes = {EVAL_SIM_TAG: np.dtype(sim_specs['out']), EVAL_GEN_TAG: np.dtype(gen_specs['out'])}
 
     
     locations = {}
@@ -53,39 +71,144 @@ def worker_main(c, sim_specs, gen_specs):
 
         locations[EVAL_SIM_TAG] = worker_dir 
 
+    # Work arrives as a single envelope (libE_info, gen_info and the H rows)
+    # received into this buffer. calc_in is a view into it.
+    recv_buf = np.empty(ENVELOPE_SIZE, dtype=np.uint8)
+
+    # With gen_specs['replicate_H'], the gen 'in' fields of H are kept here
+    # and only updated rows are received
+    H_replica = np.zeros(0, dtype=dtypes[EVAL_GEN_TAG])
+
+    # With sim_specs['setup_f'], the state it returns stays resident between
+    # sim calls (until work arrives for a different libE_info['state_key'])
+    sim_state = {}
+
+    # Sim output carries libE_info['calc_time'] (the time for the call) and
+    # libE_info['wait_time'] (the time since this worker last returned
+    # output), which the manager uses to size batches of sim work
+    last_send = None
+
     while 1:
-        libE_info = comm.recv(buf=None, source=0, tag=MPI.ANY_TAG, status=status)
-        calc_tag = status.Get_tag()
+        # With alloc_specs['queue_depth'] > 1, the manager sends the next work
+        # while this worker is busy, so it is usually already waiting here
+        msg, calc_tag = comm.recv_envelope(recv_buf, manager)
         if calc_tag == STOP_TAG: break
+        start = time.time()
+
+        D, calc_in = unpack_envelope(msg, dtypes[calc_tag])
+        libE_info = D['libE_info']
+        gen_info = D['gen_info']
+
+        # Calculations should use this (not the MPI.COMM_WORLD rank, which
+        # differs for other communicator backends)
+        libE_info['rank'] = rank
 
-        gen_info = comm.recv(buf=None, source=0, tag=MPI.ANY_TAG, status=status)
-        calc_in = np.zeros(len(libE_info['H_rows']),dtype=dtypes[calc_tag])
+        if calc_in is None:
+            # Only the row indices were sent, so read the rows from H
+            H_shared = update_shared_H(H_shared, share_info, libE_info['H_rows'])
+            calc_in = read_rows(H_shared, libE_info['H_rows'], dtypes[calc_tag])
 
-        if len(calc_in) > 0: 
-            calc_in = comm.recv(buf=None, source=0)
-            # for i in calc_in.dtype.names: 
-            #     # d = comm.recv(buf=None, source=0)
-            #     # data = np.empty(calc_in[i].shape, dtype=d)
-            #     data = np.empty(calc_in[i].shape, dtype=calc_in[i].dtype)
-            #     comm.Recv(data,source=0)
-            #     calc_in[i] = data
+        if calc_tag == EVAL_GEN_TAG and 'H_len' in libE_info:
+            H_replica = update_replica(H_replica, libE_info['H_rows'], calc_in, libE_info['H_len'])
+            # The gen gets a copy, since it may change calc_in in place
+            calc_in = H_replica[:libE_info['H_len']].copy()
+            libE_info['H_rows'] = range(0,libE_info.pop('H_len'))
 
         if calc_tag in locations:
             saved_dir = os.getcwd()
             os.chdir(locations[calc_tag])
 
+        if libE_info.get('persistent'):
+            # The calculation stays resident and talks to the manager itself
+            libE_info['comm'] = ManagerChannel(comm, dtypes[calc_tag], out_dtypes[calc_tag], calc_tag, manager)
+
+        if calc_tag == EVAL_SIM_TAG and 'setup_f' in sim_specs:
+            libE_info['sim_state'] = update_sim_state(sim_state, sim_specs, libE_info.get('state_key'))
+
         if calc_tag == EVAL_SIM_TAG: 
             H, gen_info = sim_specs['sim_f'][0](calc_in,gen_info,sim_specs,libE_info)
+            libE_info.pop('sim_state', None)
+            libE_info['calc_time'] = time.time() - start
+            if last_send is not None:
+                libE_info['wait_time'] = start - last_send
         else: 
             H, gen_info = gen_specs['gen_f'](calc_in,gen_info,gen_specs,libE_info)
 
         if calc_tag in locations:
             os.chdir(saved_dir)
 
+        if 'comm' in libE_info:
+            del libE_info['persistent']
+            if libE_info.pop('comm').stopped:
+                # The manager has stopped the run and expects no output
+                break
+
         data_out = {'calc_out':H, 'gen_info':gen_info, 'libE_info': libE_info}
+
+        if H_shared is not None and calc_tag == EVAL_SIM_TAG and is_typed_output(H, out_dtypes[calc_tag]):
+            # Write the output into H and just tell the manager it's there
+            rows = libE_info['H_rows']
+            for field in out_dtypes[calc_tag].names:
+                H_shared[field][rows] = H[field]
+            del data_out['calc_out']
         
-        comm.send(obj=data_out, dest=0, tag=calc_tag) 
+        send_result(comm, data_out, calc_tag, out_dtypes[calc_tag], manager)
+        last_send = time.time()
+
+    # Everything this worker sent precedes this reply, so once the manager
+    # has it, the manager has received all of it (see stop_workers)
+    buf, _ = pack_envelope(STOP_TAG, None)
+    comm.send_envelope(buf, manager, STOP_TAG)
+    comm.wait_sends()
 
     # Clean up
+    if 'state' in sim_state and 'teardown_f' in sim_specs:
+        sim_specs['teardown_f'](sim_state['state'], sim_specs)
+
     if 'saved_dir' in locals():
         shutil.rmtree(worker_dir)
+
+
+def update_sim_state(sim_state, sim_specs, key):
+    """
+    Returns the resident state for persistent sims with the given key. The
+    state is made by sim_specs['setup_f'](sim_specs, key) the first time, and
+    again (after sim_specs['teardown_f'](state, sim_specs) is called on the
+    old state) whenever the key changes.
+    """
+    if 'state' in sim_state and sim_state['key'] == key:
+        return sim_state['state']
+
+    if 'state' in sim_state and 'teardown_f' in sim_specs:
+        sim_specs['teardown_f'](sim_state['state'], sim_specs)
+
+    sim_state['key'] = key
+    sim_state['state'] = sim_specs['setup_f'](sim_specs, key)
+
+    return sim_state['state']
+
+
+def update_shared_H(H_shared, share_info, rows):
+    """
+    Maps the History file again if rows go past the end of H_shared (since
+    the manager has grown H). Returns the mapping.
+    """
+    if len(rows) and np.max(rows) >= len(H_shared):
+        H_shared = map_H(share_info['H_file'], share_info['dtype'])
+
+    return H_shared
+
+
+def update_replica(H_replica, rows, calc_in, H_len):
+    """
+    Writes the received rows into the replica of H, first growing it (at
+    least doubling) if it has fewer than H_len rows. Returns the replica.
+    """
+    if len(H_replica) < H_len:
+        H_new = np.zeros(max(H_len, 2*len(H_replica)), dtype=H_replica.dtype)
+        H_new[:len(H_replica)] = H_replica
+        H_replica = H_new
+
+    H_replica[rows] = calc_in
+
+    return H_replica
@@ -1,3 +1,4 @@
 STOP_TAG = 0
 EVAL_SIM_TAG = 1
 EVAL_GEN_TAG = 2
+LEASE_TAG = 3 # manager leases sim rows to a sub-manager
@@ -0,0 +1,98 @@
+# """
+# Compares APOSMM's distance updates (update_history_dist) using the
+# resident spatial index in aposmm_index.py against the previous loop, which
+# computes the distance from each new point to every evaluated point. For
+# each N, a batch of new points is added to N evaluated points. The index is
+# timed on its first call (when it is built) and on a later call (when it is
+# resident), and the results are checked against the loop.
+#
+# Execute via the following command:
+#    python3 bench_aposmm_dist.py [largest N]
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+import sys, os, time
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from aposmm_index import resident_index, update_dists_to_better
+
+n = 2
+batch = 100
+N_max = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**6
+
+
+def loop_update_dists(H, new_inds, p):
+    # Previous implementation
+    for new_ind in new_inds:
+        if p[new_ind]:
+            dist_to_all = cdist(np.atleast_2d(H['x_on_cube'][new_ind]), H['x_on_cube'][p], 'euclidean').flatten()
+            new_better_than = H['f'][new_ind] < H['f'][p]
+
+            t = 'l' if H['local_pt'][new_ind] else 's'
+            inds_of_p = np.logical_and(dist_to_all < H['dist_to_better_' + t][p], new_better_than)
+            updates = np.where(p)[0][inds_of_p]
+            H['dist_to_better_' + t][updates] = dist_to_all[inds_of_p]
+            H['ind_of_better_' + t][updates] = new_ind
+
+            for t, local in [('l', H['local_pt'][p]), ('s', ~H['local_pt'][p])]:
+                better = np.logical_and.reduce((~new_better_than, local, H['sim_id'][p] != new_ind))
+                if np.any(better):
+                    ind = dist_to_all[better].argmin()
+                    H['ind_of_better_' + t][new_ind] = H['sim_id'][p][np.nonzero(better)[0][ind]]
+                    H['dist_to_better_' + t][new_ind] = dist_to_all[better][ind]
+
+
+def make_H(N):
+    H = np.zeros(N + 2*batch, dtype=[('x_on_cube',float,n),('f',float),('local_pt',bool),('sim_id',int),
+                                     ('dist_to_better_l',float),('dist_to_better_s',float),
+                                     ('ind_of_better_l',int),('ind_of_better_s',int)])
+    H['x_on_cube'] = np.random.uniform(0,1,(len(H),n))
+    H['f'] = np.random.uniform(0,1,len(H))
+    H['local_pt'] = np.random.uniform(0,1,len(H)) < 0.1
+    H['sim_id'] = range(len(H))
+    H['dist_to_better_l'] = np.inf
+    H['dist_to_better_s'] = np.inf
+
+    # Give the N evaluated points distances of about the size they'd have
+    for t, local in [('l', H['local_pt'][:N]), ('s', ~H['local_pt'][:N])]:
+        rows = np.flatnonzero(local)
+        d, i = cKDTree(H['x_on_cube'][rows]).query(H['x_on_cube'][:N], k=min(8, len(rows)))
+        H['dist_to_better_' + t][:N] = d[:,-1]
+        H['ind_of_better_' + t][:N] = rows[i[:,-1]]
+
+    return H
+
+
+print('%10s %14s %16s %16s %9s' % ('N', 'loop (s)', 'index first (s)', 'index later (s)', 'speedup'))
+N = 1000
+while N <= N_max:
+    H = make_H(N)
+    H_loop = H.copy()
+    p = np.zeros(len(H), dtype=bool)
+    p[:N] = True
+
+    t_loop = 0
+    t_index = []
+    index = None
+    for k in range(2):
+        new_inds = np.arange(N + k*batch, N + (k+1)*batch)
+        p[new_inds] = True
+
+        start = time.time()
+        loop_update_dists(H_loop, new_inds, p)
+        t_loop = time.time() - start
+
+        start = time.time()
+        index = resident_index(index, H)
+        update_dists_to_better(H, new_inds, p, index)
+        t_index.append(time.time() - start)
+
+        assert np.array_equal(H, H_loop)
+
+    print('%10d %14.2e %16.2e %16.2e %9.1f' % (N, t_loop, t_index[0], t_index[1], t_loop/t_index[1]))
+    N *= 10
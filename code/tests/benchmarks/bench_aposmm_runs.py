@@ -0,0 +1,67 @@
+# """
+# Compares the time APOSMM takes to advance a local optimization run when its
+# method stays suspended between steps (see aposmm_runs.py) against starting
+# the method again and replaying every point in the run, as was done before.
+# Times are the totals for the first k steps of one LN_BOBYQA run.
+#
+# Execute via the following command:
+#    python3 bench_aposmm_runs.py [number of steps]
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+import sys, os, time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+import aposmm_logic as al
+
+n = 8
+steps = int(sys.argv[1]) if len(sys.argv) > 1 else 800
+gen_specs = {'localopt_method': 'LN_BOBYQA', 'lb': np.zeros(n), 'ub': np.ones(n), 'xtol_rel': 1e-12, 'dist_to_bound_multiple': 0.5}
+
+
+def rosenbrock(x):
+    y = 4*x - 2
+    return np.sum(100*(y[1:] - y[:-1]**2)**2 + (1 - y[:-1])**2)
+
+
+def advance_run(resident):
+    H = np.zeros(steps+1, dtype=[('x_on_cube',float,n),('f',float),('returned',bool)])
+    H['x_on_cube'] = np.nan
+    H['x_on_cube'][0] = 0.5
+    H['f'][0] = rosenbrock(H['x_on_cube'][0])
+    H['returned'][0] = True
+    gen_info = {'run_order': {0: [0]}}
+
+    times = []
+    start = time.time()
+    for row in range(1, steps+1):
+        if not resident:
+            for run in al.local_opt_runs.values():
+                run.stop()
+            al.local_opt_runs.clear()
+
+        x_new = al.advance_localopt_method(H, gen_specs, 0, 0, gen_info)[-1]
+        if np.isinf(x_new).all():
+            break
+
+        H['x_on_cube'][row] = x_new
+        H['f'][row] = rosenbrock(x_new[0])
+        H['returned'][row] = True
+        gen_info['run_order'][0].append(row)
+        times.append(time.time() - start)
+
+    return H, times
+
+
+H_resident, t_resident = advance_run(True)
+H_replay, t_replay = advance_run(False)
+assert np.array_equal(H_resident['x_on_cube'], H_replay['x_on_cube'], equal_nan=True)
+
+print('%10s %14s %14s %9s' % ('k', 'replay (s)', 'resident (s)', 'speedup'))
+k = 50
+while k <= len(t_resident):
+    print('%10d %14.2e %14.2e %9.1f' % (k, t_replay[k-1], t_resident[k-1], t_replay[k-1]/t_resident[k-1]))
+    k *= 2
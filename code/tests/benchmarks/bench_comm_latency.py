@@ -0,0 +1,61 @@
+# """
+# Compares the per-task latency of libEnsemble with the MPI communicator and
+# with the local (multiprocessing pipes) backend on one node. A single worker
+# evaluates a trivial sim, so the time per evaluation is the round trip
+# through the manager.
+#
+# Execute via the following command (MPI is only measured with 2 ranks):
+#    mpiexec -np 2 python3 bench_comm_latency.py [number of evaluations]
+# or, for the local backend alone:
+#    python3 bench_comm_latency.py [number of evaluations]
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+import sys, os, time
+import numpy as np
+from mpi4py import MPI
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/alloc_funcs'))
+from libE import libE
+from give_sim_work_first import give_sim_work_first
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+
+def zero_sim(H, gen_info, sim_specs, libE_info):
+    return np.zeros(len(H), dtype=sim_specs['out']), gen_info
+
+
+def batch_gen(H, gen_info, gen_specs, libE_info):
+    return np.zeros(gen_specs['gen_batch_size'], dtype=gen_specs['out']), gen_info
+
+
+sim_specs = {'sim_f': [zero_sim], 'in': ['x'], 'out': [('f',float)]}
+gen_specs = {'gen_f': batch_gen, 'in': [], 'out': [('x',float,2)], 'gen_batch_size': N, 'num_inst': 1, 'batch_mode': True}
+alloc_specs = {'alloc_f': give_sim_work_first, 'manager_ranks': set([0]), 'worker_ranks': set([1])}
+
+
+def run(c):
+    start = time.time()
+    H, gen_info, flag = libE(sim_specs, gen_specs, {'sim_max': N}, alloc_specs=alloc_specs, c=c)
+    return time.time() - start
+
+
+rank = MPI.COMM_WORLD.Get_rank()
+size = MPI.COMM_WORLD.Get_size()
+
+if rank == 0:
+    print('%d evaluations by one worker' % N)
+    print('%10s %12s %18s' % ('comm', 'time (s)', 'latency (us/task)'))
+
+if size == 2:
+    t = run({'comm': MPI.COMM_WORLD, 'color': 0})
+    if rank == 0:
+        print('%10s %12.3f %18.1f' % ('MPI', t, 1e6*t/N))
+
+if rank == 0:
+    t = run({'comm': 'local', 'color': 0})
+    print('%10s %12.3f %18.1f' % ('local', t, 1e6*t/N))
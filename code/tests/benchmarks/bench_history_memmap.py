@@ -0,0 +1,58 @@
+# """
+# Compares the throughput of the History updates when H is in memory and when
+# it is a np.memmap (alloc_specs['H_file']). Points are generated in batches
+# (growing H from a small initial size), given out and returned, as in a run.
+#
+# Execute via the following command:
+#    python3 bench_history_memmap.py [number of points] [length of fvec]
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+import sys, os, time, tempfile
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+import libE_manager as man
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+m = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+batch = 1000
+
+sim_specs = {'in': ['x'], 'out': [('f',float), ('fvec',float,m)]}
+gen_specs = {'in': [], 'out': [('x',float,3), ('priority',float)]}
+
+
+def run(alloc_specs):
+    hist = man.initialize(sim_specs, gen_specs, alloc_specs, {'gen_max': N}, [])[0]
+
+    O = np.zeros(batch, dtype=gen_specs['out'])
+    calc_out = np.zeros(batch, dtype=sim_specs['out'])
+    calc_out['fvec'] = 1.0
+
+    start = time.time()
+    while hist.index < N:
+        hist.update_history_x_in(1, O)
+        rows = np.arange(hist.index-batch, hist.index)
+        hist.update_history_x_out(rows, 2)
+        hist.update_history_f({'libE_info': {'H_rows': rows}, 'calc_out': calc_out})
+
+    # Read back every point, as an analysis of the History would
+    total = np.sum(hist.trim()['fvec'][:,0])
+    assert total == N
+
+    return time.time() - start, hist
+
+
+t_ram, hist = run({'worker_ranks': set([1])})
+print('History of %d rows, %.1f MB' % (N, N*hist.H.dtype.itemsize/2**20))
+print('%10s %12s %14s' % ('H', 'time (s)', 'points/s'))
+print('%10s %12.3f %14.0f' % ('in RAM', t_ram, N/t_ram))
+del hist
+
+H_file = os.path.join(tempfile.mkdtemp(), 'H.dat')
+t_map, hist = run({'worker_ranks': set([1]), 'H_file': H_file})
+print('%10s %12.3f %14.0f' % ('memmap', t_map, N/t_map))
+del hist
+os.remove(H_file)
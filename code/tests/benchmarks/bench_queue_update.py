@@ -0,0 +1,59 @@
+# """
+# Compares the time queue_update_function takes per manager iteration when
+# its per-point partial values are kept between calls (persistent_data, as
+# the manager does) against recomputing every point's values on each call.
+# Each call follows one new point (m component rows) and the return of the
+# components of earlier points, as in chwirut with one residual at a time.
+#
+# Execute via the following command:
+#    python3 bench_queue_update.py [number of points]
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+import sys, os, time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+import aposmm_logic as al
+
+m = 214
+P = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+gen_specs = {'stop_on_NaNs': True, 'stop_partial_fvec_eval': True, 'combine_component_func': lambda x: np.sum(np.power(x,2))}
+
+np.random.seed(0)
+f_i = np.random.uniform(0, 1, P*m)*np.repeat(np.random.exponential(1, P), m)
+
+
+def run_calls(incremental):
+    H = np.zeros(P*m, dtype=[('f_i',float),('returned',bool),('pt_id',int),('paused',bool)])
+    H['pt_id'] = np.repeat(np.arange(P), m)
+    persistent_data = {}
+
+    times = []
+    start = time.time()
+    for p in range(1, P+1):
+        # The rows of the point before last are returned (unless paused)
+        rows = np.arange((p-2)*m, (p-1)*m) if p > 1 else np.zeros(0, dtype=int)
+        rows = rows[~H['paused'][rows]]
+        H['f_i'][rows] = f_i[rows]
+        H['returned'][rows] = True
+
+        if not incremental:
+            persistent_data = {}
+        al.queue_update_function(H[:p*m], gen_specs, persistent_data)
+        times.append(time.time() - start)
+
+    return H, times
+
+
+H_inc, t_inc = run_calls(True)
+H_full, t_full = run_calls(False)
+assert np.array_equal(H_inc['paused'], H_full['paused'])
+
+print('%10s %14s %14s %9s' % ('points', 'full (s)', 'incremental (s)', 'speedup'))
+k = 50
+while k <= P:
+    print('%10d %14.2e %14.2e %9.1f' % (k, t_full[k-1], t_inc[k-1], t_full[k-1]/t_inc[k-1]))
+    k *= 2
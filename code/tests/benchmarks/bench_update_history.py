@@ -0,0 +1,70 @@
+# """
+# Compares the vectorized History updates (update_history_f and
+# update_history_x_out) against the previous row-by-row loops for a range of
+# batch sizes (rows returned or given per dispatch).
+#
+# Execute via the following command:
+#    python3 bench_update_history.py
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+import sys, os, time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+import libE_manager as man
+
+n = 3
+m = 214
+sim_specs = {'in': ['x', 'obj_component'], 'out': [('f_i',float), ('fvec',float,m)]}
+gen_specs = {'in': [], 'out': [('x',float,n), ('priority',float), ('obj_component',int), ('pt_id',int)]}
+alloc_specs = {'worker_ranks': set([1])}
+
+
+def loop_update_history_f(H, D):
+    # Previous implementation
+    new_inds = D['libE_info']['H_rows']
+    H_0 = D['calc_out']
+
+    for j,ind in enumerate(new_inds):
+        for field in H_0.dtype.names:
+            H[field][ind] = H_0[field][j]
+
+        H['returned'][ind] = True
+
+
+def loop_update_history_x_out(H, q_inds, sim_rank):
+    # Previous implementation
+    for i,j in zip(q_inds,range(len(q_inds))):
+        H['given'][i] = True
+        H['given_time'][i] = time.time()
+        H['sim_rank'][i] = sim_rank
+
+
+def best_time(f, reps=5):
+    t = np.inf
+    for _ in range(reps):
+        start = time.time()
+        f()
+        t = min(t, time.time() - start)
+    return t
+
+
+hist = man.initialize(sim_specs, gen_specs, alloc_specs, {'sim_max': 100000}, [])[0]
+H = hist.H
+
+print('%10s %14s %14s %9s %14s %14s %9s' % ('batch', 'loop f (s)', 'bulk f (s)', 'speedup', 'loop x_out (s)', 'bulk x_out (s)', 'speedup'))
+for batch in [1, 10, 100, 1000, 10000]:
+    rows = np.random.permutation(len(H))[:batch]
+    O = np.zeros(batch, dtype=sim_specs['out'])
+    O['f_i'] = np.random.uniform(0,1,batch)
+    D = {'libE_info': {'H_rows': rows}, 'calc_out': O}
+
+    t_loop_f = best_time(lambda: loop_update_history_f(H, D))
+    t_bulk_f = best_time(lambda: hist.update_history_f(D))
+    t_loop_x = best_time(lambda: loop_update_history_x_out(H, rows, 1))
+    t_bulk_x = best_time(lambda: hist.update_history_x_out(rows, 1))
+
+    print('%10d %14.2e %14.2e %9.1f %14.2e %14.2e %9.1f' % (batch, t_loop_f, t_bulk_f, t_loop_f/t_bulk_f, t_loop_x, t_bulk_x, t_loop_x/t_bulk_x))
@@ -0,0 +1,67 @@
+# """
+# Runs libEnsemble on the 6-hump camel problem. Documented here:
+#    https://www.sfu.ca/~ssurjano/camel6.html 
+# 
+# Execute via the following command:
+#    mpiexec -np 4 python3 test_6-hump_camel_elapsed_time_abort_large_output.py
+# The number of concurrent evaluations of the objective function will be 4-1=3.
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+from mpi4py import MPI # for libE communicator
+import sys, os             # for adding to path
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append('../../src')
+from libE import libE
+
+# Import sim_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/sim_funcs'))
+from six_hump_camel import six_hump_camel
+
+# Import gen_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from uniform_sampling import uniform_random_sample
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+
+#State the objective function, its arguments, output, and necessary parameters (and their sizes)
+sim_specs = {'sim_f': [six_hump_camel], # This is the function whose output is being minimized
+             'in': ['x'], # These keys will be given to the above function
+             'out': [('f',float), # This is the output from the function being minimized
+                     ('big',float,2000), # Makes each result longer than a receive buffer
+                    ],
+             'pause_time': 1,
+             }
+
+# State the generating function, its arguments, output, and necessary parameters.
+gen_specs = {'gen_f': uniform_random_sample,
+             'in': ['sim_id'],
+             'out': [('x',float,2),
+                    ],
+             'lb': np.array([-3,-2]),
+             'ub': np.array([ 3, 2]),
+             'gen_batch_size': 5,
+             'num_inst': 1,
+             'batch_mode': False,
+             }
+
+# Tell libEnsemble when to stop
+exit_criteria = {'elapsed_wallclock_time': 0.1}
+
+np.random.seed(1)
+
+# Workers are still sending their (two-part) results when the time expires,
+# so the run only ends if the manager receives them before stopping workers
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria)
+
+if MPI.COMM_WORLD.Get_rank() == 0:
+    assert flag == 2
+    short_name = script_name.split("test_", 1).pop()
+    filename = short_name + '_results_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_ranks=' + str(MPI.COMM_WORLD.Get_size())
+    print("\n\n\nRun completed.\nSaving results to file: " + filename)
+    # Output that came after the time expired wasn't added to H
+    assert not np.any(H['returned'])
@@ -0,0 +1,91 @@
+# """
+# Runs libEnsemble on the 6-hump camel problem with a persistent gen that
+# keeps sending uniformly sampled points as evaluations are streamed back to
+# it. Documented here:
+#    https://www.sfu.ca/~ssurjano/camel6.html
+#
+# Execute via the following command:
+#    mpiexec -np 4 python3 test_6-hump_camel_persistent_uniform_sampling.py
+# The number of concurrent evaluations of the objective function will be 4-2=2,
+# as one worker runs the persistent gen.
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+from mpi4py import MPI # for libE communicator
+import sys, os             # for adding to path
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append('../../src')
+from libE import libE
+
+# Import sim_func
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/sim_funcs'))
+from six_hump_camel import six_hump_camel
+
+# Import gen_func
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from persistent_uniform_sampling import persistent_uniform
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+
+if MPI.COMM_WORLD.Get_size() < 3:
+    # The persistent gen needs a worker of its own
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        print("\nSkipping " + script_name + ": needs at least 2 workers")
+    sys.exit(0)
+
+#State the objective function, its arguments, output, and necessary parameters (and their sizes)
+sim_specs = {'sim_f': [six_hump_camel], # This is the function whose output is being minimized
+             'in': ['x'], # These keys will be given to the above function
+             'out': [('f',float), # This is the output from the function being minimized
+                    ],
+             }
+
+# State the generating function, its arguments, output, and necessary parameters.
+gen_specs = {'gen_f': persistent_uniform,
+             'in': ['sim_id'],
+             'out': [('x',float,2),
+                    ],
+             'lb': np.array([-3,-2]),
+             'ub': np.array([ 3, 2]),
+             'gen_batch_size': 20,
+             'num_inst':1,
+             'persistent': True,
+             }
+
+
+# Tell libEnsemble when to stop
+exit_criteria = {'sim_max': 500}
+
+np.random.seed(1)
+
+# Perform the run
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria)
+
+if MPI.COMM_WORLD.Get_rank() == 0:
+    short_name = script_name.split("test_", 1).pop()
+    filename = short_name + '_results_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_ranks=' + str(MPI.COMM_WORLD.Get_size())
+    print("\n\n\nRun completed.\nSaving results to file: " + filename)
+    np.save(filename, H)
+
+    # All points came from the one persistent gen, and it kept generating
+    # while the sims ran. (The last alloc call may give one point to each
+    # idle sim worker past sim_max.)
+    assert len(np.unique(H['gen_rank'])) == 1
+    assert exit_criteria['sim_max'] <= np.sum(H['given']) < exit_criteria['sim_max'] + MPI.COMM_WORLD.Get_size()
+    assert len(H) > exit_criteria['sim_max']
+
+    minima = np.array([[ -0.089842,  0.712656],
+                       [  0.089842, -0.712656],
+                       [ -1.70361,  0.796084],
+                       [  1.70361, -0.796084],
+                       [ -1.6071,   -0.568651],
+                       [  1.6071,    0.568651]])
+    tol = 0.1
+    for m in minima:
+        assert np.min(np.sum((H['x']-m)**2,1)) < tol
+
+    print("\nlibEnsemble with a persistent uniform random sampler has identified the 6 minima within a tolerance " + str(tol))
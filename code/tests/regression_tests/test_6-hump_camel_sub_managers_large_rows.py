@@ -0,0 +1,103 @@
+# """
+# Runs libEnsemble on the 6-hump camel problem with a sub-manager, as in
+# test_6-hump_camel_sub_managers.py, but with sim input and output rows large
+# enough that both the leases and the returned batches are longer than a
+# receive buffer, so the manager and sub-manager send them to each other at
+# the same time.
+#
+# Execute via the following command:
+#    mpiexec -np 5 python3 test_6-hump_camel_sub_managers_large_rows.py
+# (With fewer than 4 ranks, there are no workers for the sub-manager and the
+# test exits.)
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+from mpi4py import MPI # for libE communicator
+import sys, os             # for adding to path
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append('../../src')
+from libE import libE
+
+# Import sim_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/sim_funcs'))
+from six_hump_camel import six_hump_camel
+
+# Import gen_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from uniform_sampling import uniform_random_sample
+
+# Import alloc_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/alloc_funcs'))
+from give_sim_work_first import give_sim_work_first
+
+size = MPI.COMM_WORLD.Get_size()
+if size < 4:
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        print("Test needs at least 4 ranks")
+    sys.exit(0)
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+
+sim_specs = {'sim_f': [six_hump_camel],
+             'in': ['x','pad'],
+             'out': [('f',float),
+                     ('big',float,2000),
+                    ],
+             }
+
+gen_specs = {'gen_f': uniform_random_sample,
+             'in': ['sim_id'],
+             'out': [('x',float,2),
+                     ('pad',float,1000),
+                    ],
+             'lb': np.array([-3,-2]),
+             'ub': np.array([ 3, 2]),
+             'gen_batch_size': 500,
+             'batch_mode': True,
+             'num_inst':1,
+             }
+
+alloc_specs = {'alloc_f': give_sim_work_first,
+               'manager_ranks': set([0]),
+               'worker_ranks': set([1,2]),
+               'sub_managers': {2: set(range(3,size))},
+               'lease_size': 50,
+               'return_batch': 10,
+               }
+
+exit_criteria = {'sim_max': 800}
+
+np.random.seed(1)
+
+# Perform the run
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria, alloc_specs=alloc_specs)
+
+if MPI.COMM_WORLD.Get_rank() == 0:
+    short_name = script_name.split("test_", 1).pop()
+    filename = short_name + '_results_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_ranks=' + str(size)
+    print("\n\n\nRun completed.\nSaving results to file: " + filename)
+    np.save(filename, H)
+
+    assert flag == 0
+    assert np.sum(H['given']) == exit_criteria['sim_max']
+    assert np.all(H['returned'][H['given']])
+
+    # Rows leased to the sub-manager were evaluated by its workers
+    assert set(H['sim_rank'][H['returned']]).issubset(set([1]) | alloc_specs['sub_managers'][2])
+    assert np.any(H['sim_rank'][H['returned']] >= 3)
+
+    minima = np.array([[ -0.089842,  0.712656],
+                       [  0.089842, -0.712656],
+                       [ -1.70361,  0.796084],
+                       [  1.70361, -0.796084],
+                       [ -1.6071,   -0.568651],
+                       [  1.6071,    0.568651]])
+    tol = 0.1
+    for m in minima:
+        assert np.min(np.sum((H['x']-m)**2,1)) < tol
+
+    print("\nlibEnsemble with a sub-manager and large rows has identified the 6 minima within a tolerance " + str(tol))
@@ -0,0 +1,100 @@
+# """
+# Runs libEnsemble on the 6-hump camel problem. Documented here:
+#    https://www.sfu.ca/~ssurjano/camel6.html 
+# 
+# Execute via the following command:
+#    mpiexec -np 4 python3 call_6-hump_camel.py
+# The number of concurrent evaluations of the objective function will be 4-1=3.
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+from mpi4py import MPI # for libE communicator
+import sys, os             # for adding to path
+import tempfile
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append('../../src')
+from libE import libE
+
+# Import sim_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/sim_funcs'))
+from six_hump_camel import six_hump_camel, six_hump_camel_func
+
+# Import gen_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from uniform_sampling import uniform_random_sample
+
+# Import alloc_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/alloc_funcs'))
+from give_sim_work_first import give_sim_work_first
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+
+#State the objective function, its arguments, output, and necessary parameters (and their sizes)
+sim_specs = {'sim_f': [six_hump_camel], # This is the function whose output is being minimized
+             'in': ['x'], # These keys will be given to the above function
+             'out': [('f',float), # This is the output from the function being minimized
+                    ],
+             'batch_efficiency': 0.9, # Give enough points per sim call to keep workers 90% busy
+             'max_batch': 50,
+             }
+
+# State the generating function, its arguments, output, and necessary parameters.
+gen_specs = {'gen_f': uniform_random_sample,
+             'in': ['sim_id'],
+             'out': [('x',float,2),
+                    ],
+             'lb': np.array([-3,-2]),
+             'ub': np.array([ 3, 2]),
+             'gen_batch_size': 500,
+             'batch_mode': True,
+             'num_inst':1,
+             }
+
+alloc_specs = {'alloc_f': give_sim_work_first,
+               'manager_ranks': set([0]),
+               'worker_ranks': set(range(1,MPI.COMM_WORLD.Get_size())),
+               }
+
+# Tell libEnsemble when to stop
+exit_criteria = {'sim_max': 1000}
+
+np.random.seed(1)
+
+# Perform the run
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria, alloc_specs=alloc_specs)
+
+if MPI.COMM_WORLD.Get_rank() == 0:
+    short_name = script_name.split("test_", 1).pop()
+    filename = short_name + '_results_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_ranks=' + str(MPI.COMM_WORLD.Get_size())
+    print("\n\n\nRun completed.\nSaving results to file: " + filename)
+    np.save(filename, H)
+
+    # Every point given out was evaluated by a worker, and batches stopped
+    # at sim_max
+    assert flag == 0
+    assert np.array_equal(H['given'], H['returned'])
+    assert np.sum(H['given']) == exit_criteria['sim_max']
+    assert set(H['sim_rank'][H['given']]).issubset(alloc_specs['worker_ranks'])
+    for i in np.flatnonzero(H['returned']):
+        assert H['f'][i] == six_hump_camel_func(H['x'][i])
+
+    # The sims are fast next to the time spent getting work, so points were
+    # given out in batches (which share a given_time)
+    _, batch_sizes = np.unique(H['given_time'][H['given']], return_counts=True)
+    assert np.max(batch_sizes) > 1
+
+    minima = np.array([[ -0.089842,  0.712656],
+                       [  0.089842, -0.712656],
+                       [ -1.70361,  0.796084],
+                       [  1.70361, -0.796084],
+                       [ -1.6071,   -0.568651],
+                       [  1.6071,    0.568651]])
+    tol = 0.1
+    for m in minima:
+        assert np.min(np.sum((H['x']-m)**2,1)) < tol
+
+    print("\nlibEnsemble with batched sim work has identified the 6 minima within a tolerance " + str(tol))
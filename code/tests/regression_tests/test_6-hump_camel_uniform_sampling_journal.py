@@ -0,0 +1,97 @@
+# """
+# Runs libEnsemble on the 6-hump camel problem, as in
+# test_6-hump_camel_uniform_sampling.py, with a queue_update_function that
+# pauses points, and checks that the History journal matches the returned H.
+# 
+# Execute via the following command:
+#    mpiexec -np 4 python3 test_6-hump_camel_uniform_sampling_journal.py
+# The number of concurrent evaluations of the objective function will be 4-1=3.
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+from mpi4py import MPI # for libE communicator
+import sys, os             # for adding to path
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append('../../src')
+from libE import libE
+
+# Import sim_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/sim_funcs'))
+from six_hump_camel import six_hump_camel
+
+# Import gen_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from uniform_sampling import uniform_random_sample
+
+# Import the journal reader
+from libE_journal import compact_journal
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+
+#State the objective function, its arguments, output, and necessary parameters (and their sizes)
+sim_specs = {'sim_f': [six_hump_camel], # This is the function whose output is being minimized
+             'in': ['x'], # These keys will be given to the above function
+             'out': [('f',float), # This is the output from the function being minimized
+                    ],
+             'save_every_k': 400,
+             'journal_file': script_name + '_journal.bin'
+             }
+
+# Pauses the points that haven't been given out and have x[0] > 2.5, so the
+# journal must record changes made outside the History's own updates
+def pause_far_points(H, gen_specs, data):
+    H['paused'][~H['given'] & (H['x'][:,0] > 2.5)] = True
+    return H, data
+
+# State the generating function, its arguments, output, and necessary parameters.
+gen_specs = {'gen_f': uniform_random_sample,
+             'in': ['sim_id'],
+             'out': [('x',float,2),
+                    ],
+             'lb': np.array([-3,-2]),
+             'ub': np.array([ 3, 2]),
+             'gen_batch_size': 500,
+             'batch_mode': True,
+             'num_inst':1,
+             'save_every_k': 300,
+             'queue_update_function': pause_far_points
+             }
+
+
+# Tell libEnsemble when to stop
+exit_criteria = {'gen_max': 501}
+
+np.random.seed(1)
+
+# Perform the run
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria)
+
+if MPI.COMM_WORLD.Get_rank() == 0:
+    short_name = script_name.split("test_", 1).pop()
+    filename = short_name + '_results_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_ranks=' + str(MPI.COMM_WORLD.Get_size())
+    print("\n\n\nRun completed.\nSaving results to file: " + filename)
+    np.save(filename, H)
+
+    minima = np.array([[ -0.089842,  0.712656],
+                       [  0.089842, -0.712656],
+                       [ -1.70361,  0.796084],
+                       [  1.70361, -0.796084],
+                       [ -1.6071,   -0.568651],
+                       [  1.6071,    0.568651]])
+    tol = 0.1
+    for m in minima:
+        assert np.min(np.sum((H['x']-m)**2,1)) < tol
+
+    print("\nlibEnsemble with Uniform random sampling has identified the 6 minima within a tolerance " + str(tol))
+
+    # The journal rebuilds the returned History, paused points included
+    assert np.any(H['paused']) and not np.any(H['given'][H['paused']])
+    H_journal = compact_journal(sim_specs['journal_file'])
+    for field in H.dtype.names:
+        assert np.array_equal(H_journal[field], H[field])
+
+    os.remove(sim_specs['journal_file'])
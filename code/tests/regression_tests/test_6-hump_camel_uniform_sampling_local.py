@@ -0,0 +1,84 @@
+# """
+# Runs libEnsemble on the 6-hump camel problem with the local communicator
+# backend: the workers are started as local processes that talk to the manager
+# over pipes, so no MPI launcher is needed.
+# 
+# Execute via the following command:
+#    python3 test_6-hump_camel_uniform_sampling_local.py
+# (When launched with mpiexec, only rank 0 runs. mpi4py isn't imported, since
+# the workers are forked, so the rank is read from the launcher's environment.)
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+import sys, os             # for adding to path
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append('../../src')
+from libE import libE
+
+# Import sim_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/sim_funcs'))
+from six_hump_camel import six_hump_camel
+
+# Import gen_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from uniform_sampling import uniform_random_sample
+
+# Import alloc_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/alloc_funcs'))
+from give_sim_work_first import give_sim_work_first
+
+if int(os.environ.get('OMPI_COMM_WORLD_RANK', os.environ.get('PMI_RANK', 0))) != 0:
+    sys.exit(0)
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+nworkers = 3
+
+sim_specs = {'sim_f': [six_hump_camel],
+             'in': ['x'],
+             'out': [('f',float),
+                    ],
+             }
+
+gen_specs = {'gen_f': uniform_random_sample,
+             'in': ['sim_id'],
+             'out': [('x',float,2),
+                    ],
+             'lb': np.array([-3,-2]),
+             'ub': np.array([ 3, 2]),
+             'gen_batch_size': 500,
+             'batch_mode': True,
+             'num_inst':1,
+             }
+
+alloc_specs = {'alloc_f': give_sim_work_first, 'manager_ranks': set([0]), 'worker_ranks': set(range(1,nworkers+1))}
+
+exit_criteria = {'gen_max': 501}
+
+np.random.seed(1)
+
+# Perform the run
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria, alloc_specs=alloc_specs, c={'comm': 'local', 'color': 0})
+
+short_name = script_name.split("test_", 1).pop()
+filename = short_name + '_results_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_workers=' + str(nworkers)
+print("\n\n\nRun completed.\nSaving results to file: " + filename)
+np.save(filename, H)
+
+assert flag == 0
+assert set(H['sim_rank'][H['returned']]) == alloc_specs['worker_ranks']
+
+minima = np.array([[ -0.089842,  0.712656],
+                   [  0.089842, -0.712656],
+                   [ -1.70361,  0.796084],
+                   [  1.70361, -0.796084],
+                   [ -1.6071,   -0.568651],
+                   [  1.6071,    0.568651]])
+tol = 0.1
+for m in minima:
+    assert np.min(np.sum((H['x']-m)**2,1)) < tol
+
+print("\nlibEnsemble with Uniform random sampling has identified the 6 minima within a tolerance " + str(tol))
@@ -0,0 +1,103 @@
+# """
+# Runs libEnsemble on the 6-hump camel problem. Documented here:
+#    https://www.sfu.ca/~ssurjano/camel6.html 
+# 
+# Execute via the following command:
+#    mpiexec -np 4 python3 call_6-hump_camel.py
+# The number of concurrent evaluations of the objective function will be 4-1=3.
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+from mpi4py import MPI # for libE communicator
+import sys, os             # for adding to path
+import tempfile
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append('../../src')
+from libE import libE
+
+# Import sim_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/sim_funcs'))
+from six_hump_camel import six_hump_camel, six_hump_camel_func
+
+# Import gen_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from uniform_sampling import uniform_random_sample
+
+# Import alloc_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/alloc_funcs'))
+from give_sim_work_first import give_sim_work_first
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+
+#State the objective function, its arguments, output, and necessary parameters (and their sizes)
+sim_specs = {'sim_f': [six_hump_camel], # This is the function whose output is being minimized
+             'in': ['x'], # These keys will be given to the above function
+             'out': [('f',float), # This is the output from the function being minimized
+                    ],
+             'memo': True, # Don't evaluate points matching earlier points
+             'memo_tol': 0.1, # to within about 0.1
+             }
+
+# State the generating function, its arguments, output, and necessary parameters.
+gen_specs = {'gen_f': uniform_random_sample,
+             'in': ['sim_id'],
+             'out': [('x',float,2),
+                    ],
+             'lb': np.array([-3,-2]),
+             'ub': np.array([ 3, 2]),
+             'gen_batch_size': 100,
+             'batch_mode': True,
+             'num_inst':1,
+             }
+
+alloc_specs = {'alloc_f': give_sim_work_first,
+               'manager_ranks': set([0]),
+               'worker_ranks': set(range(1,MPI.COMM_WORLD.Get_size())),
+               }
+
+# Tell libEnsemble when to stop
+exit_criteria = {'sim_max': 500}
+
+np.random.seed(1)
+
+# Perform the run
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria, alloc_specs=alloc_specs)
+
+if MPI.COMM_WORLD.Get_rank() == 0:
+    short_name = script_name.split("test_", 1).pop()
+    filename = short_name + '_results_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_ranks=' + str(MPI.COMM_WORLD.Get_size())
+    print("\n\n\nRun completed.\nSaving results to file: " + filename)
+    np.save(filename, H)
+
+    # Every point was evaluated, or got the output of an earlier point that
+    # rounds to the same multiple of memo_tol. Those don't count toward
+    # sim_max.
+    assert flag == 0
+    assert np.array_equal(H['given'], H['returned'])
+    H = H[H['returned']]
+    evaluated = np.array([H['f'][i] == six_hump_camel_func(H['x'][i]) for i in range(len(H))])
+    assert exit_criteria['sim_max'] <= np.sum(evaluated) < exit_criteria['sim_max'] + MPI.COMM_WORLD.Get_size()
+    assert np.sum(~evaluated) > 0
+
+    f_evaluated = {}
+    keys = [tuple(np.round(x/sim_specs['memo_tol'])) for x in H['x']]
+    for i in np.flatnonzero(evaluated):
+        f_evaluated.setdefault(keys[i], []).append(H['f'][i])
+    for i in np.flatnonzero(~evaluated):
+        assert H['f'][i] in f_evaluated[keys[i]]
+
+    minima = np.array([[ -0.089842,  0.712656],
+                       [  0.089842, -0.712656],
+                       [ -1.70361,  0.796084],
+                       [  1.70361, -0.796084],
+                       [ -1.6071,   -0.568651],
+                       [  1.6071,    0.568651]])
+    tol = 0.1
+    for m in minima:
+        assert np.min(np.sum((H['x']-m)**2,1)) < tol
+
+    print("\nlibEnsemble with an evaluation cache has identified the 6 minima within a tolerance " + str(tol))
@@ -67,6 +67,7 @@ gen_specs = {'gen_f': uniform_random_sample_with_different_nodes_and_ranks,
              'num_inst': 1,
              'batch_mode': False,
              'give_all_with_same_priority': True,
+             'replicate_H': True, # Only send the gen rows it hasn't seen
              # 'save_every_k': 10
              }
 
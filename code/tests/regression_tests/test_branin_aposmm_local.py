@@ -0,0 +1,113 @@
+# """
+# Runs APOSMM on the Branin function with the local communicator backend. The
+# worker is a local process (so the gen must use libE_info['rank'], not an MPI
+# rank), and finds the same points as test_branin_aposmm.py with one worker.
+#
+# Execute via the following command:
+#    python3 test_branin_aposmm_local.py
+# (When launched with mpiexec, only rank 0 runs.)
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+from mpi4py import MPI # for the rank when launched with mpiexec
+import sys             # for adding to path
+import os    
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+from libE import libE
+
+# Import sim_func and declare directory to be copied by each worker to do its evaluations in 
+sim_dir_name='../../examples/sim_funcs/branin'
+sys.path.append(os.path.join(os.path.dirname(__file__), sim_dir_name))
+from branin_obj import call_branin as obj_func
+
+# Import gen_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from aposmm_logic import aposmm_logic
+
+# Import alloc_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/alloc_funcs'))
+from give_sim_work_first import give_sim_work_first
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+
+### Declare the run parameters/functions
+max_sim_budget = 150
+n = 2
+w = 1 # Number of workers
+
+#State the objective function, its arguments, output, and necessary parameters (and their sizes)
+sim_specs = {'sim_f': [obj_func], # This is the function whose output is being minimized
+             'in': ['x'], # These keys will be given to the above function
+             'out': [('f',float), # This is the output from the function being minimized
+                    ],
+             'sim_dir': sim_dir_name, # to be copied by each worker 
+             }
+
+gen_out = [('x',float,n),
+      ('x_on_cube',float,n),
+      ('sim_id',int),
+      ('priority',float),
+      ('local_pt',bool),
+      ('known_to_aposmm',bool), # Mark known points so fewer updates are needed.
+      ('dist_to_unit_bounds',float),
+      ('dist_to_better_l',float),
+      ('dist_to_better_s',float),
+      ('ind_of_better_l',int),
+      ('ind_of_better_s',int),
+      ('started_run',bool),
+      ('num_active_runs',int), # Number of active runs point is involved in
+      ('local_min',bool),
+      ]
+
+# State the generating function, its arguments, output, and necessary parameters.
+gen_specs = {'gen_f': aposmm_logic,
+             'in': [o[0] for o in gen_out] + ['f', 'returned'],
+             'out': gen_out,
+             'lb': np.array([-5,0]),
+             'ub': np.array([10,15]),
+             'initial_sample': 20,
+             'localopt_method': 'LN_BOBYQA',
+             'dist_to_bound_multiple': 0.99,
+             'xtol_rel': 1e-3,
+             'min_batch_size': w,
+             'num_inst': 1,
+             'batch_mode': True,
+             }
+
+# Tell libEnsemble when to stop
+exit_criteria = {'sim_max': max_sim_budget, 
+                 'elapsed_wallclock_time': 100,
+                 'stop_val': ('f', -1), # key must be in sim_specs['out'] or gen_specs['out'] 
+                }
+
+alloc_specs = {'alloc_f': give_sim_work_first, 'manager_ranks': set([0]), 'worker_ranks': set(range(1,w+1))}
+
+np.random.seed(1)
+# Perform the run
+
+if __name__ == "__main__" and MPI.COMM_WORLD.Get_rank() == 0:
+    H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria, alloc_specs=alloc_specs, c={'comm': 'local', 'color': 0})
+
+    assert flag == 0
+    short_name = script_name.split("test_", 1).pop()
+    filename = short_name + '_History_length=' + str(len(H)) + '_evals=' + str(sum(H['returned'])) + '_ranks=' + str(w)
+    print("\n\n\nRun completed.\nSaving results to file: " + filename)
+    np.save(filename, H)
+
+    minima_and_func_val_file = os.path.join(sim_dir_name, 'known_minima_and_func_values') 
+
+    if os.path.isfile(minima_and_func_val_file):
+        M = np.loadtxt(minima_and_func_val_file)
+        M = M[M[:,-1].argsort()] # Sort by function values (last column)
+        k = 3
+        tol = 1e-5
+        for i in range(k):
+            print(np.min(np.sum((H['x'][H['local_min']]-M[i,:n])**2,1)))
+            assert np.min(np.sum((H['x'][H['local_min']]-M[i,:n])**2,1)) < tol
+
+        print("\nlibEnsemble with APOSMM has identified the " + str(k) + " best minima within a tolerance " + str(tol))
@@ -0,0 +1,79 @@
+# """
+# Runs libEnsemble with a uniform random sample on the chwirut problem, one
+# residual at a time. Each worker keeps the data for a residual in a persistent
+# sim state (set up by sim_specs['setup_f']) and is preferably given points for
+# the residual it already holds.
+#
+# Execute via the following command:
+#    mpiexec -np 4 python3 test_chwirut_persistent_sim_state.py
+# """
+
+from __future__ import division
+from __future__ import absolute_import
+
+from mpi4py import MPI # for libE communicator
+import sys, os             # for adding to path
+import numpy as np
+
+# Import libEnsemble main
+sys.path.append('../../src')
+from libE import libE
+
+# Import sim_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/sim_funcs'))
+from chwirut1 import libE_component_with_state, setup_component
+ 
+# Import gen_func 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from uniform_sampling import uniform_random_sample_obj_components 
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+
+### Declare the run parameters/functions
+m = 214
+n = 3
+max_sim_budget = 4*m
+
+sim_specs = {'sim_f': [libE_component_with_state],
+             'in': ['x', 'obj_component'],
+             'out': [('f_i',float),
+                     ('state_evals',int),
+                     ],
+             'setup_f': setup_component,
+             'state_key': 'obj_component',
+             'affinity_window': 2*m,
+             }
+
+gen_out = [('x',float,n),
+      ('obj_component',int),
+      ('pt_id',int),
+      ]
+
+gen_specs = {'gen_f': uniform_random_sample_obj_components,
+             'in': ['pt_id'],
+             'out': gen_out,
+             'lb': -2*np.ones(3),
+             'ub':  2*np.ones(3),
+             'gen_batch_size': 2,
+             'components': m,
+             'num_inst': 1,
+             'batch_mode': True,
+             }
+
+exit_criteria = {'sim_max': max_sim_budget, # must be provided
+                  }
+
+np.random.seed(1)
+# Perform the run
+H, gen_info, flag = libE(sim_specs, gen_specs, exit_criteria)
+
+if MPI.COMM_WORLD.Get_rank() == 0:
+    assert flag == 0
+    short_name = script_name.split("test_", 1).pop()    
+    filename = short_name + '_results_after_evals=' + str(max_sim_budget) + '_ranks=' + str(MPI.COMM_WORLD.Get_size())
+    print("\n\n\nRun completed.\nSaving results to file: " + filename)
+    np.save(filename, H)
+
+    # Each pair of points shares its residuals, so workers reuse their state
+    assert np.all(H['state_evals'][H['returned']] >= 1)
+    assert np.max(H['state_evals']) > 1
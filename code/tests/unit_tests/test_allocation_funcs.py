@@ -7,22 +7,108 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/alloc_fu
 
 import libE_manager as man
 from test_manager_main import make_criteria_and_specs_1
-from give_sim_work_first import give_sim_work_first
+from give_sim_work_first import give_sim_work_first, sim_batch_size
 
 al = {'alloc_f': give_sim_work_first, 'worker_ranks':set([1,2]),'persist_gen_ranks':set([])}
 
 def test_decide_work_and_resources():
 
     sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
-    H, Hs_ind,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
 
 
     # Don't give out work when idle is empty
     active_w = set([1,2,3,4])
     idle_w = set()
-    Work, gen_info = al['alloc_f'](active_w, idle_w, H, Hs_ind, sim_specs, gen_specs, term_test, {})
+    Work, gen_info = al['alloc_f'](active_w, idle_w, hist, sim_specs, gen_specs, term_test, {})
     assert len(Work) == 0 
     # 
 
+
+def test_give_oldest_ready_points():
+    sim_specs={'sim_f': [np.linalg.norm], 'in':['x'], 'out':[('g',float)], }
+    gen_specs={'gen_f': [np.random.uniform], 'in':[], 'out':[('x',float)], }
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, {'sim_max':10},[]) 
+    hist.update_history_x_in(3, np.zeros(6, dtype=gen_specs['out']))
+
+    # Points 0 and 2 are given and paused, so workers get 1 and 3
+    hist.update_history_x_out(np.array([0]), 3)
+    hist.H['paused'][2] = True
+    active_w = {man.EVAL_GEN_TAG:set(), man.EVAL_SIM_TAG:set(), 'blocked':set()}
+    Work, gen_info = al['alloc_f'](active_w, set([1,2]), hist, sim_specs, gen_specs, term_test, {})
+    assert sorted(Work[w]['libE_info']['H_rows'][0] for w in Work) == [1,3]
+
+    assert np.array_equal(hist.ready.next(hist.H, 5), [4,5])
+
+
+def test_give_points_for_held_sim_state():
+    sim_specs={'sim_f': [np.linalg.norm], 'in':['x'], 'out':[('g',float)], 'setup_f':dict, 'state_key':'c'}
+    gen_specs={'gen_f': [np.random.uniform], 'in':[], 'out':[('x',float),('c',int)], }
+    hist,term_test,_,active_w = man.initialize(sim_specs, gen_specs, al, {'sim_max':10},[]) 
+    O = np.zeros(6, dtype=gen_specs['out'])
+    O['c'] = [0,1,2,0,1,2]
+    hist.update_history_x_in(3, O)
+
+    # Worker 2 holds the state for c=2, so it gets point 2; worker 1 holds
+    # nothing and gets the oldest point
+    active_w['sim_state'] = {2: 2}
+    Work, gen_info = al['alloc_f'](active_w, set([1,2]), hist, sim_specs, gen_specs, term_test, {})
+    assert Work[1]['libE_info']['H_rows'][0] == 0
+    assert Work[2]['libE_info']['H_rows'][0] == 2
+
+
+def test_give_same_priority_points_with_one_sim_state():
+    sim_specs={'sim_f': [np.linalg.norm], 'in':['x'], 'out':[('g',float)], 'setup_f':dict, 'state_key':'c'}
+    gen_specs={'gen_f': [np.random.uniform], 'in':[], 'out':[('x',float),('c',int),('priority',float)], 'give_all_with_same_priority':True}
+    hist,term_test,_,active_w = man.initialize(sim_specs, gen_specs, al, {'sim_max':10},[]) 
+    O = np.zeros(5, dtype=gen_specs['out'])
+    O['c'] = [1,0,1,0,1]
+    O['priority'] = [1,1,1,1,0]
+    hist.update_history_x_in(3, O)
+
+    # The points with the top priority and the first one's state_key are
+    # given together
+    Work, gen_info = al['alloc_f'](active_w, set([1]), hist, sim_specs, gen_specs, term_test, {})
+    assert np.array_equal(Work[1]['libE_info']['H_rows'], [0,2])
+
+
+def test_queue_sims_on_busy_workers():
+    sim_specs={'sim_f': [np.linalg.norm], 'in':['x'], 'out':[('g',float)], }
+    gen_specs={'gen_f': [np.random.uniform], 'in':[], 'out':[('x',float)], }
+    hist,term_test,idle_w,active_w = man.initialize(sim_specs, gen_specs, dict(al, queue_depth=2), {'sim_max':10},[]) 
+    hist.update_history_x_in(3, np.zeros(1, dtype=gen_specs['out']))
+
+    # Worker 1 is running a sim and has a free slot; worker 2 is empty, so it
+    # gets the only point
+    active_w['slots'][1].append((man.EVAL_SIM_TAG, False))
+    Work, gen_info = al['alloc_f'](active_w, idle_w, hist, sim_specs, gen_specs, term_test, {})
+    assert list(Work) == [2] and Work[2]['tag'] == man.EVAL_SIM_TAG
+
+    # With no sim work left, gen work isn't queued behind worker 1's sim
+    Work, gen_info = al['alloc_f'](active_w, set([1]), hist, sim_specs, gen_specs, term_test, gen_info)
+    assert len(Work) == 0
+
+
+def test_batch_sims_by_measured_times():
+    sim_specs={'sim_f': [np.linalg.norm], 'in':['x'], 'out':[('g',float)], 'batch_efficiency':0.75}
+    gen_specs={'gen_f': [np.random.uniform], 'in':[], 'out':[('x',float),('num_nodes',int)], }
+    hist,term_test,idle_w,active_w = man.initialize(sim_specs, gen_specs, al, {'sim_max':100},[]) 
+    O = np.ones(20, dtype=gen_specs['out'])
+    O['num_nodes'][6] = 2
+    hist.update_history_x_in(3, O)
+
+    # Nothing measured yet, so one point per call
+    assert sim_batch_size(hist, sim_specs, 2) == 1
+
+    # 1ms per point and 1ms waiting for work: 3 points give 75% efficiency
+    hist.update_sim_timing({'H_rows': [0,1], 'calc_time': 0.002, 'wait_time': 0.001})
+    assert sim_batch_size(hist, sim_specs, 2) == 3
+    assert sim_batch_size(hist, dict(sim_specs, max_batch=2), 2) == 2
+
+    # Batches stop before the multi-node point
+    Work, gen_info = al['alloc_f'](active_w, idle_w, hist, sim_specs, gen_specs, term_test, {})
+    assert np.array_equal(Work[1]['libE_info']['H_rows'], [0,1,2])
+    assert np.array_equal(Work[2]['libE_info']['H_rows'], [3,4,5])
+
 if __name__ == "__main__":
     test_initialize_history()
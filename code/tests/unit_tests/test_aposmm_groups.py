@@ -0,0 +1,94 @@
+import sys, os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from aposmm_groups import resident_groups, PartialFvals
+
+
+def check_groups(groups, H):
+    ids = np.unique(H['pt_id'])
+    assert np.array_equal(groups.ids, ids)
+    for g, pt_id in enumerate(ids):
+        assert np.array_equal(groups.rows_of(g), np.flatnonzero(H['pt_id']==pt_id))
+        assert groups.num_returned[g] == np.sum(H['returned'][H['pt_id']==pt_id])
+    assert np.array_equal(groups.group, groups.groups_of(H['pt_id']))
+
+
+def test_groups_as_H_grows():
+    m = 3
+    H = np.zeros(60, dtype=[('pt_id',int),('returned',bool)])
+    # Components of a point aren't always in consecutive rows
+    H['pt_id'] = np.arange(60)//m
+    H['pt_id'][30:60] = np.arange(30) % 10 + 10
+
+    groups = None
+    for k in [6, 6, 30, 45, 60]:
+        H['returned'][:k-3] = True
+        groups = resident_groups(groups, H[:k])
+        check_groups(groups, H[:k])
+
+    complete = [np.all(H['returned'][H['pt_id']==pt_id]) for pt_id in groups.ids]
+    assert np.array_equal(groups.complete(), complete)
+    assert not np.all(complete)
+
+
+def test_groups_rebuilt():
+    H = np.zeros(20, dtype=[('pt_id',int),('returned',bool)])
+    H['pt_id'] = np.arange(20)//2
+    H['returned'][:10] = True
+
+    groups = resident_groups(None, H[:10])
+
+    # A new pt_id smaller than the last
+    H['pt_id'][10:12] = 1
+    groups = resident_groups(groups, H[:12])
+    check_groups(groups, H[:12])
+
+    # A different H (or one with returned rows that aren't) gets new groups
+    H2 = H.copy()
+    H2['returned'] = False
+    assert not groups.matches(H2)
+    new_groups = resident_groups(groups, H2)
+    assert new_groups is not groups
+    check_groups(new_groups, H2)
+
+    H2['pt_id'][0] = 5
+    assert not new_groups.matches(H2)
+
+
+def test_partial_fvals():
+    m = 4
+    H = np.zeros(80, dtype=[('f_i',float),('returned',bool),('pt_id',int)])
+    H['pt_id'] = np.arange(80)//m
+    f_i = np.random.uniform(0,1,80)
+    f_i[[9,50]] = np.nan
+
+    fvals = PartialFvals(np.linalg.norm)
+    for k in range(m, 81, m):
+        returned = np.random.uniform(0,1,k) < 0.5
+        H['returned'][:k] = np.logical_or(H['returned'][:k], returned)
+        H['f_i'] = np.where(H['returned'], f_i, 0)
+
+        fvals.update(H[:k])
+
+        ids = fvals.groups.ids
+        has_nan = np.array([np.any(np.isnan(H['f_i'][H['pt_id']==i])) for i in ids])
+        complete = np.array([np.all(H['returned'][H['pt_id']==i]) for i in ids]) & ~has_nan
+        values = np.array([np.linalg.norm(H['f_i'][H['pt_id']==i]) for i in ids])
+
+        assert np.array_equal(fvals.has_nan, has_nan)
+        assert np.array_equal(fvals.complete, complete)
+        assert np.array_equal(fvals.fvals, values, equal_nan=True)
+        if np.any(complete):
+            assert fvals.best_complete == np.nanmin(values[complete])
+        else:
+            assert fvals.best_complete == np.inf
+
+        worse = fvals.worse(np.arange(len(ids)))
+        assert np.array_equal(worse, np.flatnonzero((values > fvals.best_complete) & ~complete))
+
+
+if __name__ == "__main__":
+    test_groups_as_H_grows()
+    test_groups_rebuilt()
+    test_partial_fvals()
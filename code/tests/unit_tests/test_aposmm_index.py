@@ -0,0 +1,99 @@
+import sys, os
+import numpy as np
+from scipy.spatial.distance import cdist
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+import aposmm_index
+from aposmm_index import BetterPointIndex, resident_index, update_dists_to_better
+
+
+def make_H(N, n, seed):
+    np.random.seed(seed)
+    H = np.zeros(N, dtype=[('x_on_cube',float,n),('f',float),('local_pt',bool),('sim_id',int),
+                           ('dist_to_better_l',float),('dist_to_better_s',float),
+                           ('ind_of_better_l',int),('ind_of_better_s',int)])
+    # Snap some points to a grid and round f, so there are ties in both
+    H['x_on_cube'] = np.random.uniform(0,1,(N,n))
+    H['x_on_cube'][::3] = np.round(H['x_on_cube'][::3]*4)/4
+    H['f'] = np.round(np.random.uniform(0,10,N), 1)
+    H['local_pt'] = np.random.uniform(0,1,N) < 0.3
+    H['sim_id'] = range(N)
+    H['dist_to_better_l'] = np.inf
+    H['dist_to_better_s'] = np.inf
+    H['ind_of_better_l'] = -1
+    H['ind_of_better_s'] = -1
+    return H
+
+
+def brute_force(H, new_inds, p):
+    # The loop update_history_dist used before the index
+    for new_ind in new_inds:
+        if p[new_ind]:
+            dist_to_all = cdist(np.atleast_2d(H['x_on_cube'][new_ind]), H['x_on_cube'][p], 'euclidean').flatten()
+            new_better_than = H['f'][new_ind] < H['f'][p]
+
+            t = 'l' if H['local_pt'][new_ind] else 's'
+            inds_of_p = np.logical_and(dist_to_all < H['dist_to_better_' + t][p], new_better_than)
+            updates = np.where(p)[0][inds_of_p]
+            H['dist_to_better_' + t][updates] = dist_to_all[inds_of_p]
+            H['ind_of_better_' + t][updates] = new_ind
+
+            for t, local in [('l', H['local_pt'][p]), ('s', ~H['local_pt'][p])]:
+                better = np.logical_and.reduce((~new_better_than, local, H['sim_id'][p] != new_ind))
+                if np.any(better):
+                    ind = dist_to_all[better].argmin()
+                    H['ind_of_better_' + t][new_ind] = H['sim_id'][p][np.nonzero(better)[0][ind]]
+                    H['dist_to_better_' + t][new_ind] = dist_to_all[better][ind]
+
+
+def check_same_as_brute_force(N, n, batches, seed):
+    H = make_H(N, n, seed)
+    H_ref = H.copy()
+    returned = np.zeros(N, dtype=bool)
+    index = None
+
+    for new_inds in np.array_split(np.arange(N), batches):
+        returned[new_inds] = True
+        p = returned & (H['f'] != 9.9)  # As if some f were nan
+
+        brute_force(H_ref, new_inds, p)
+        index = resident_index(index, H)
+        update_dists_to_better(H, new_inds, p, index)
+
+        assert np.array_equal(H, H_ref)
+
+
+def test_same_as_brute_force():
+    # Search the trees even though there are few points
+    brute_force_max = aposmm_index.BRUTE_FORCE_MAX
+    aposmm_index.BRUTE_FORCE_MAX = 0
+    check_same_as_brute_force(300, 2, 1, 0)
+    check_same_as_brute_force(2000, 3, 7, 1)
+    check_same_as_brute_force(1500, 5, 40, 2)
+
+    # Start using the trees partway through
+    aposmm_index.BRUTE_FORCE_MAX = 500
+    check_same_as_brute_force(1500, 3, 7, 3)
+
+    aposmm_index.BRUTE_FORCE_MAX = brute_force_max
+    check_same_as_brute_force(1500, 3, 7, 4)
+
+
+def test_resident_index_reset():
+    H = make_H(200, 2, 3)
+    p = np.ones(200, dtype=bool)
+
+    index = resident_index(None, H)
+    update_dists_to_better(H, np.arange(200), p, index)
+    assert resident_index(index, H) is index
+
+    # A different H (or a shorter one) gets a new index
+    H2 = make_H(200, 2, 4)
+    assert resident_index(index, H2) is not index
+    assert resident_index(index, H[:100]) is not index
+    assert isinstance(resident_index(index, H2), BetterPointIndex)
+
+
+if __name__ == "__main__":
+    test_same_as_brute_force()
+    test_resident_index_reset()
@@ -13,7 +13,7 @@ alloc = {'worker_ranks':set([1,2]),'persist_gen_ranks':set([])}
 
 def test_failing_localopt_method():
     sim_specs_0, gen_specs_0, exit_criteria_0 = make_criteria_and_specs_0()
-    H, _, _, _, _ = man.initialize(sim_specs_0, gen_specs_0, alloc, exit_criteria_0,[]) 
+    H = man.initialize(sim_specs_0, gen_specs_0, alloc, exit_criteria_0,[])[0].H
     H['returned'] = 1
 
     gen_specs_0['localopt_method'] = 'BADNAME'
@@ -28,9 +28,12 @@ def test_failing_localopt_method():
 
 def test_exception_raising():
     sim_specs_0, gen_specs_0, exit_criteria_0 = make_criteria_and_specs_0()
-    H, _, _, _, _ = man.initialize(sim_specs_0, gen_specs_0, alloc, exit_criteria_0,[]) 
+    H = man.initialize(sim_specs_0, gen_specs_0, alloc, exit_criteria_0,[])[0].H
     H['returned'] = 1
 
+    # gen_specs_0 lacks the methods' settings, which isn't a failure of the
+    # method, so it is raised
+    H['x_on_cube'] = 0.5
     for method in ['LN_SBPLX','pounders']:
         gen_specs_0['localopt_method'] = method
         try: 
@@ -39,6 +42,58 @@ def test_exception_raising():
             assert 1, "Failed like it should have"
         else:
             assert 0, "Failed like it should have"
+        assert 0 not in al.local_opt_runs
+
+
+def test_failed_localopt_run_is_dropped():
+    # NLopt rejects the initial step of a run starting on a bound, and the
+    # run is returned as finished with exit_code 0
+    gen_specs = {'localopt_method': 'LN_SBPLX', 'lb': np.zeros(2), 'ub': np.ones(2), 'xtol_rel': 1e-4}
+    H = np.zeros(1, dtype=[('x_on_cube',float,2),('f',float),('returned',bool)])
+    H['x_on_cube'][0] = [0, 0.5]
+    H['returned'] = True
+
+    x_opt, exit_code, _, _, x_new = al.advance_localopt_method(H, gen_specs, 0, 0, {'run_order': {0:[0]}})
+    assert x_opt is None and exit_code == 0 and np.isinf(x_new).all()
+    assert 0 not in al.local_opt_runs
+
+
+def test_resumed_localopt_run():
+    # A run advanced by its suspended method gives the same points as one
+    # whose method is started again (and given every value) each time
+    gen_specs = {'localopt_method': 'LN_BOBYQA', 'lb': np.zeros(2), 'ub': np.ones(2), 'xtol_rel': 1e-4, 'dist_to_bound_multiple': 0.5}
+    fun = lambda x: np.sum((x - [0.3, 0.7])**2)
+
+    X = {}
+    for resident in [True, False]:
+        H = np.zeros(200, dtype=[('x_on_cube',float,2),('f',float),('returned',bool)])
+        H['x_on_cube'] = np.nan
+        H['x_on_cube'][0] = [0.5, 0.5]
+        H['f'][0] = fun(H['x_on_cube'][0])
+        H['returned'][0] = True
+        gen_info = {'run_order': {0: [0]}}
+
+        for row in range(1, len(H)):
+            if not resident:
+                for run in al.local_opt_runs.values():
+                    run.stop()
+                al.local_opt_runs.clear()
+
+            x_opt, exit_code, gen_info, run_inds, x_new = al.advance_localopt_method(H, gen_specs, 0, 0, gen_info)
+            if np.isinf(x_new).all():
+                assert exit_code > 0
+                break
+
+            H['x_on_cube'][row] = x_new
+            H['f'][row] = fun(x_new[0])
+            H['returned'][row] = True
+            gen_info['run_order'][0].append(row)
+
+        X[resident] = H['x_on_cube'][run_inds]
+
+    assert 0 not in al.local_opt_runs, "Finished run wasn't removed"
+    assert np.allclose(X[True][-1], [0.3, 0.7], atol=1e-3)
+    assert np.array_equal(X[True], X[False])
 
 
 def test_decide_where_to_start_localopt():
@@ -66,13 +121,19 @@ def test_calc_rk():
 
 def test_initialize_APOSMM():
     sim_specs_0, gen_specs_0, exit_criteria_0 = make_criteria_and_specs_0()
-    H, _, _, _, _ = man.initialize(sim_specs_0, gen_specs_0, alloc, exit_criteria_0,[]) 
+    H = man.initialize(sim_specs_0, gen_specs_0, alloc, exit_criteria_0,[])[0].H
 
     al.initialize_APOSMM(H,gen_specs_0)
     
 
 def test_queue_update_function():
 
+    # Nothing is done (or needed from H) without stop_on_NaNs or
+    # stop_partial_fvec_eval
+    H = np.zeros(10, dtype=[('returned',bool),('paused',bool)])
+    H,_ = al.queue_update_function(H, {}, {})
+    assert not np.any(H['paused'])
+
     gen_specs_0 = {}
     gen_specs_0 = {}
     gen_specs_0['stop_on_NaNs'] = True
@@ -96,6 +157,31 @@ def test_queue_update_function():
     assert np.all(H['paused'][4:])
 
 
+def test_queue_update_function_incremental():
+
+    gen_specs_0 = {'stop_on_NaNs': True, 'stop_partial_fvec_eval': True, 'combine_component_func': np.linalg.norm}
+    H = np.zeros(300, dtype=[('f_i',float),('returned',bool),('pt_id',int),('paused',bool)])
+    H['pt_id'] = np.arange(300)//3
+    f_i = np.random.uniform(0,1,300)*np.repeat(np.random.exponential(1,100),3)
+    f_i[[10,200]] = np.nan
+
+    # Keeping persistent_data between calls pauses the same rows as starting
+    # each call anew
+    H_inc = H.copy()
+    persistent_data = {}
+    for k in range(3, 301, 6):
+        returned = (np.random.uniform(0,1,k) < 0.5) & ~H['paused'][:k]
+        for H_k in [H, H_inc]:
+            H_k['returned'][:k] |= returned
+            H_k['f_i'][:k] = np.where(H_k['returned'][:k], f_i[:k], 0)
+
+        al.queue_update_function(H[:k], gen_specs_0, {})
+        al.queue_update_function(H_inc[:k], gen_specs_0, persistent_data)
+        assert np.array_equal(H['paused'], H_inc['paused'])
+
+    assert np.any(H['paused'])
+
+
 # if __name__ == "__main__":
 #     import ipdb; ipdb.set_trace()
 #     test_failing_localopt_method()
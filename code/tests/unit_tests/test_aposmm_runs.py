@@ -0,0 +1,156 @@
+import sys, os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/gen_funcs'))
+from aposmm_runs import LocalOptRun, RunPool, resident_run, OptimizerError
+
+
+def compass_search(x0, objective, step=0.25, tol=1e-2):
+    # A small optimizer that asks for one point at a time
+    x = np.array(x0, dtype=float)
+    f = objective(x)
+    while step > tol:
+        for d in np.vstack((np.eye(len(x)), -np.eye(len(x)))):
+            f_new = objective(x + step*d)
+            if f_new < f:
+                x, f = x + step*d, f_new
+                break
+        else:
+            step /= 2
+    return x, 1
+
+
+def test_run_asks_and_finishes():
+    fun = lambda x: np.sum((x - 0.3)**2)
+    run = LocalOptRun(lambda objective: compass_search([0.5, 0.5], objective))
+
+    X = []
+    while run.x is not None:
+        X.append(run.x)
+        run.tell(len(X)-1, run.x, fun(run.x))
+
+    assert np.allclose(run.result[0], 0.3, atol=1e-2)
+    assert run.result[1] == 1
+    assert run.told == list(range(len(X)))
+
+
+def test_resident_run():
+    fun = lambda x: np.sum((x - 0.3)**2)
+    solve = lambda objective: compass_search([0.5, 0.5], objective)
+    runs = {}
+    X = np.zeros((10, 2))
+
+    def told_three():
+        for run in runs.values():
+            run.stop()
+        runs.clear()
+        run = resident_run(runs, 0, 'a', [], X, solve)
+        for i in range(3):
+            X[i] = run.x
+            run.tell(i, run.x, fun(run.x))
+        return run
+
+    # Continued if it was told the first rows of the run (with the same points)
+    run = told_three()
+    assert resident_run(runs, 0, 'a', [0, 1, 2, 3], X, solve) is run
+
+    # Started again otherwise
+    for key, inds, X_run in [('b', [0, 1, 2], X), ('a', [0, 2, 1], X), ('a', [0, 1], X), ('a', [0, 1, 2], X + 1)]:
+        run = told_three()
+        new_run = resident_run(runs, 0, key, inds, X_run, solve)
+        assert new_run is not run and new_run.told == []
+        assert not run.thread.is_alive()
+
+
+def test_error_in_optimizer():
+    def solve(objective):
+        objective(np.zeros(2))
+        raise ValueError('Bad step')
+
+    run = LocalOptRun(solve)
+    try:
+        run.tell(0, np.zeros(2), 1.0)
+    except OptimizerError as e:
+        assert isinstance(e.args[0], ValueError)
+        assert run.x is None
+    else:
+        assert 0, "Error in the optimizer wasn't raised"
+
+
+def test_run_pool():
+    # Runs advanced on a pool give the same points as runs advanced here
+    fun = lambda x: np.sum((x - 0.3)**2)
+    starts = np.random.uniform(0, 1, (5, 2))
+
+    def advance(H, run, run_order, runs):
+        if run == 4:
+            raise ValueError('Run 4 failed')
+        run_inds = run_order[run]
+        assert all(H['returned'][run_inds])
+        solve = lambda objective: compass_search(starts[run], objective)
+        local_run = resident_run(runs, run, 'a', run_inds, H['x_on_cube'], solve)
+        for ind in run_inds[len(local_run.told):]:
+            local_run.tell(ind, H['x_on_cube'][ind], fun(H['x_on_cube'][ind]))
+        return local_run.x
+
+    X = {}
+    for pool in [None, RunPool(2, lambda H, run, run_order: advance(H, run, run_order, pool_runs), pool_runs, ['x_on_cube','returned'])]:
+        H = np.zeros(100, dtype=[('x_on_cube',float,2),('returned',bool),('f',float)])
+        run_order = {}
+        for run in range(4):
+            H['x_on_cube'][run] = starts[run]
+            H['returned'][run] = True
+            run_order[run] = [run]
+        k = 4
+
+        for step in range(40):
+            # Runs whose last point isn't returned yet wait for it
+            runs = [run for run in run_order if H['returned'][run_order[run]].all()]
+            if pool is None:
+                x_new = [advance(H[:k], run, run_order, here_runs) for run in runs]
+            else:
+                x_new, new_order = pool.advance(H[:k], runs, run_order)
+                run_order.update(new_order)
+
+            # Points are returned a step after they are added (so the pool
+            # is sent them when added and again when returned)
+            H['returned'][:k] = True
+            for run, x_run in zip(runs, x_new):
+                if x_run is not None:
+                    H['x_on_cube'][k] = x_run
+                    run_order[run].append(k)
+                    k += 1
+
+        X[pool is None] = H['x_on_cube']
+
+    assert np.array_equal(X[True], X[False])
+
+    # Errors in a pool process are raised here (and close the pool)
+    run_order[4] = []
+    try:
+        pool.advance(H[:k], [0, 4], run_order)
+    except ValueError:
+        pass
+    else:
+        assert 0, "Error in pool process wasn't raised"
+    assert not pool.procs
+
+    # The processes end if the pool's ends of the pipes are closed (e.g., when
+    # its process dies)
+    pool = RunPool(2, lambda H, run, run_order: None, pool_runs, ['returned'])
+    for conn in pool.conns:
+        conn.close()
+    for proc in pool.procs:
+        proc.join(5)
+        assert not proc.is_alive()
+
+
+here_runs = {}
+pool_runs = {}
+
+
+if __name__ == "__main__":
+    test_run_asks_and_finishes()
+    test_resident_run()
+    test_error_in_optimizer()
+    test_run_pool()
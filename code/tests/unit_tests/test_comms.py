@@ -0,0 +1,228 @@
+import sys, time, os, threading, subprocess
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+
+from mpi4py import MPI
+from libE_comms import MPIComm, ResultReceiver, ManagerChannel, send_result, packed_dtype, pack_envelope, unpack_envelope, send_envelope, complete_envelope, ENVELOPE_SIZE
+from libE_local import LocalComm, mp
+from message_numbers import EVAL_SIM_TAG, EVAL_GEN_TAG, STOP_TAG
+
+out_dtypes = {EVAL_SIM_TAG: np.dtype([('f',float),('fvec',float,3)])}
+
+def test_receiver_batches_completions():
+    comm = MPI.COMM_SELF
+    receiver = ResultReceiver(comm, set([0]), out_dtypes)
+
+    # Nothing posted, so wait must not block
+    assert receiver.wait() == []
+
+    receiver.post(0)
+    O = np.zeros(2, dtype=out_dtypes[EVAL_SIM_TAG])
+    O['f'] = [1, 2]
+    O['fvec'][1] = [3, 4, 5]
+    send_result(MPIComm(comm), {'calc_out': O, 'gen_info': {}, 'libE_info': {'H_rows': [4,7]}}, EVAL_SIM_TAG, out_dtypes[EVAL_SIM_TAG])
+
+    received = receiver.wait()
+    assert len(received) == 1
+    w, tag, D = received[0]
+    assert w == 0 and tag == EVAL_SIM_TAG
+    assert np.array_equal(D['calc_out'], O)
+    assert D['libE_info']['H_rows'] == [4,7]
+
+    assert receiver.wakeups == 1 and receiver.completions == 1
+    assert receiver.completions_per_wakeup() == 1.0
+    assert receiver.num_posted == 0
+
+
+def test_receiver_pickles_unexpected_output():
+    comm = MPI.COMM_SELF
+    receiver = ResultReceiver(comm, set([0]), out_dtypes)
+
+    # Output without the fields of out_dtype can't be sent as a typed buffer
+    receiver.post(0)
+    send_result(MPIComm(comm), {'calc_out': np.arange(3), 'gen_info': {}, 'libE_info': {}}, EVAL_SIM_TAG, out_dtypes[EVAL_SIM_TAG])
+
+    w, tag, D = receiver.wait()[0]
+    assert np.array_equal(D['calc_out'], np.arange(3))
+
+
+def test_envelopes():
+    H = np.zeros(5, dtype=[('x',float,2),('given',bool),('f',float)])
+    H['x'] = np.arange(10).reshape(5,2)
+
+    dtype = packed_dtype(H.dtype, ['x','f'])
+    assert dtype.itemsize == 3*8
+
+    buf, rows = pack_envelope(EVAL_SIM_TAG, {'H_rows': [1,3]}, 2, dtype)
+    for field in dtype.names:
+        rows[field] = H[field][[1,3]]
+
+    meta, calc_in = unpack_envelope(buf, dtype)
+    assert meta == {'H_rows': [1,3]}
+    assert np.array_equal(calc_in['x'], [[2,3],[6,7]])
+
+    # No rows
+    buf, rows = pack_envelope(EVAL_SIM_TAG, 'meta')
+    assert rows is None
+    assert unpack_envelope(buf, dtype) == ('meta', None)
+
+
+def test_envelope_larger_than_receive_buffer():
+    comm = MPI.COMM_SELF
+    status = MPI.Status()
+    dtype = np.dtype([('x',np.uint8)])
+
+    num_rows = ENVELOPE_SIZE + 100
+    buf, rows = pack_envelope(EVAL_SIM_TAG, {}, num_rows, dtype)
+    rows['x'] = np.arange(num_rows)
+
+    recv_buf = np.empty(ENVELOPE_SIZE, dtype=np.uint8)
+    req = comm.Irecv([recv_buf, MPI.BYTE], source=0, tag=MPI.ANY_TAG)
+    send_envelope(comm, buf, 0, EVAL_SIM_TAG)
+    req.Wait(status)
+    msg = complete_envelope(comm, recv_buf, 0, status.Get_tag())
+
+    meta, calc_in = unpack_envelope(msg, dtype)
+    assert np.array_equal(calc_in['x'], rows['x'])
+
+
+def test_receiver_deadline():
+    comm = MPI.COMM_SELF
+    receiver = ResultReceiver(comm, set([0]), out_dtypes, deadline=time.time()+0.05)
+
+    receiver.post(0)
+    start = time.time()
+    assert receiver.wait() == []
+    assert time.time() - start < 1
+    assert receiver.wakeups == 0
+
+    receiver.cancel()
+    assert receiver.num_posted == 0
+
+
+def test_manager_channel():
+    comm = MPI.COMM_SELF
+    gen_out = np.dtype([('x',float,2)])
+    gen_in = np.dtype([('f',float)])
+    receiver = ResultReceiver(comm, set([0]), {EVAL_GEN_TAG: gen_out})
+    channel = ManagerChannel(MPIComm(comm), gen_in, gen_out, EVAL_GEN_TAG)
+
+    # Points sent by a persistent gen are marked as such
+    receiver.post(0)
+    O = np.ones(3, dtype=gen_out)
+    channel.send(O)
+    w, tag, D = receiver.wait()[0]
+    assert tag == EVAL_GEN_TAG and D['libE_info']['persistent']
+    assert np.array_equal(D['calc_out'], O)
+
+    buf, rows = pack_envelope(EVAL_GEN_TAG, {'libE_info': {'H_rows': [4]}, 'gen_info': {}}, 1, gen_in)
+    rows['f'] = 7
+    send_envelope(comm, buf, 0, EVAL_GEN_TAG)
+    tag, libE_info, calc_in = channel.recv()
+    assert tag == EVAL_GEN_TAG and libE_info['H_rows'] == [4] and calc_in['f'][0] == 7
+    assert not channel.stopped
+
+    buf, _ = pack_envelope(STOP_TAG, None)
+    send_envelope(comm, buf, 0, STOP_TAG)
+    assert channel.recv() == (STOP_TAG, None, None)
+    assert channel.stopped
+
+
+def test_manager_channel_sends_without_blocking():
+    # A gen's output longer than a receive buffer doesn't wait for the
+    # manager (which may be sending to the gen) to receive it
+    comm = MPI.COMM_SELF
+    gen_out = np.dtype([('x',float,2)])
+    mpi_comm = MPIComm(comm)
+    channel = ManagerChannel(mpi_comm, np.dtype([('f',float)]), gen_out, EVAL_GEN_TAG)
+
+    O = np.zeros(ENVELOPE_SIZE, dtype=gen_out)
+    O['x'] = np.arange(2*ENVELOPE_SIZE).reshape(-1,2)
+    channel.send(O)
+    O['x'] = 0
+
+    receiver = ResultReceiver(comm, set([0]), {EVAL_GEN_TAG: gen_out})
+    receiver.post(0)
+    w, tag, D = receiver.wait()[0]
+    assert np.array_equal(D['calc_out']['x'], np.arange(2*ENVELOPE_SIZE).reshape(-1,2))
+    mpi_comm.wait_sends()
+
+
+def test_local_comm():
+    a, b = mp.Pipe()
+    manager = LocalComm(0, 2, {1: a})
+    worker = LocalComm(1, 2, {0: b})
+    receiver = manager.result_receiver(set([1]), out_dtypes)
+
+    receiver.post(1)
+    O = np.ones(2, dtype=out_dtypes[EVAL_SIM_TAG])
+    send_result(worker, {'calc_out': O, 'gen_info': {}, 'libE_info': {'H_rows': [0,1]}}, EVAL_SIM_TAG, out_dtypes[EVAL_SIM_TAG])
+    w, tag, D = receiver.wait()[0]
+    assert w == 1 and tag == EVAL_SIM_TAG
+    assert np.array_equal(D['calc_out'], O)
+    assert receiver.num_posted == 0
+
+    # Envelopes longer than the receive buffer arrive whole, with their tag
+    dtype = np.dtype([('x',np.uint8)])
+    buf, rows = pack_envelope(EVAL_GEN_TAG, {}, ENVELOPE_SIZE + 100, dtype)
+    rows['x'] = np.arange(len(rows))
+    manager.send_envelope(buf, 1, EVAL_GEN_TAG)
+    msg, tag = worker.recv_envelope(np.empty(ENVELOPE_SIZE, dtype=np.uint8), 0)
+    assert tag == EVAL_GEN_TAG
+    assert np.array_equal(unpack_envelope(msg, dtype)[1]['x'], rows['x'])
+
+
+def test_local_comm_queued_sends():
+    # Queued envelopes (each larger than a pipe holds) don't block the
+    # manager while the worker, busy with earlier work, sends a large result
+    a, b = mp.Pipe()
+    manager = LocalComm(0, 2, {1: a})
+    worker = LocalComm(1, 2, {0: b})
+    dtype = np.dtype([('x',float)])
+
+    sent = []
+    for tag in [EVAL_SIM_TAG, EVAL_SIM_TAG, STOP_TAG]:
+        buf, rows = pack_envelope(tag, {}, 10**5, dtype)
+        rows['x'] = len(sent)
+        if tag == STOP_TAG:
+            manager.send_envelope(buf, 1, tag)
+        else:
+            manager.isend_envelope(buf, 1, tag)
+        sent.append(tag)
+
+    buf, _ = pack_envelope(EVAL_SIM_TAG, {}, 10**5, dtype)
+    result = threading.Thread(target=worker.send_envelope, args=(buf, 0, EVAL_SIM_TAG))
+    result.start()
+    msg, tag = manager.recv_envelope(np.empty(ENVELOPE_SIZE, dtype=np.uint8), 1)
+    result.join()
+    assert tag == EVAL_SIM_TAG and len(msg) == len(buf)
+
+    # The envelopes arrive in the order they were sent
+    for i, tag in enumerate(sent):
+        msg, recv_tag = worker.recv_envelope(np.empty(ENVELOPE_SIZE, dtype=np.uint8), 0)
+        assert recv_tag == tag
+        assert np.all(unpack_envelope(msg, dtype)[1]['x'] == i)
+    manager.wait_sends()
+
+
+def test_import_does_not_initialize_mpi():
+    # The local backend forks its workers, so importing libEnsemble must not
+    # initialize MPI (this process has, so a fresh one is checked)
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src')
+    code = "import sys; sys.path.insert(0, %r); import libE, libE_local; print(libE_local.mpi_initialized() or 'mpi4py.MPI' in sys.modules)" % src
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.strip() == b'False'
+
+
+if __name__ == "__main__":
+    test_receiver_batches_completions()
+    test_receiver_pickles_unexpected_output()
+    test_envelopes()
+    test_envelope_larger_than_receive_buffer()
+    test_receiver_deadline()
+    test_manager_channel()
+    test_manager_channel_sends_without_blocking()
+    test_local_comm()
+    test_local_comm_queued_sends()
+    test_import_does_not_initialize_mpi()
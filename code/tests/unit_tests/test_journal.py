@@ -0,0 +1,99 @@
+import sys, time, os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+
+import libE_manager as man
+from libE_journal import HistoryJournal, compact_journal
+from test_manager_main import make_criteria_and_specs_0
+
+al = {'worker_ranks':set([1,2]),'persist_gen_ranks':set([])}
+
+def test_journal_rebuilds_history(tmpdir):
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_0()
+    H0 = np.zeros(2, dtype=gen_specs['out'])
+    H0['x_on_cube'] = [-1, -2]
+    hist,_,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria, H0)
+
+    filename = str(tmpdir.join('journal.bin'))
+    hist.journal = HistoryJournal(filename, hist, sim_k=2, gen_k=None)
+
+    O = np.zeros(25, dtype=gen_specs['out'])
+    O['x_on_cube'] = np.arange(25)
+    hist.update_history_x_in(1, O)
+    hist.update_history_x_out(np.array([2,3,4]), 2)
+    hist.journal.checkpoint(hist)
+    assert len(hist.journal.changed) == 3  # Nothing returned yet
+
+    calc_out = np.zeros(3, dtype=sim_specs['out'])
+    calc_out['f'] = [5,6,7]
+    hist.update_history_f({'libE_info': {'H_rows': np.array([2,3,4])}, 'calc_out': calc_out})
+    hist.journal.checkpoint(hist)
+    assert len(hist.journal.changed) == 0
+
+    # Rows change again after being journaled
+    calc_out['f'] = [8,9,10]
+    hist.update_history_f({'libE_info': {'H_rows': np.array([2,3,4])}, 'calc_out': calc_out})
+    hist.journal.close(hist.H)
+
+    H = compact_journal(filename)
+    assert len(H) == hist.index
+    for field in H.dtype.names:
+        assert np.array_equal(H[field], hist.trim()[field])
+
+
+def test_journal_never_waits_for_writer(tmpdir):
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_0()
+    hist,_,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria, [])
+    hist.journal = HistoryJournal(str(tmpdir.join('journal.bin')), hist, gen_k=1)
+    hist.update_history_x_in(1, np.zeros(1, dtype=gen_specs['out']))
+
+    # With both buffers busy, the rows stay marked for the next checkpoint
+    busy = hist.journal.free
+    hist.journal.free = []
+    hist.journal.checkpoint(hist)
+    assert hist.journal.pending and len(hist.journal.changed) == 2
+
+    hist.journal.free = busy
+    hist.journal.checkpoint(hist)
+    assert not hist.journal.pending and len(hist.journal.changed) == 0
+    hist.journal.close(hist.H)
+
+
+def test_journal_records_queue_updates(tmpdir):
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_0()
+    filename = str(tmpdir.join('queue_journal.bin'))
+    sim_specs['save_every_k'] = 1
+    sim_specs['journal_file'] = filename
+
+    def pause_and_reprioritize(H, gen_specs, data):
+        H['paused'][1] = True
+        H['priority'][3] = 7
+        return H, data
+
+    gen_specs['queue_update_function'] = pause_and_reprioritize
+    hist,_,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria, [])
+
+    # More rows than H has capacity for, so H grows
+    hist.update_history_x_in(1, np.zeros(15, dtype=gen_specs['out']))
+    hist.journal.flush(hist.H)
+    assert len(hist.journal.changed) == 0
+
+    man.update_active_and_queue({}, set(), hist, gen_specs, {})
+    assert np.array_equal(np.unique(np.concatenate(hist.journal.changed)), [1,3])
+
+    # The same edits again change nothing
+    hist.journal.flush(hist.H)
+    man.update_active_and_queue({}, set(), hist, gen_specs, {})
+    assert len(hist.journal.changed) == 0
+    hist.journal.close(hist.H)
+
+    H = compact_journal(filename)
+    assert H['paused'][1] and H['priority'][3] == 7
+
+
+if __name__ == "__main__":
+    import py.path, tempfile
+    test_journal_rebuilds_history(py.path.local(tempfile.mkdtemp()))
+    test_journal_never_waits_for_writer(py.path.local(tempfile.mkdtemp()))
+    test_journal_records_queue_updates(py.path.local(tempfile.mkdtemp()))
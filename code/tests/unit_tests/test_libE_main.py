@@ -52,6 +52,20 @@ def test_checking_inputs():
     else:
         assert 0
 
+    # sim_specs['batch_efficiency'] must be in (0, 1)
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_0()
+    for e in [0, 1, 1.5]:
+        sim_specs['batch_efficiency'] = e
+        try: 
+            check_inputs({},al, sim_specs, gen_specs, {}, exit_criteria,[]) 
+        except AssertionError:
+            assert 1
+        else:
+            assert 0
+
+    sim_specs['batch_efficiency'] = 0.9
+    check_inputs({},al, sim_specs, gen_specs, {}, exit_criteria,[]) 
+
 def rmfield( a, *fieldnames_to_remove ):
         return a[ [ name for name in a.dtype.names if name not in fieldnames_to_remove ] ]
 
@@ -10,7 +10,32 @@ import libE_manager as man
 al = {'worker_ranks':set([1,2]),'persist_gen_ranks':set([])}
 
 def test_update_history_x_out():
-    assert True
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    H = hist.H
+
+    hist.update_history_x_out(np.array([2,5,7]), 3)
+    assert np.array_equal(np.nonzero(H['given'])[0], [2,5,7])
+    assert np.all(H['sim_rank'][[2,5,7]] == 3)
+
+    # All points in a dispatch share one given_time
+    assert len(np.unique(H['given_time'][[2,5,7]])) == 1
+    assert np.all(np.isinf(H['given_time'][~H['given']]))
+
+
+def test_update_history_f():
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_0()
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    H = hist.H
+
+    O = np.zeros(3, dtype=sim_specs['out'])
+    O['f'] = [1,2,3]
+    O['fvec'] = np.arange(9).reshape(3,3)
+
+    hist.update_history_f({'libE_info': {'H_rows': np.array([4,1,8])}, 'calc_out': O})
+    assert np.array_equal(H['f'][[4,1,8]], [1,2,3])
+    assert np.array_equal(H['fvec'][1], [3,4,5])
+    assert np.array_equal(np.nonzero(H['returned'])[0], [1,4,8])
 
 def make_criteria_and_specs_0():
     sim_specs={'sim_f': [np.linalg.norm], 'in':['x_on_cube'], 'out':[('f',float),('fvec',float,3)], }
@@ -31,55 +56,271 @@ def test_termination_test():
     # termination_test should be True when we want to stop
 
     sim_specs_0, gen_specs_0, exit_criteria_0 = make_criteria_and_specs_0()
-    H, H_ind, term_test,_,_ = man.initialize(sim_specs_0, gen_specs_0, al, exit_criteria_0,[]) 
-    assert not term_test(H, H_ind)
+    hist, term_test,_,_ = man.initialize(sim_specs_0, gen_specs_0, al, exit_criteria_0,[]) 
+    assert not term_test(hist.H, hist.index)
 
 
 
     # Shouldn't terminate
     sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
-    H, H_ind,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
-    assert not term_test(H, H_ind)
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    assert not term_test(hist.H, hist.index)
     # 
 
 
     # Terminate because we've found a good 'g' value
-    H, H_ind,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
-    H['g'][0] = -1
-    H_ind = 1
-    assert term_test(H, H_ind)
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    hist.update_history_x_in(1, np.zeros(2, dtype=gen_specs['out']))
+    O = np.zeros(2, dtype=sim_specs['out'])
+    O['g'] = [np.nan, 0]
+    hist.update_history_f({'libE_info': {'H_rows': np.array([0,1])}, 'calc_out': O})
+    assert not term_test()
+    O['g'] = [-1, 0]
+    hist.update_history_f({'libE_info': {'H_rows': np.array([0,1])}, 'calc_out': O})
+    assert term_test()
     # 
 
     
     # Terminate because everything has been given.
-    H, H_ind,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
-    H['given'] = np.ones
-    assert term_test(H, H_ind)
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    hist.update_history_x_out(np.arange(9), 1)
+    hist.update_history_x_out(np.arange(9), 1)
+    assert hist.given_count == 9
+    assert not term_test()
+    hist.update_history_x_out(np.array([9]), 1)
+    assert term_test()
     # 
     
 
     # Terminate because enough time has passed
     H0 = np.zeros(3,dtype=sim_specs['out'] + gen_specs['out'])
-    H, H_ind,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,H0) 
-    H_ind = 4
-    H['given_time'][0] = time.time()
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,H0) 
+    assert not term_test()
     time.sleep(0.5)
-    assert term_test(H, H_ind)
+    assert term_test() == 2
     # 
 
 
+    # Terminate because H0 already has a good 'g' value
+    H0['g'][1] = -2
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,H0) 
+    assert hist.given_count == hist.returned_count == 3
+    assert term_test() == 1
+
+
 def test_update_history_x_in():
 
-    # Don't take more points than there is space in history.
+    # Take more points than there is space in history.
     sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
-    H, H_ind,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    capacity = len(hist.H)
+
+    O = np.zeros(2*capacity+1, dtype=gen_specs['out'])
+    O['x'] = np.arange(len(O))
+
+    hist.update_history_x_in(1, O)
+    assert hist.index == len(O)
+    assert len(hist.H) >= len(O)
+    assert np.array_equal(hist.H['sim_id'][:hist.index], np.arange(len(O)))
+    assert np.array_equal(hist.H['x'][:hist.index], O['x'])
+    assert np.all(hist.H['gen_rank'][:hist.index] == 1)
+
+    # Spare rows are marked as not yet generated
+    assert np.all(hist.H['sim_id'][hist.index:] == -1)
+    assert np.all(np.isinf(hist.H['given_time'][hist.index:]))
+    assert len(hist.trim()) == len(O)
+
+
+def test_grow_H_is_amortized():
+    # Adding points one at a time only reallocates H when its capacity doubles
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+
+    reallocations = 0
+    for i in range(1000):
+        H = hist.H
+        hist.update_history_x_in(1, np.zeros(1, dtype=gen_specs['out']))
+        reallocations += H is not hist.H
+
+    assert hist.index == 1000
+    assert reallocations <= np.ceil(np.log2(1000/exit_criteria['sim_max']))
+
+
+def test_memmap_history(tmpdir):
+    # With H_file, H is mapped from a file and growing it keeps all rows
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
+    H_file = str(tmpdir.join('H.dat'))
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, dict(al, H_file=H_file), exit_criteria,[]) 
+    assert isinstance(hist.H, np.memmap)
+
+    O = np.zeros(3*len(hist.H), dtype=gen_specs['out'])
+    O['x'] = np.arange(len(O))
+    hist.update_history_x_in(1, O[:5])
+    hist.update_history_x_in(1, O[5:])
+
+    assert isinstance(hist.H, np.memmap)
+    assert os.path.getsize(H_file) == len(hist.H)*hist.H.dtype.itemsize
+    assert np.array_equal(hist.trim()['x'], O['x'])
+    assert np.all(hist.H['sim_id'][hist.index:] == -1)
+
+
+def test_shared_history(tmpdir):
+    # A worker mapping H_file reads rows and writes sim output in place
+    from libE_history import map_H, read_rows
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
+    H_file = str(tmpdir.join('H.dat'))
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, dict(al, H_file=H_file), exit_criteria,[]) 
+    H_shared = map_H(H_file, hist.H.dtype)
+
+    O = np.zeros(2*len(hist.H), dtype=gen_specs['out'])
+    O['x'] = np.arange(len(O))
+    hist.update_history_x_in(1, O)
+
+    # H has grown, so the worker maps it again
+    assert len(H_shared) < hist.index
+    H_shared = map_H(H_file, hist.H.dtype)
+    rows = np.array([3, hist.index-1])
+    calc_in = read_rows(H_shared, rows, man.packed_dtype(hist.H.dtype, sim_specs['in']))
+    assert np.array_equal(calc_in['x'], O['x'][rows])
+
+    hist.update_history_x_out(rows, 2)
+    H_shared['g'][rows] = [5, 6]
+    hist.update_history_f({'libE_info': {'H_rows': rows}})
+    assert np.array_equal(hist.H['g'][rows], [5, 6])
+    assert np.all(hist.H['returned'][rows]) and hist.returned_count == 2
+
+
+def test_memo():
+    # New points matching a given point get its output, or wait for it
+    sim_specs={'sim_f': [np.linalg.norm], 'in':['x'], 'out':[('g',float)], 'memo':True}
+    gen_specs={'gen_f': [np.random.uniform], 'in':[], 'out':[('x',float)], }
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, {'sim_max':10},[]) 
+    O = np.zeros(2, dtype=gen_specs['out'])
+    O['x'] = [1, 2]
+    hist.update_history_x_in(1, O)
+    hist.update_history_x_out(np.array([0, 1]), 2)
+    O2 = np.zeros(2, dtype=sim_specs['out'])
+    O2['g'] = [5, 6]
+    hist.update_history_f({'libE_info': {'H_rows': np.array([0])}, 'calc_out': O2[:1]})
+
+    # Row 2 (x=1) gets row 0's output. It counts as given, but not toward
+    # sim_max
+    O['x'] = [1, -0.0]
+    assert np.array_equal(hist.update_history_x_in(1, O), [2])
+    assert hist.H['g'][2] == 5 and hist.H['returned'][2]
+    assert hist.given_count == 3 and hist.returned_count == 2 and hist.given_max == 11
+
+    # Row 4 (x=2) waits for row 1, and gets its output when it returns. Row 5
+    # (x=0.0) is held for row 3 (x=-0.0), which hasn't been given out
+    O['x'] = [2, 0.0]
+    assert len(hist.update_history_x_in(1, O)) == 0
+    assert hist.H['given'][4] and not hist.H['given'][5]
+    assert np.array_equal(hist.ready.next(hist.H, 10), [3])
+    assert np.array_equal(hist.update_history_f({'libE_info': {'H_rows': np.array([1])}, 'calc_out': O2[1:]}), [4])
+    assert hist.H['g'][4] == 6 and hist.H['returned'][4]
+
+    # Row 5 waits for row 3 once it is given out
+    hist.update_history_x_out(np.array([3]), 2)
+    assert hist.H['given'][5] and hist.given_count == 6
+    assert np.array_equal(hist.update_history_f({'libE_info': {'H_rows': np.array([3])}, 'calc_out': O2[:1]}), [5])
+    assert hist.given_count == hist.returned_count == 6 and hist.given_max == 13
+
+    # Points sent again by sim_id are neither hits nor misses
+    O = np.zeros(2, dtype=gen_specs['out'] + [('sim_id',int)])
+    O['x'] = [3, 3]
+    O['sim_id'] = [6, 7]
+    hist.update_history_x_in(1, O)
+    hist.update_history_x_in(1, O[:1])
+    assert np.array_equal(hist.ready.next(hist.H, 10), [6])
+    assert hist.memo.hits == 4 and hist.memo.misses == 4
+
+
+def test_take_next():
+    # Rows are taken by priority (ties to the oldest) when H has a priority
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    O = np.zeros(5, dtype=gen_specs['out'])
+    O['priority'] = [1, 3, 2, 3, 0]
+    hist.update_history_x_in(1, O)
+
+    assert np.array_equal(hist.take_next(3), [1,3,2])
+    assert np.array_equal(hist.take_next(3), [0,4])
+    assert len(hist.take_next(3)) == 0
+
+def test_ready_rows():
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+    assert len(hist.ready.next(hist.H)) == 0
+
+    hist.update_history_x_in(1, np.zeros(200, dtype=gen_specs['out']))
+    assert np.array_equal(hist.ready.next(hist.H, 3), [0,1,2])
+
+    hist.update_history_x_out(np.arange(0,150), 2)
+    hist.H['paused'][[150,152]] = True
+    assert np.array_equal(hist.ready.next(hist.H, 2), [151,153])
+    assert hist.ready.head == 151
+    assert np.array_equal(np.nonzero(hist.ready.mask(hist.H, hist.index))[0], np.r_[151, 153:200])
+
+def test_unpaused_rows_are_ready_again():
+    def unpause(H, gen_specs, data):
+        H['paused'] = False
+        return H, data
+
+    for make_specs in [make_criteria_and_specs_0, make_criteria_and_specs_1]:
+        sim_specs, gen_specs, exit_criteria = make_specs()
+        gen_specs['queue_update_function'] = unpause
+        hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+        hist.update_history_x_in(1, np.zeros(4, dtype=gen_specs['out']))
+
+        # Paused rows are dropped when reached, as rows 0 and 1 are here
+        hist.H['paused'][[0,1]] = True
+        hist.update_queue_fields()
+        assert np.array_equal(hist.take_next(1), [2])
+
+        man.update_active_and_queue({}, set(), hist, gen_specs, {})
+        assert np.array_equal(hist.take_next(3), [0,1,3])
+
+
+def test_replica_delta():
+    from libE_worker import update_replica
+
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
+    H0 = np.zeros(2, dtype=gen_specs['out'])
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,H0) 
+
+    # Everything is sent to a worker the first time
+    assert np.array_equal(hist.replica_delta(1), [0,1])
+    assert np.array_equal(hist.replica_delta(2), [0,1])
+    assert len(hist.replica_delta(1)) == 0
+
+    O = np.zeros(20, dtype=gen_specs['out'])
+    O['x'] = np.arange(20)
+    hist.update_history_x_in(1, O)
+    hist.update_history_x_out(np.array([5]), 2)
+    rows_1 = hist.replica_delta(1)
+    assert np.array_equal(rows_1, np.arange(2,22))
+
+    calc_out = np.zeros(1, dtype=sim_specs['out'])
+    hist.update_history_f({'libE_info': {'H_rows': np.array([5])}, 'calc_out': calc_out})
+    assert np.array_equal(hist.replica_delta(1), [5])
+    assert np.array_equal(hist.replica_delta(2), np.arange(2,22))
 
-    O = np.zeros(2*len(H), dtype=gen_specs['out'])
-    print(len(O))
+    # The worker's replica matches H after applying the deltas
+    fields = ['x','given']
+    replica = np.zeros(0, dtype=[(f, hist.H.dtype[f]) for f in fields])
+    for rows in [np.arange(2), rows_1]:
+        replica = update_replica(replica, rows, hist.H[fields][rows], hist.index)
+    assert len(replica) >= hist.index
+    for f in fields:
+        assert np.array_equal(replica[f][:hist.index], hist.trim()[f])
 
-    H_ind = man.update_history_x_in(H, H_ind, 1, O)
+    # Rows a queue_update_function changes are sent again
+    def pause_row_7(H, gen_specs, data):
+        H['paused'][7] = True
+        return H, data
 
-    # assert H_ind == len(H)
+    man.update_active_and_queue({}, set(), hist, {'queue_update_function': pause_row_7}, {})
+    assert np.array_equal(hist.replica_delta(1), [7])
 
 
 # if __name__ == "__main__":
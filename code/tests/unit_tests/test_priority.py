@@ -0,0 +1,78 @@
+import sys, time, os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../examples/alloc_funcs'))
+
+import libE_manager as man
+from libE_priority import PriorityQueue
+from give_sim_work_first import give_sim_work_first
+from test_manager_main import make_criteria_and_specs_1
+
+al = {'alloc_f': give_sim_work_first, 'worker_ranks':set([1,2]),'persist_gen_ranks':set([])}
+
+def test_priority_queue_matches_argmax():
+    np.random.seed(0)
+    H = np.zeros(300, dtype=[('priority',float),('paused',bool)])
+    H['priority'] = np.random.randint(0,20,len(H))
+    ready = np.zeros(len(H), dtype=bool)
+
+    Q = PriorityQueue(100)
+    Q.grow(len(H))
+    for _ in range(200):
+        inds = np.random.choice(len(H), 5, replace=False)
+        op = np.random.randint(4)
+        if op == 0:
+            Q.add(inds, H['priority'][inds])
+            ready[inds] = True
+        elif op == 1:
+            Q.remove(inds)
+            ready[inds] = False
+        elif op == 2:
+            H['paused'][inds[0]] = True
+        else:
+            H['priority'][inds] = np.random.randint(0,20,len(inds))
+            inds = inds[ready[inds]]
+            Q.add(inds, H['priority'][inds])
+
+        q_inds_logical = np.logical_and(ready, ~H['paused'])
+        if not np.any(q_inds_logical):
+            assert Q.top(H) is None
+            continue
+
+        top = np.nonzero(q_inds_logical)[0][np.argmax(H['priority'][q_inds_logical])]
+        assert Q.top(H) == top
+
+        same = np.nonzero(np.logical_and(q_inds_logical, H['priority'] == H['priority'][top]))[0]
+        assert np.array_equal(Q.top_all(H), same)
+
+
+def test_give_all_with_same_priority():
+    sim_specs, gen_specs, exit_criteria = make_criteria_and_specs_1()
+    gen_specs['give_all_with_same_priority'] = True
+    hist,term_test,_,_ = man.initialize(sim_specs, gen_specs, al, exit_criteria,[]) 
+
+    O = np.zeros(6, dtype=gen_specs['out'])
+    O['priority'] = [1,3,2,3,3,0]
+    hist.update_history_x_in(3, O)
+    hist.H['paused'][4] = True
+
+    active_w = {man.EVAL_GEN_TAG:set(), man.EVAL_SIM_TAG:set(), 'blocked':set()}
+    Work, gen_info = al['alloc_f'](active_w, set([1,2]), hist, sim_specs, gen_specs, term_test, {})
+    assert np.array_equal(Work[1]['libE_info']['H_rows'], [1,3])
+    assert np.array_equal(Work[2]['libE_info']['H_rows'], [2])
+
+    # A queue_update_function changing priorities reorders the queue
+    def raise_priority(H, gen_specs, data):
+        H['priority'][5] = 5
+        return H, data
+
+    man.update_active_and_queue(active_w, set(), hist, {}, {})
+    assert hist.priority.top(hist.H) == 0
+    man.update_active_and_queue(active_w, set(), hist, {'queue_update_function': raise_priority}, {})
+    assert hist.priority.top(hist.H) == 5
+
+
+if __name__ == "__main__":
+    test_priority_queue_matches_argmax()
+    test_give_all_with_same_priority()
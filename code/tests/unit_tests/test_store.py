@@ -0,0 +1,45 @@
+import sys, time, os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src'))
+
+import libE_manager as man
+from libE_store import EvaluationStore
+
+al = {'worker_ranks':set([1,2]),'persist_gen_ranks':set([])}
+
+def run(store, x, evaluate):
+    # One run: the gen makes points x, and the points not found in the store
+    # are evaluated (with g = 10*x)
+    sim_specs={'sim_f': [np.linalg.norm], 'in':['x'], 'out':[('g',float)], 'store':store}
+    gen_specs={'gen_f': [np.random.uniform], 'in':[], 'out':[('x',float)], }
+    hist,_,_,_ = man.initialize(sim_specs, gen_specs, al, {'sim_max':10},[]) 
+    O = np.zeros(len(x), dtype=gen_specs['out'])
+    O['x'] = x
+    filled = hist.update_history_x_in(1, O)
+
+    rows = hist.ready.next(hist.H, len(x))
+    assert np.array_equal(hist.H['x'][rows], evaluate)
+    hist.update_history_x_out(rows, 2)
+    calc_out = np.zeros(len(rows), dtype=sim_specs['out'])
+    calc_out['g'] = 10*hist.H['x'][rows]
+    hist.update_history_f({'libE_info': {'H_rows': rows}, 'calc_out': calc_out})
+    hist.memo.store.close()
+
+    return hist, filled
+
+
+def test_store_across_runs(tmpdir):
+    store = {'file': str(tmpdir.join('evals.db')), 'version': 'v1', 'max_entries': 3}
+
+    run(store, [1, 2], [1, 2])
+    time.sleep(0.01)
+    hist, filled = run(store, [2, 3, 4], [3, 4])
+    assert np.array_equal(filled, [0]) and hist.H['g'][0] == 20
+    assert hist.memo.store_hits == 1
+
+    # The least recently used entry (x=1) was evicted
+    assert sorted(np.frombuffer(k, dtype=float)[0] for k in EvaluationStore(store['file'], 'v1', [('g',float)]).entries) == [2, 3, 4]
+
+    # Entries for another version aren't used
+    run(dict(store, version='v2'), [2], [2])